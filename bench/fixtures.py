@@ -0,0 +1,255 @@
+"""
+Generate a fixture set for the stand-in server.
+
+The layout mirrors the URL paths the stand-in serves, so recorded responses
+(see `bench/record.py`) can be dropped in place of the generated ones:
+
+    ea/stations.json                 EA /id/stations items
+    ea/measures.json                 EA /id/measures items
+    ea/readings/<measure>.json       EA /id/measures/<measure>/readings items
+    govuk/<page>.html                gov.uk guidance pages
+    metoffice/<type>.json            Met Office site-specific forecasts
+
+`generate_archive` writes sample EA daily archive files for `hcc.archive`:
+
+    ea/archive/readings-full-YYYY-MM-DD.csv
+"""
+
+import csv
+import json
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+EA_ROOT = "http://environment.data.gov.uk/flood-monitoring"
+
+# (label, notation, lat, long, parameters, river)
+STATIONS = [
+    ("Shepperton Lock", "3000TH", 51.3913, -0.4689, ["level"], "River Thames"),
+    ("Walton", "3100TH", 51.3892, -0.4215, ["level", "flow"], "River Thames"),
+    ("Sunbury Lock", "3200TH", 51.4048, -0.4038, ["level"], "River Thames"),
+    ("Molesey Lock", "3300TH", 51.4024, -0.3484, ["level"], "River Thames"),
+    ("Kingston", "3400TH", 51.4150, -0.3087, ["level", "flow"], "River Thames"),
+    ("Teddington Lock", "3500TH", 51.4309, -0.3240, ["level"], "River Thames"),
+    ("Richmond", "3600TH", 51.4613, -0.3074, ["level"], "Thames Tideway"),
+]
+
+WEATHER_CODES = [1, 3, 7, 8, 10, 12, 15]
+
+
+def _station(label, notation, lat, long, parameters, river):
+    measures = []
+    for parameter in parameters:
+        if parameter == "level":
+            measures.append((f"{notation}-level-stage-i-15_min-mASD", "level", "Stage"))
+            measures.append((f"{notation}-level-downstage-i-15_min-mASD", "level", "Downstream Stage"))
+        else:
+            measures.append((f"{notation}-flow--i-15_min-m3_s", "flow", ""))
+    return {
+        "@id": f"{EA_ROOT}/id/stations/{notation}",
+        "label": label,
+        "notation": notation,
+        "stationReference": notation,
+        "riverName": river,
+        "status": "http://environment.data.gov.uk/flood-monitoring/def/core/statusActive",
+        "lat": lat,
+        "long": long,
+        "measures": [
+            {"@id": f"{EA_ROOT}/id/measures/{m}", "parameter": p, "qualifier": q}
+            for m, p, q in measures
+        ],
+    }
+
+
+def _stations(n_extra):
+    stations = [_station(*s) for s in STATIONS]
+    # Filler stations upstream so the catalog has a realistic size
+    for i in range(n_extra):
+        stations.append(_station(f"Upstream Gauge {i:03d}", f"2{i:03d}TH",
+                                 51.45 + 0.001 * i, -1.8 + 0.012 * i,
+                                 ["level"], "River Thames"))
+    return stations
+
+
+def _readings(measure, end, days, step=timedelta(minutes=15)):
+    n = int(days * timedelta(days=1) / step)
+    phase = sum(map(ord, measure)) % 97
+    scale = 100.0 if "-flow-" in measure else 1.0
+    items = []
+    for i in range(n):
+        t = end - (n - 1 - i) * step
+        value = scale * (5 + math.sin(i / 400.0 + phase) + 0.05 * math.sin(i / 3.0))
+        stamp = t.strftime("%Y-%m-%dT%H:%M:%SZ")
+        items.append({
+            "@id": f"{EA_ROOT}/data/readings/{measure}/{stamp}",
+            "dateTime": stamp,
+            "measure": f"{EA_ROOT}/id/measures/{measure}",
+            "value": round(value, 3),
+        })
+    return items
+
+
+def _conditions_html(stations):
+    reaches = [s[0] for s in STATIONS if s[5] == "River Thames"]
+    rows = []
+    for i, (fm, to) in enumerate(zip(reaches, reaches[1:])):
+        condition = ["No stream warnings", "Yellow boards: stream increasing",
+                     "Red boards: strong stream"][i % 3]
+        rows.append(f"<tr><td>{fm} to {to}</td><td>{condition}</td></tr>")
+    table = ("<table><thead><tr><th>Reach</th><th>Current conditions</th></tr></thead>"
+             "<tbody>{}</tbody></table>")
+    return ("<html><body><h1>River Thames: current river conditions</h1>"
+            + table.format("".join(rows[: len(rows) // 2]))
+            + table.format("".join(rows[len(rows) // 2:]))
+            + "</body></html>")
+
+
+def _closures_html(n_rows):
+    places = ["Walton Bridge", "Sunbury Lock", "Molesey Lock", "Kingston Bridge",
+              "Teddington Lock", "Romney Lock", "Boveney Lock", "Marlow Lock"]
+    tables = []
+    for t in range(3):
+        rows = []
+        for i in range(n_rows):
+            where = places[(i + t) % len(places)]
+            rows.append(
+                f"<tr><td>{i % 28 + 1} November 2026</td><td>{where}</td>"
+                f"<td><a href=\"https://www.gov.uk/government/news/notice-{t}-{i}\">"
+                f"Notice {t}-{i}</a>: Lock closed for maintenance</td></tr>")
+        tables.append(
+            "<table><thead><tr><th>When</th><th>Where</th><th>What’s happening</th></tr></thead>"
+            f"<tbody>{''.join(rows)}</tbody></table>")
+    tables.append("<table><thead><tr><th>Lock</th><th>Telephone</th></tr></thead>"
+                  "<tbody><tr><td>Molesey</td><td>01234 567890</td></tr></tbody></table>")
+    return "<html><body><h1>River Thames: restrictions and closures</h1>" + "".join(tables) + "</body></html>"
+
+
+def _forecast(type, start):
+    step, n = {"hourly": (1, 49), "three-hourly": (3, 57), "daily": (24, 8)}[type]
+    series = []
+    for i in range(n):
+        t = start + timedelta(hours=step * i)
+        code = WEATHER_CODES[i % len(WEATHER_CODES)]
+        entry = {"time": t.strftime("%Y-%m-%dT%H:%MZ")}
+        if type == "daily":
+            entry.update({
+                "daySignificantWeatherCode": code,
+                "nightSignificantWeatherCode": WEATHER_CODES[(i + 3) % len(WEATHER_CODES)],
+                "dayMaxScreenTemperature": 14.0 + i % 5,
+                "nightMinScreenTemperature": 6.0 + i % 3,
+                "dayProbabilityOfPrecipitation": (10 * i) % 100,
+                "midday10MWindSpeed": 3.0 + 0.5 * i,
+            })
+        else:
+            entry.update({
+                "significantWeatherCode": code,
+                "screenTemperature": 10.0 + 5 * math.sin(i / 4.0),
+                "feelsLikeTemperature": 8.0 + 5 * math.sin(i / 4.0),
+                "windSpeed10m": 3.0 + (i % 7) * 0.4,
+                "windDirectionFrom10m": (i * 37) % 360,
+                "windGustSpeed10m": 6.0 + (i % 5),
+                "visibility": 20000 - 100 * i,
+                "screenRelativeHumidity": 70.0 + i % 20,
+                "mslp": 101300 + 10 * i,
+                "uvIndex": i % 4,
+                "precipitationRate": 0.1 * (i % 3),
+                "probOfPrecipitation": (7 * i) % 100,
+            })
+        series.append(entry)
+    return {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [-0.3379, 51.4034, 8.0]},
+            "properties": {"requestPointDistance": 120.5, "modelRunDate": start.strftime("%Y-%m-%dT%H:%MZ"),
+                           "timeSeries": series},
+        }],
+    }
+
+
+def generate(directory, days=28, extra_stations=90, closure_rows=30, now=None):
+    """Write a fixture set to `directory`
+
+    :param directory: target directory
+    :param days: days of 15 minute readings per measure (payload size)
+    :param extra_stations: filler stations added to the catalog
+    :param closure_rows: rows per table on the closures page
+    :param now: timestamp of the newest reading, by default now rounded to 15 min
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    now = now.replace(minute=now.minute - now.minute % 15, second=0, microsecond=0)
+
+    stations = _stations(extra_stations)
+    measures = []
+    for station in stations:
+        for m in station["measures"]:
+            notation = m["@id"].rsplit("/", 1)[-1]
+            measures.append(dict(m, station=station["@id"], notation=notation,
+                                 label=f"{station['label']} - {m['parameter']}"))
+
+    os.makedirs(os.path.join(directory, "ea", "readings"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "govuk"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "metoffice"), exist_ok=True)
+
+    def dump(path, obj):
+        with open(os.path.join(directory, path), "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+
+    dump("ea/stations.json", stations)
+    dump("ea/measures.json", measures)
+    for m in measures:
+        dump(f"ea/readings/{m['notation']}.json", _readings(m["notation"], now, days))
+
+    with open(os.path.join(directory, "govuk", "river-thames-current-river-conditions.html"), "w", encoding="utf-8") as f:
+        f.write(_conditions_html(stations))
+    with open(os.path.join(directory, "govuk", "river-thames-restrictions-and-closures.html"), "w", encoding="utf-8") as f:
+        f.write(_closures_html(closure_rows))
+
+    start = now.replace(minute=0)
+    for type in ["hourly", "three-hourly", "daily"]:
+        dump(f"metoffice/{type}.json", _forecast(type, start))
+    return directory
+
+
+def generate_archive(directory, start, days=7, other_measures=200):
+    """Write `days` of sample EA archive CSVs, one per day from `start`
+
+    Each file holds 15 minute readings for the fixture stations' measures
+    plus `other_measures` measures on other rivers, which ingest should
+    drop, and the columns of the real `readings-full` files.
+
+    :param directory: fixture directory; files go in `ea/archive`
+    :param start: first day, a `date`
+    :return: paths of the files written
+    """
+    measures = [m["@id"].rsplit("/", 1)[-1] for s in _stations(0) for m in s["measures"]]
+    measures += [f"E{i:05d}-level-stage-i-15_min-mASD" for i in range(other_measures)]
+    out = os.path.join(directory, "ea", "archive")
+    os.makedirs(out, exist_ok=True)
+    paths = []
+    step = timedelta(minutes=15)
+    for d in range(days):
+        day = datetime(start.year, start.month, start.day, tzinfo=timezone.utc) + timedelta(days=d)
+        path = os.path.join(out, f"readings-full-{day.date().isoformat()}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["dateTime", "date", "measure", "station", "label", "stationReference",
+                        "parameter", "qualifier", "datumType", "period", "unitName", "valueType", "value"])
+            for i in range(96):
+                t = day + i * step
+                stamp = t.strftime("%Y-%m-%dT%H:%M:%SZ")
+                n = int((t - datetime(2000, 1, 1, tzinfo=timezone.utc)) / step)
+                for m in measures:
+                    notation = m.split("-", 1)[0]
+                    parameter = "flow" if "-flow-" in m else "level"
+                    phase = sum(map(ord, m)) % 97
+                    scale = 100.0 if parameter == "flow" else 1.0
+                    value = round(scale * (5 + math.sin(n / 400.0 + phase)), 3)
+                    # The real files carry the odd reading with two values
+                    text = f"{value}|{value}" if i == 50 and notation == "E00000" else value
+                    w.writerow([stamp, stamp[:10], f"{EA_ROOT}/id/measures/{m}",
+                                f"{EA_ROOT}/id/stations/{notation}", notation, notation,
+                                parameter, "Stage", "", 900, "m", "instantaneous", text])
+        paths.append(path)
+    return paths
@@ -0,0 +1,75 @@
+"""
+Import-time regression check for hcc.
+
+Times `import hcc` in fresh interpreters and checks that it doesn't pull in
+the heavy dependencies, which should only load when a function needs them.
+
+    python -m bench.imports --runs 10 --max-ms 50
+
+Exits with status 1 if a heavy module is imported or the median import time
+is above `--max-ms`.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+HEAVY = ["pandas", "numpy", "plotly", "bs4", "astral", "pytz", "requests", "matplotlib", "lxml"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+heavy = sorted({{m.split('.')[0] for m in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def probe(module="hcc"):
+    """Import `module` in a fresh interpreter; return its import time and heavy modules"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    out = subprocess.run([sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY)],
+                         capture_output=True, text=True, check=True, env=env)
+    return json.loads(out.stdout)
+
+
+def measure(runs=5, module="hcc"):
+    """Import timings over several fresh interpreters"""
+    results = [probe(module) for _ in range(runs)]
+    times = [r["seconds"] for r in results]
+    return {
+        "module": module,
+        "runs": runs,
+        "p50_ms": float(np.percentile(times, 50)) * 1000,
+        "p95_ms": float(np.percentile(times, 95)) * 1000,
+        "heavy_modules": results[-1]["heavy"],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that `import hcc` stays cheap")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None, help="fail above this median import time")
+    args = parser.parse_args(argv)
+
+    result = measure(args.runs)
+    print(json.dumps(result, indent=2))
+
+    failed = False
+    if result["heavy_modules"]:
+        print(f"import hcc loaded heavy modules: {', '.join(result['heavy_modules'])}", file=sys.stderr)
+        failed = True
+    if args.max_ms is not None and result["p50_ms"] > args.max_ms:
+        print(f"import hcc took {result['p50_ms']:.1f} ms, above {args.max_ms} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Simulate `hcc.poller.Poller` against the stand-in with a simulated clock.
+
+    python -m bench.poll --hours 6 --workers 4
+
+Fixture readings are published a random delay after their `dateTime`
+(different for each measure). The poller runs on a `SimulatedClock` for
+`--hours`, so the run takes seconds. The output reports requests, readings
+delivered and how long after publication each reading reached the callback.
+"""
+
+import argparse
+import json
+import random
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import hcc.transport
+from bench.fixtures import generate
+from bench.standin import StandIn
+from hcc.poller import Poller, SimulatedClock
+
+
+def simulate(hours=6.0, workers=4, extra_stations=10, max_delay=600, seed=1):
+    """Run the poller for `hours` of simulated time and summarise it"""
+    rng = random.Random(seed)
+    end = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    end = end.replace(minute=end.minute - end.minute % 15)
+    start = end.timestamp() - hours * 3600
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, days=1 + hours / 24, extra_stations=extra_stations, now=end)
+        clock = SimulatedClock(start)
+        with StandIn(directory, clock=clock.time) as standin:
+            delays = {m: rng.uniform(30, max_delay) for m in standin.fixtures.readings}
+            standin.publish_delay = delays
+            hcc.transport.set_transport(standin.transport())
+
+            poller = Poller(max_workers=workers, clock=clock, seed=seed)
+            for measure in standin.fixtures.measures:
+                poller.track(measure["@id"])
+            latency = []
+
+            @poller.subscribe
+            def received(measure, df):
+                notation = measure.rsplit("/", 1)[-1]
+                published = df["dateTime"].astype("int64") / 1e9 + delays[notation]
+                # Skip the history fetched on the first poll
+                published = published[published >= start]
+                latency.extend(clock.time() - published)
+
+            standin.reset_stats()
+            poller.run(until=end.timestamp())
+            stats = standin.stats()
+
+    status = poller.status()
+    latency = np.asarray(latency)
+    return {
+        "hours": hours,
+        "measures": len(status),
+        "requests": stats["requests"],
+        "readings_delivered": int(len(latency)),
+        "requests_per_reading": stats["requests"] / max(len(latency), 1),
+        "delivery_seconds_p50": float(np.percentile(latency, 50)) if len(latency) else None,
+        "delivery_seconds_p95": float(np.percentile(latency, 95)) if len(latency) else None,
+        "delivery_seconds_max": float(latency.max()) if len(latency) else None,
+        "learnt_interval_seconds": float(status["interval"].dt.total_seconds().median()),
+        "lag_error_seconds_p95": float(np.percentile(
+            [abs(lag - delays[m.rsplit("/", 1)[-1]]) for m, lag in
+             zip(status["measure"], status["lag"].dt.total_seconds())], 95)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate the hcc poller against the stand-in")
+    parser.add_argument("--hours", type=float, default=6.0, help="simulated hours to run")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--stations", type=int, default=10, help="filler stations in the fixtures")
+    parser.add_argument("--max-delay", type=float, default=600, help="longest publication delay, seconds")
+    args = parser.parse_args(argv)
+    print(json.dumps(simulate(args.hours, args.workers, args.stations, args.max_delay), indent=2))
+
+
+if __name__ == "__main__":
+    main()
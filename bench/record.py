@@ -0,0 +1,76 @@
+"""
+Record live responses into a fixture directory for the stand-in server.
+
+    python -m bench.record fixtures/ --days 28
+
+Needs network access; the Met Office forecasts are only recorded when
+`MET_OFFICE_API_KEY` is available.
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import hcc.ea_rivers as ea_rivers
+import hcc.metoffice as metoffice
+import hcc.scrape as scrape
+from hcc.transport import get_transport
+
+RIVERS = ["River Thames", "Thames Tideway"]
+
+
+def record(directory, days=28, lat=51.4034, lon=-0.3379):
+    os.makedirs(os.path.join(directory, "ea", "readings"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "govuk"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "metoffice"), exist_ok=True)
+
+    def dump(path, obj):
+        with open(os.path.join(directory, path), "w", encoding="utf-8") as f:
+            json.dump(obj, f)
+
+    stations, measures = [], []
+    for river in RIVERS:
+        for parameter in ["level", "flow"]:
+            stations += ea_rivers.get_stations(river_name=river, parameter=parameter,
+                                               status="Active").to_dict("records")
+    stations = list({s["@id"]: s for s in stations}.values())
+    for station in stations:
+        measures += ea_rivers.get_measures(station=station["@id"]).to_dict("records")
+
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    for measure in measures:
+        readings = ea_rivers.get_readings_for_measure(measure["@id"], since=since,
+                                                      limit=ea_rivers.MAX_LIMIT, raw=True)
+        dump(f"ea/readings/{measure['notation']}.json", readings.to_dict("records"))
+
+    # Station tables can hold NaN for missing fields, which JSON can't
+    dump("ea/stations.json", json.loads(json.dumps(stations, default=str).replace("NaN", "null")))
+    dump("ea/measures.json", json.loads(json.dumps(measures, default=str).replace("NaN", "null")))
+
+    for url in [scrape.CONDITIONS_URL, scrape.CLOSURES_URL]:
+        name = url.rstrip("/").rsplit("/", 1)[-1]
+        with open(os.path.join(directory, "govuk", name + ".html"), "wb") as f:
+            f.write(get_transport().get(url).content)
+
+    try:
+        api_key = metoffice.get_api_key()
+    except ValueError:
+        print("No Met Office API key, skipping forecasts")
+    else:
+        for type in ["hourly", "three-hourly", "daily"]:
+            with open(os.path.join(directory, "metoffice", type + ".json"), "wb") as f:
+                f.write(metoffice._call_weather_api(lat, lon, type, api_key=api_key))
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record live responses as stand-in fixtures")
+    parser.add_argument("directory")
+    parser.add_argument("--days", type=int, default=28, help="days of readings to record per measure")
+    args = parser.parse_args(argv)
+    record(args.directory, days=args.days)
+
+
+if __name__ == "__main__":
+    main()
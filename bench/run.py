@@ -0,0 +1,183 @@
+"""
+Offline benchmarks for hcc.
+
+Starts the local stand-in server, points hcc at it and times the public
+functions. Results (p50/p95 latency, requests and bytes per run, peak Python
+memory) are written as JSON so they can be compared between commits.
+
+    python -m bench.run --runs 10 --latency 0.05 --output bench_output.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import hcc
+import hcc.cache
+import hcc.httpcache
+import hcc.metoffice
+import hcc.transport
+from bench.fixtures import generate
+from bench.imports import measure as measure_imports
+from bench.standin import StandIn
+
+HAMPTON_COURT = (51.4034, -0.3379)
+
+# Fixture directory in use, for scenarios that parse saved pages
+FIXTURES = None
+
+
+def _since():
+    return (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+
+
+def dashboard():
+    """Everything thames-river-levels-dashboard.qmd fetches"""
+    since = _since()
+    hcc.sunrise_times()
+    hcc.scrape_conditions()
+    hcc.plot_thames_level("Walton", parameter="flow", since=since)
+    hcc.plot_thames_level("Kingston", parameter="flow", since=since)
+    hcc.plot_thames_level("Sunbury", position="downstream", since=since)
+    hcc.plot_thames_level("Richmond", river_name="Thames Tideway", since=since)
+    hcc.scrape_river_closures()
+
+
+def parse_river_closures():
+    """Parse the saved closures page without any network"""
+    path = os.path.join(FIXTURES, "govuk", "river-thames-restrictions-and-closures.html")
+    with open(path, "rb") as f:
+        hcc.scrape_river_closures(html=f.read())
+
+
+SCENARIOS = {
+    "get_thames_metric": lambda: hcc.get_thames_metric("Walton", parameter="flow", since=_since()),
+    "plot_thames_level": lambda: hcc.plot_thames_level("Sunbury", position="downstream", since=_since()),
+    "scrape_conditions": lambda: hcc.scrape_conditions(),
+    "scrape_river_closures": lambda: hcc.scrape_river_closures(),
+    "parse_river_closures": parse_river_closures,
+    "get_weather": lambda: hcc.metoffice.get_weather(*HAMPTON_COURT, type="three-hourly", api_key="bench"),
+    "dashboard": dashboard,
+}
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def run_scenario(name, func, standin, runs, warm=False):
+    """Time one scenario against the stand-in"""
+    times, errors = [], []
+    standin.reset_stats()
+    for _ in range(runs):
+        if not warm:
+            hcc.cache.clear_all()
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            errors.append(repr(e))
+        times.append(time.perf_counter() - start)
+    stats = standin.stats()
+
+    # Peak memory in a separate run, since tracing slows everything down
+    if not warm:
+        hcc.cache.clear_all()
+    tracemalloc.start()
+    try:
+        func()
+    except Exception:
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "runs": runs,
+        "p50_ms": _percentile(times, 50) * 1000,
+        "p95_ms": _percentile(times, 95) * 1000,
+        "mean_ms": float(np.mean(times)) * 1000,
+        "requests_per_run": stats["requests"] / runs,
+        "not_modified_per_run": stats["not_modified"] / runs,
+        "bytes_per_run": stats["bytes"] / runs,
+        "requests_by_route": {k: v / runs for k, v in sorted(stats["by_route"].items())},
+        "peak_memory_bytes": peak,
+        "errors": errors[:3],
+        "n_errors": len(errors),
+    }
+
+
+def format_table(results):
+    """Format results as a plain text table"""
+    lines = [f"{'scenario':<24}{'p50 ms':>10}{'p95 ms':>10}{'req/run':>9}{'kB/run':>10}{'peak MB':>9}{'errors':>8}"]
+    for name, r in results.items():
+        lines.append(f"{name:<24}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['requests_per_run']:>9.1f}"
+                     f"{r['bytes_per_run'] / 1024:>10.1f}{r['peak_memory_bytes'] / 2**20:>9.1f}{r['n_errors']:>8}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="timed runs per scenario")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--days", type=int, default=28, help="days of readings per measure in generated fixtures")
+    parser.add_argument("--stations", type=int, default=90, help="filler stations in generated fixtures")
+    parser.add_argument("--closure-rows", type=int, default=30, help="rows per closures table in generated fixtures")
+    parser.add_argument("--fixtures", help="replay this fixture directory instead of generating one")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable), by default all")
+    parser.add_argument("--warm", action="store_true", help="keep hcc caches between runs")
+    parser.add_argument("--http-cache", action="store_true",
+                        help="use the on-disk HTTP cache, so repeat runs revalidate instead of downloading")
+    parser.add_argument("--max-age", type=int, default=None,
+                        help="Cache-Control max-age sent by the stand-in")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    global FIXTURES
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = args.fixtures or generate(os.path.join(tmp, "fixtures"), days=args.days,
+                                             extra_stations=args.stations,
+                                             closure_rows=args.closure_rows)
+        FIXTURES = fixtures
+        os.environ.setdefault("HCC_CACHE_DIR", os.path.join(tmp, "cache"))
+
+        http_cache = None
+        if args.http_cache:
+            http_cache = hcc.httpcache.HttpCache(os.path.join(tmp, "http"))
+
+        with StandIn(fixtures, latency=args.latency, max_age=args.max_age) as standin:
+            previous = hcc.transport.set_transport(standin.transport(cache=http_cache))
+            try:
+                results = {}
+                for name in args.scenario or list(SCENARIOS):
+                    results[name] = run_scenario(name, SCENARIOS[name], standin,
+                                                 runs=args.runs, warm=args.warm)
+            finally:
+                hcc.transport.set_transport(previous)
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output",)},
+        "import": measure_imports(runs=args.runs),
+        "scenarios": results,
+    }
+    print(format_table(results), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
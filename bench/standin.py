@@ -0,0 +1,266 @@
+"""
+Local stand-in for the EA flood monitoring API, gov.uk and the Met Office.
+
+Serves a fixture directory (see `bench/fixtures.py`) over HTTP with optional
+added latency, and counts requests and bytes so benchmarks can report them.
+Point hcc at it with `StandIn.transport()`, which rewrites the real hosts to
+the local server.
+"""
+
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from hcc.transport import Transport
+
+
+def _iso(value):
+    """Normalise an EA style date or date time to "YYYY-MM-DDTHH:MM:SSZ" """
+    value = value.strip().replace(" ", "T").replace("Z", "+00:00")
+    t = datetime.fromisoformat(value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _last(path):
+    return path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class Fixtures:
+    """Fixture files loaded into memory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "ea", "stations.json"), encoding="utf-8") as f:
+            self.stations = json.load(f)
+        with open(os.path.join(directory, "ea", "measures.json"), encoding="utf-8") as f:
+            self.measures = json.load(f)
+        self.readings = {}
+        readings_dir = os.path.join(directory, "ea", "readings")
+        for name in os.listdir(readings_dir):
+            with open(os.path.join(readings_dir, name), encoding="utf-8") as f:
+                items = json.load(f)
+            self.readings[name[:-len(".json")]] = sorted(items, key=lambda r: r["dateTime"])
+
+    def file(self, *parts):
+        path = os.path.join(self.directory, *parts)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def _filter_readings(items, q, default_limit=500):
+    if "since" in q:
+        since = _iso(q["since"][0])
+        items = [r for r in items if r["dateTime"] > since]
+    if "date" in q:
+        day = q["date"][0]
+        items = [r for r in items if r["dateTime"].startswith(day)]
+    if "startdate" in q:
+        start = q["startdate"][0]
+        items = [r for r in items if r["dateTime"][:10] >= start]
+    if "enddate" in q:
+        end = q["enddate"][0]
+        items = [r for r in items if r["dateTime"][:10] <= end]
+    if "latest" in q:
+        items = items[-1:]
+    if "_sorted" in q:
+        items = items[::-1]
+    limit = int(q.get("_limit", [default_limit])[0])
+    return items[:limit]
+
+
+class StandIn:
+    """Threaded HTTP server replaying fixtures
+
+    :param fixtures: fixture directory
+    :param latency: seconds added to every response
+    :param port: port to listen on, by default any free port
+    :param gzip: compress responses when the client accepts gzip
+    :param validators: send `ETag` and `Last-Modified` headers and answer
+        matching conditional requests with `304 Not Modified`
+    :param max_age: `Cache-Control: max-age` to send, if any
+    :param clock: a function returning the current time in seconds since the
+        epoch. When given, readings are only served once they are published,
+        `publish_delay` seconds after their `dateTime`.
+    :param publish_delay: seconds from `dateTime` to publication for each
+        measure notation, 0 for measures not listed
+    """
+
+    def __init__(self, fixtures, latency=0.0, port=0, gzip=True, validators=True, max_age=None,
+                 clock=None, publish_delay=None):
+        self.fixtures = Fixtures(fixtures)
+        self.clock = clock
+        self.publish_delay = dict(publish_delay or {})
+        self.latency = latency
+        self.gzip = gzip
+        self.validators = validators
+        self.max_age = max_age
+        self.last_modified = formatdate(time.time(), usegmt=True)
+        self.lock = threading.Lock()
+        self.reset_stats()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = None
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.not_modified = 0
+            self.by_route = {}
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "bytes": self.bytes_sent,
+                    "not_modified": self.not_modified, "by_route": dict(self.by_route)}
+
+    def transport(self, **kwargs):
+        """A `Transport` that sends every hcc host to this server"""
+        return Transport(rewrite={
+            "https://environment.data.gov.uk": self.url + "/ea",
+            "http://environment.data.gov.uk": self.url + "/ea",
+            "https://www.gov.uk": self.url + "/govuk",
+            "https://data.hub.api.metoffice.gov.uk": self.url + "/metoffice",
+        }, **kwargs)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def published(self, measure):
+        """Readings of a measure published by now, oldest first"""
+        readings = self.fixtures.readings[measure]
+        if self.clock is None:
+            return readings
+        cutoff = datetime.fromtimestamp(self.clock() - self.publish_delay.get(measure, 0), timezone.utc)
+        cutoff = cutoff.strftime("%Y-%m-%dT%H:%M:%SZ")
+        return readings[:bisect.bisect_right([r["dateTime"] for r in readings], cutoff)]
+
+    def route(self, path, q):
+        """Return `(route, status, content type, body)` for a request"""
+        fx = self.fixtures
+        if path.startswith("/ea/flood-monitoring"):
+            path = path[len("/ea/flood-monitoring"):]
+            if path == "/id/stations":
+                items = fx.stations
+                if "riverName" in q:
+                    items = [s for s in items if s.get("riverName") == q["riverName"][0]]
+                if "parameter" in q:
+                    items = [s for s in items
+                             if any(m["parameter"] == q["parameter"][0] for m in s["measures"])]
+                if "label" in q:
+                    items = [s for s in items if s["label"] == q["label"][0]]
+                if "search" in q:
+                    items = [s for s in items if q["search"][0] in s["label"]]
+                return "ea/stations", 200, "application/json", {"items": items}
+            if path == "/id/measures":
+                items = fx.measures
+                if "station" in q:
+                    items = [m for m in items if _last(m["station"]) == _last(q["station"][0])]
+                if "parameter" in q:
+                    items = [m for m in items if m["parameter"] == q["parameter"][0]]
+                return "ea/measures", 200, "application/json", {"items": items}
+            if path.startswith("/id/measures/") and path.endswith("/readings"):
+                measure = path[len("/id/measures/"):-len("/readings")]
+                if measure not in fx.readings:
+                    return "ea/readings", 404, "application/json", {"items": []}
+                return "ea/readings", 200, "application/json", {
+                    "items": _filter_readings(self.published(measure), q)}
+            if path.startswith("/archive/"):
+                body = fx.file("ea", "archive", _last(path))
+                if body is not None:
+                    return "ea/archive", 200, "text/csv", body
+                return "ea/archive", 404, "text/plain", b"not found"
+            if path == "/data/readings":
+                params = {m["notation"]: m["parameter"] for m in fx.measures}
+                stations = {m["notation"]: _last(m["station"]) for m in fx.measures}
+                items = []
+                for measure in fx.readings:
+                    if "parameter" in q and params.get(measure) != q["parameter"][0]:
+                        continue
+                    if "stationReference" in q and stations.get(measure) != q["stationReference"][0]:
+                        continue
+                    items.extend(_filter_readings(self.published(measure), {k: v for k, v in q.items() if k != "_limit"},
+                                                  default_limit=10**9))
+                limit = int(q.get("_limit", [10**9])[0])
+                return "ea/data-readings", 200, "application/json", {"items": items[:limit]}
+        elif path.startswith("/govuk/"):
+            body = fx.file("govuk", _last(path) + ".html")
+            if body is not None:
+                return "govuk/" + _last(path), 200, "text/html; charset=utf-8", body
+        elif path.startswith("/metoffice/sitespecific/v0/point/"):
+            body = fx.file("metoffice", _last(path) + ".json")
+            if body is not None:
+                return "metoffice/" + _last(path), 200, "application/json", body
+        return "not-found", 404, "text/plain", b"not found"
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; without this each
+            # keep-alive response waits on the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if standin.latency:
+                    time.sleep(standin.latency)
+                url = urlparse(self.path)
+                q = parse_qs(url.query, keep_blank_values=True)
+                route, status, content_type, body = standin.route(url.path, q)
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                headers = {"Content-Type": content_type}
+                if standin.max_age is not None:
+                    headers["Cache-Control"] = f"max-age={standin.max_age}"
+                if standin.validators and status == 200:
+                    etag = '"' + hashlib.md5(body).hexdigest() + '"'
+                    headers["ETag"] = etag
+                    headers["Last-Modified"] = standin.last_modified
+                    if self.headers.get("If-None-Match") == etag:
+                        status, body = 304, b""
+                if status != 304 and standin.gzip and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=5)
+                    headers["Content-Encoding"] = "gzip"
+                headers["Content-Length"] = str(len(body))
+
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+                with standin.lock:
+                    standin.requests += 1
+                    standin.bytes_sent += len(body)
+                    standin.not_modified += status == 304
+                    standin.by_route[route] = standin.by_route.get(route, 0) + 1
+
+        return Handler
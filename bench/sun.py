@@ -0,0 +1,89 @@
+"""
+Check `hcc.sunrise.sun_times` against astral and time both.
+
+    python -m bench.sun --year 2026 --max-seconds 5
+
+Computes every event for a year at a few sites, compares each time with
+astral's, and exits with status 1 if any differs by more than
+`--max-seconds`. Days when astral finds no event (polar day or night) are
+skipped.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# name: (lat, lon, time zone)
+SITES = {
+    "Hampton Court": (51.4034, -0.3379, "Europe/London"),
+    "Oxford": (51.7520, -1.2577, "Europe/London"),
+    "Lechlade": (51.6930, -1.6910, "Europe/London"),
+    "Quito": (-0.1800, -78.4700, "America/Guayaquil"),
+    "Sydney": (-33.8700, 151.2100, "Australia/Sydney"),
+}
+
+
+def compare(year=2026, sites=SITES):
+    """Largest differences in seconds between hcc and astral, with timings"""
+    from zoneinfo import ZoneInfo
+
+    import astral
+    from astral.sun import sun
+
+    import hcc.sunrise
+
+    dates = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq="D")
+    hcc.sunrise._year_cache.clear()
+    start = time.perf_counter()
+    df = hcc.sunrise.sun_times(dates, {name: site[:2] for name, site in sites.items()}, tz="UTC")
+    hcc_seconds = time.perf_counter() - start
+
+    # astral's dates are local dates when given the local time zone
+    start = time.perf_counter()
+    reference = {}
+    for name, (lat, lon, tz) in sites.items():
+        observer = astral.Observer(lat, lon)
+        for day in dates.date:
+            try:
+                s = sun(observer, day, tzinfo=ZoneInfo(tz))
+            except ValueError:
+                continue
+            for event in hcc.sunrise.EVENTS:
+                reference[(name, day, event)] = pd.Timestamp(s[event])
+    astral_seconds = time.perf_counter() - start
+
+    diffs = {}
+    for row in df.dropna(subset=["time"]).itertuples():
+        expected = reference.get((row.location, row.date, row.event))
+        if expected is not None:
+            diffs.setdefault(row.event, []).append(abs((row.time - expected).total_seconds()))
+    return {
+        "year": year,
+        "sites": list(sites),
+        "events_compared": sum(len(v) for v in diffs.values()),
+        "max_seconds": {k: float(np.max(v)) for k, v in diffs.items()},
+        "hcc_ms": hcc_seconds * 1000,
+        "astral_ms": astral_seconds * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check hcc sun times against astral")
+    parser.add_argument("--year", type=int, default=2026)
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="fail above this difference")
+    args = parser.parse_args(argv)
+
+    result = compare(args.year)
+    print(json.dumps(result, indent=2))
+    worst = max(result["max_seconds"].values())
+    if worst > args.max_seconds:
+        print(f"sun times differ from astral by up to {worst:.1f} s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,45 @@
 __version__ = '0.1.0'
-from .core import find_local
-from .core import plot_thames_level, lookup_thames_station_name, get_thames_metric
-from .scrape import scrape_conditions, scrape_river_closures
-from .sunrise import sunrise_times
-# from .earivers import get_stations, get_measures, get_readings_for_measure, get_ea_measures
 
-from . import ea_rivers
\ No newline at end of file
+# Public names are imported on first use, so `import hcc` stays cheap and
+# pandas, plotly, requests, astral and lxml only load when needed.
+import importlib
+
+_lazy_names = {
+    "find_local": "core",
+    "plot_thames_level": "core",
+    "lookup_thames_station_name": "core",
+    "lookup_thames_station": "core",
+    "get_thames_metric": "core",
+    "get_thames_metrics": "core",
+    "get_thames_panel": "core",
+    "get_river_snapshot": "core",
+    "river_state": "rolling",
+    "scrape_conditions": "scrape",
+    "scrape_river_closures": "scrape",
+    "sun_times": "sunrise",
+    "sunrise_times": "sunrise",
+    "travel_times": "travel",
+}
+
+_lazy_modules = {
+    "align", "archive", "cache", "core", "downsample", "ea_rivers", "httpcache", "instrument",
+    "locality", "metoffice", "poller", "ringstore", "rolling", "scrape", "snapshot", "store", "sunrise",
+    "transport", "travel",
+}
+
+__all__ = sorted(_lazy_names)
+
+
+def __getattr__(name):
+    if name in _lazy_names:
+        module = importlib.import_module("." + _lazy_names[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if name in _lazy_modules:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names) | _lazy_modules)
@@ -0,0 +1,156 @@
+"""
+Alignment of several reading series onto one regular time grid.
+
+Stations report every 15 minutes, but not all at the same second, and some
+miss readings. `align` snaps every series to the nearest point of one
+`date_range` grid in a single vectorized pass over all the readings, and
+fills short gaps by interpolation or by carrying the last value forward.
+"""
+
+from typing import Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+from hcc.ea_rivers import utc_ns
+
+FILL_METHODS = (None, "interpolate", "ffill")
+
+
+def _steps(limit, step: int) -> Optional[int]:
+    """A gap limit as a number of grid steps; `limit` is a count or a duration"""
+    if limit is None:
+        return None
+    if isinstance(limit, (int, np.integer)):
+        return int(limit)
+    return int(pd.Timedelta(limit).value // step)
+
+
+def fill_gaps(values: np.ndarray, method: Optional[str] = "interpolate", limit = None) -> np.ndarray:
+    """Fill the missing values of each column of a 2-D array
+
+    A gap is only filled when it is at most `limit` values long, so a long
+    outage stays visible instead of being bridged by a straight line. Gaps at
+    the start are never filled, and neither are gaps at the end when
+    interpolating.
+
+    :param values: 2-D float array, one series per column, on a regular grid
+    :param method: "interpolate" (linear), "ffill" or None
+    :param limit: longest gap to fill, in values; None for any length
+    :return: a new array
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(f"method must be one of {FILL_METHODS}")
+    values = np.array(values, dtype = np.float64)
+    if method is None:
+        return values
+    n = values.shape[0]
+    valid = ~np.isnan(values)
+    rows = np.arange(n)[:, None]
+
+    # Row of the previous and next valid value at every position, or -1 / n
+    previous = np.maximum.accumulate(np.where(valid, rows, -1), axis = 0)
+    following = np.minimum.accumulate(np.where(valid, rows, n)[::-1], axis = 0)[::-1]
+
+    gap = following - previous - 1
+    fill = ~valid & (previous >= 0)
+    if method == "interpolate":
+        fill &= following < n
+    else:
+        # The length of a trailing gap is how far it runs to the end
+        gap = np.where(following < n, gap, n - previous - 1)
+    if limit is not None:
+        fill &= gap <= limit
+
+    cols = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+    r, c = np.nonzero(fill)
+    before = values[previous[r, c], cols[r, c]]
+    if method == "interpolate":
+        after = values[following[r, c], cols[r, c]]
+        weight = (r - previous[r, c]) / (following[r, c] - previous[r, c])
+        values[r, c] = before + (after - before) * weight
+    else:
+        values[r, c] = before
+    return values
+
+
+def align(series: Mapping[str, pd.DataFrame],
+          freq = "15min",
+          start = None,
+          end = None,
+          tolerance = None,
+          fill: Optional[str] = None,
+          limit = None) -> pd.DataFrame:
+    """Align several reading series onto one time grid
+
+    Each reading goes to the nearest grid time within `tolerance`; where
+    several readings of a series land on one grid time, the closest wins.
+
+    :param series: mapping of column name to a frame with `dateTime` and `value`
+    :param freq: grid spacing
+    :param start: first grid time (rounded up to the grid), by default the
+        grid time nearest the earliest reading
+    :param end: last grid time (rounded down to the grid), by default the
+        grid time nearest the latest reading
+    :param tolerance: furthest a reading may be from its grid time, by
+        default half of `freq`
+    :param fill: how to fill gaps: None, "interpolate" or "ffill"
+    :param limit: longest gap to fill, as a number of grid steps or a
+        duration such as "2h"; None fills gaps of any length
+    :return: a wide frame of floats indexed by the UTC grid times, one column
+        per series
+    """
+    step = pd.Timedelta(freq).value
+    names = list(series)
+
+    # Every reading of every series, flattened into three arrays
+    times, values, columns = [], [], []
+    for i, name in enumerate(names):
+        df = series[name]
+        if df is None or not len(df):
+            continue
+        t = pd.to_datetime(df["dateTime"], utc = True).to_numpy(dtype = "datetime64[ns]").view(np.int64)
+        times.append(t)
+        values.append(pd.to_numeric(df["value"], errors = "coerce").to_numpy(dtype = np.float64))
+        columns.append(np.full(len(t), i, dtype = np.int64))
+    times = np.concatenate(times) if times else np.empty(0, dtype = np.int64)
+    values = np.concatenate(values) if values else np.empty(0)
+    columns = np.concatenate(columns) if columns else np.empty(0, dtype = np.int64)
+    keep = ~np.isnan(values)
+    times, values, columns = times[keep], values[keep], columns[keep]
+
+    if start is None:
+        start = (times.min() + step // 2) // step * step if len(times) else None
+    else:
+        start = -(-utc_ns(start) // step) * step
+    if end is None:
+        end = (times.max() + step // 2) // step * step if len(times) else None
+    else:
+        end = utc_ns(end) // step * step
+    if start is None or end is None or end < start:
+        index = pd.DatetimeIndex([], tz = "UTC", name = "dateTime")
+        return pd.DataFrame(np.empty((0, len(names))), index = index, columns = names)
+
+    n = (end - start) // step + 1
+    tolerance = step // 2 if tolerance is None else pd.Timedelta(tolerance).value
+    offset = times - start
+    cell = np.floor_divide(offset + step // 2, step)
+    distance = np.abs(offset - cell * step)
+    ok = (cell >= 0) & (cell < n) & (distance <= tolerance)
+    cell, distance, values, columns = cell[ok], distance[ok], values[ok], columns[ok]
+
+    # The closest reading to each grid time wins: sort by slot, then distance
+    slot = cell * len(names) + columns
+    order = np.lexsort((distance, slot))
+    slot, values = slot[order], values[order]
+    first = np.ones(len(slot), dtype = bool)
+    first[1:] = slot[1:] != slot[:-1]
+
+    grid = np.full(n * len(names), np.nan)
+    grid[slot[first]] = values[first]
+    grid = grid.reshape(n, len(names))
+    if fill is not None:
+        grid = fill_gaps(grid, fill, _steps(limit, step))
+
+    index = pd.DatetimeIndex(pd.to_datetime(start + np.arange(n) * step, utc = True), name = "dateTime")
+    return pd.DataFrame(grid, index = index, columns = names)
@@ -0,0 +1,394 @@
+"""
+Historic EA readings from the daily archive files.
+
+The flood monitoring API only keeps about four weeks of readings. For
+longer histories the EA publishes one CSV a day of every reading from every
+station (`/archive/readings-full-YYYY-MM-DD.csv`). `Archive.ingest` streams
+those files in chunks, keeps only the measures of one river and writes each
+day to a Parquet file partitioned by year and month:
+
+    <root>/readings/year=2024/month=01/2024-01-31.parquet
+
+Days already ingested are recorded in `<root>/ingested.json` and skipped, so
+an interrupted run picks up where it stopped, and re-ingesting a day
+replaces its file. `Archive.read` opens only the files for the days asked
+for, memory-mapped, and reads only the columns asked for.
+
+    python -m hcc.archive 2024-01-01 2024-12-31
+    python -m hcc.archive 2024-01-01 2024-01-31 --source sample_archive/
+
+or from Python:
+
+    archive = hcc.archive.Archive()
+    archive.ingest("2024-01-01", "2024-12-31")
+    df = archive.read(measures, start = "2024-01-01", end = "2024-03-01")
+
+Requires pyarrow.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from hcc.cache import cache_dir
+from hcc.ea_rivers import API_ROOT, measure_key, utc_timestamp
+
+ARCHIVE_URL = API_ROOT + "/archive/readings-full-{day}.csv"
+
+# Rows parsed at a time; a day of the full archive is several million rows
+CHUNK_ROWS = 250_000
+
+COLUMNS = ["dateTime", "measure", "value"]
+
+_MEASURE_ROOT = "http://environment.data.gov.uk/flood-monitoring/id/measures"
+
+DayLike = Union[date, str, pd.Timestamp]
+
+
+def _as_date(value: DayLike) -> date:
+    return pd.Timestamp(value).date()
+
+
+def _days(start: DayLike, end: DayLike) -> List[date]:
+    return [d.date() for d in pd.date_range(_as_date(start), _as_date(end), freq = "D")]
+
+
+def _fingerprint(keys: Iterable[str]) -> str:
+    return hashlib.sha1("\n".join(sorted(keys)).encode("utf-8")).hexdigest()[:16]
+
+
+def river_measures(river_name: str = "River Thames",
+                   parameters: Sequence[str] = ("level", "flow")) -> List[str]:
+    """Measure ids of every station on a river, from the station catalog
+
+    :param river_name: name of the river
+    :param parameters: parameters to keep, matched against the measure id
+    """
+    import hcc.core as core
+
+    return [m for record in core.get_station_index(river_name).records for m in record.measures
+            if any(f"-{p}-" in m for p in parameters)]
+
+
+def _empty() -> pd.DataFrame:
+    return pd.DataFrame({
+        "dateTime": pd.DatetimeIndex([], tz = "UTC"),
+        "measure": pd.Categorical([]),
+        "value": np.array([], dtype = np.float64),
+    })
+
+
+def read_archive_csv(source, measures: Iterable[str], chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+    """Read the readings of some measures from one archive CSV
+
+    The file is parsed `chunksize` rows at a time and each chunk is filtered
+    before the next is read, so memory use follows the rows kept rather
+    than the size of the file.
+
+    :param source: a path (optionally `.gz`) or a file-like object
+    :param measures: measure ids (URIs or notations) to keep
+    :param chunksize: rows parsed at a time
+    :return: a data frame with `dateTime` (UTC), `measure` and `value`,
+        oldest first
+    """
+    keys = {measure_key(m) for m in measures}
+    parts = []
+    reader = pd.read_csv(source, usecols = COLUMNS, chunksize = chunksize,
+                         dtype = {"dateTime": str, "measure": "category", "value": str})
+    with reader:
+        for chunk in reader:
+            # A day has a few thousand distinct measures, so test each once
+            measure = chunk["measure"]
+            wanted = np.fromiter((measure_key(c) in keys for c in measure.cat.categories),
+                                 dtype = bool, count = len(measure.cat.categories))
+            codes = measure.cat.codes.to_numpy()
+            mask = (codes >= 0) & wanted[np.maximum(codes, 0)]
+            if mask.any():
+                kept = chunk[mask]
+                parts.append(pd.DataFrame({
+                    "dateTime": kept["dateTime"].to_numpy(),
+                    "measure": kept["measure"].astype(str).to_numpy(),
+                    # A few readings hold two values joined by "|"; they are dropped
+                    "value": pd.to_numeric(kept["value"], errors = "coerce").to_numpy(),
+                }))
+
+    if not parts:
+        return _empty()
+    df = pd.concat(parts, ignore_index = True)
+    df["dateTime"] = pd.to_datetime(df["dateTime"], utc = True, format = "ISO8601")
+    df["measure"] = df["measure"].astype("category")
+    return df.sort_values(["dateTime", "measure"], kind = "stable").reset_index(drop = True)
+
+
+class Archive:
+    """Partitioned Parquet store of readings ingested from the EA archive
+
+    :param root: directory of the store, by default `<cache dir>/archive`
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.path.join(cache_dir(), "archive")
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Archive({self.root!r})"
+
+    def path(self, day: DayLike) -> str:
+        """Path of the Parquet file for one day"""
+        day = _as_date(day)
+        return os.path.join(self.root, "readings", f"year={day.year:04d}", f"month={day.month:02d}",
+                            f"{day.isoformat()}.parquet")
+
+    def ingested(self) -> Dict[str, Dict[str, Any]]:
+        """The ledger of ingested days: `{"YYYY-MM-DD": {"rows": n, "measures": fingerprint}}`"""
+        try:
+            with open(os.path.join(self.root, "ingested.json"), encoding = "utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _record(self, day: date, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            ledger = self.ingested()
+            ledger[day.isoformat()] = entry
+            self._write(os.path.join(self.root, "ingested.json"),
+                        json.dumps(ledger, indent = 1, sort_keys = True).encode("utf-8"))
+
+    def _write(self, path: str, data: bytes) -> None:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _open(self, day: date, source: Optional[str]):
+        """A readable source for the archive file of `day`, or None if there isn't one"""
+        if source is None:
+            source = ARCHIVE_URL
+        if os.path.isdir(source):
+            for name in (f"readings-full-{day}.csv", f"readings-full-{day}.csv.gz", f"readings-{day}.csv"):
+                path = os.path.join(source, name)
+                if os.path.isfile(path):
+                    return path
+            return None
+        location = source.format(day = day.isoformat())
+        if location.startswith(("http://", "https://")):
+            import requests
+
+            from hcc.transport import get_transport
+
+            try:
+                return get_transport().stream(location)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    return None
+                raise
+        return location if os.path.isfile(location) else None
+
+    def ingest_day(self, day: DayLike, measures: Iterable[str],
+                   source: Optional[str] = None, chunksize: int = CHUNK_ROWS) -> Optional[int]:
+        """Ingest one day's archive file, replacing anything held for that day
+
+        :return: the number of readings kept, or None if the file doesn't exist
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        day = _as_date(day)
+        keys = {measure_key(m) for m in measures}
+        opened = self._open(day, source)
+        if opened is None:
+            return None
+        if hasattr(opened, "raw"):
+            with opened:
+                df = read_archive_csv(opened.raw, keys, chunksize = chunksize)
+        else:
+            df = read_archive_csv(opened, keys, chunksize = chunksize)
+
+        table = pa.Table.from_pandas(df, preserve_index = False)
+        path = self.path(day)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = os.path.dirname(path), suffix = ".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp, compression = "zstd")
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._record(day, {"rows": len(df), "measures": _fingerprint(keys)})
+        return len(df)
+
+    def ingest(self, start: DayLike, end: DayLike,
+               measures: Optional[Iterable[str]] = None,
+               river_name: str = "River Thames",
+               source: Optional[str] = None,
+               force: bool = False,
+               max_workers: int = 2,
+               chunksize: int = CHUNK_ROWS) -> pd.DataFrame:
+        """Ingest the archive files for every day from `start` to `end`
+
+        Days already in the ledger for the same set of measures are skipped
+        unless `force` is set, so running this again resumes an interrupted
+        ingest and changes nothing once it has finished.
+
+        :param start: first day, inclusive
+        :param end: last day, inclusive
+        :param measures: measure ids to keep, by default every level and flow
+            measure on `river_name`
+        :param river_name: river whose measures are kept when `measures` isn't given
+        :param source: a directory holding `readings-full-YYYY-MM-DD.csv[.gz]`
+            files, or a path or URL template with a `{day}` field; by default
+            the EA archive
+        :param force: ingest days that are already in the ledger again
+        :param max_workers: days downloaded and parsed concurrently
+        :param chunksize: rows parsed at a time
+        :return: one row per day with `day`, `status` ("ingested", "skipped",
+            "missing" or "failed"), `rows` and `error`
+        """
+        if measures is None:
+            measures = river_measures(river_name)
+        keys = sorted({measure_key(m) for m in measures})
+        if not keys:
+            raise ValueError("No measures to ingest")
+        fingerprint = _fingerprint(keys)
+
+        ledger = self.ingested()
+        days = _days(start, end)
+        todo = [d for d in days if force
+                or ledger.get(d.isoformat(), {}).get("measures") != fingerprint
+                or not os.path.isfile(self.path(d))]
+
+        results = {d: ("skipped", ledger.get(d.isoformat(), {}).get("rows"), None) for d in days}
+
+        def run(day):
+            try:
+                rows = self.ingest_day(day, keys, source = source, chunksize = chunksize)
+            except Exception as e:
+                return "failed", None, repr(e)
+            return ("missing", None, None) if rows is None else ("ingested", rows, None)
+
+        with ThreadPoolExecutor(max_workers = max(1, max_workers)) as pool:
+            for day, result in zip(todo, pool.map(run, todo)):
+                results[day] = result
+
+        return pd.DataFrame([(d, *results[d]) for d in days], columns = ["day", "status", "rows", "error"])
+
+    def files(self, start: Optional[DayLike] = None, end: Optional[DayLike] = None) -> List[str]:
+        """Paths of the day files between `start` and `end`, oldest first
+
+        Only the year and month partitions that overlap the range are listed.
+        """
+        base = os.path.join(self.root, "readings")
+        if not os.path.isdir(base):
+            return []
+        first = _as_date(start) if start is not None else date.min
+        last = _as_date(end) if end is not None else date.max
+        paths = []
+        for year_dir in sorted(os.listdir(base)):
+            if not year_dir.startswith("year="):
+                continue
+            year = int(year_dir[5:])
+            if not first.year <= year <= last.year:
+                continue
+            for month_dir in sorted(os.listdir(os.path.join(base, year_dir))):
+                if not month_dir.startswith("month="):
+                    continue
+                month = int(month_dir[6:])
+                if not (first.year, first.month) <= (year, month) <= (last.year, last.month):
+                    continue
+                directory = os.path.join(base, year_dir, month_dir)
+                for name in sorted(os.listdir(directory)):
+                    if name.endswith(".parquet") and first.isoformat() <= name[:10] <= last.isoformat():
+                        paths.append(os.path.join(directory, name))
+        return paths
+
+    def read(self, measures: Optional[Iterable[str]] = None,
+             start: Optional[DayLike] = None, end: Optional[DayLike] = None,
+             columns: Sequence[str] = COLUMNS) -> pd.DataFrame:
+        """Read archived readings
+
+        :param measures: measure ids (URIs or notations) to read, by default all
+        :param start: earliest time, inclusive
+        :param end: latest time, exclusive; a date without a time reads up to
+            the start of that day
+        :param columns: columns to read
+        :return: a data frame of readings, newest first like the API's
+        """
+        import pyarrow.compute as pc
+        import pyarrow.dataset as ds
+        import pyarrow.fs
+
+        start = None if start is None else utc_timestamp(start)
+        end = None if end is None else utc_timestamp(end)
+
+        columns = list(columns)
+        paths = self.files(start, end)
+        if not paths:
+            return _empty().loc[:, columns]
+
+        dataset = ds.dataset(paths, format = "parquet",
+                             filesystem = pyarrow.fs.LocalFileSystem(use_mmap = True))
+        condition = None
+
+        def both(a, b):
+            return b if a is None else a & b
+
+        if measures is not None:
+            # The archive names measures by their http URI
+            ids = sorted({f"{_MEASURE_ROOT}/{measure_key(m)}" for m in measures})
+            condition = both(condition, pc.field("measure").isin(ids))
+        if start is not None:
+            condition = both(condition, pc.field("dateTime") >= start.to_pydatetime())
+        if end is not None:
+            condition = both(condition, pc.field("dateTime") < end.to_pydatetime())
+
+        table = dataset.to_table(columns = columns, filter = condition)
+        df = table.to_pandas()
+        if "measure" in df:
+            df["measure"] = df["measure"].astype("category")
+        if "dateTime" in df:
+            df = df.sort_values("dateTime", ascending = False, kind = "stable")
+        return df.reset_index(drop = True)
+
+
+def main(argv = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Ingest EA archive readings for a river")
+    parser.add_argument("start", help = "first day, YYYY-MM-DD")
+    parser.add_argument("end", help = "last day, YYYY-MM-DD")
+    parser.add_argument("--river", default = "River Thames", help = "river whose measures are kept")
+    parser.add_argument("--source", help = "directory of archive CSVs, or a URL template with {day}")
+    parser.add_argument("--root", help = "directory of the Parquet store")
+    parser.add_argument("--force", action = "store_true", help = "ingest days already in the store again")
+    parser.add_argument("--workers", type = int, default = 2, help = "days ingested concurrently")
+    args = parser.parse_args(argv)
+
+    archive = Archive(args.root)
+    result = archive.ingest(args.start, args.end, river_name = args.river, source = args.source,
+                            force = args.force, max_workers = args.workers)
+    for row in result[result["status"] == "failed"].itertuples():
+        print(f"{row.day}: {row.error}")
+    counts = result["status"].value_counts()
+    print(f"{archive.root}: " + ", ".join(f"{n} {status}" for status, n in counts.items())
+          + f", {int(result['rows'].fillna(0).sum())} readings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Time-to-live caching for functions that fetch remote data.
+
+`ttl_cache` replaces the `lru_cache` plus `time_hash` argument pattern: entries
+expire after a fixed number of seconds, the cache is bounded by entry count
+and (optionally) memory, and each cache keeps hit, miss and eviction counters.
+"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, NamedTuple, Optional, Union
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    stale_hits: int
+    evictions: int
+    currsize: int
+    maxsize: int
+    nbytes: int
+
+
+def _sizeof(value: Any) -> int:
+    """Approximate memory used by a cached value"""
+    if hasattr(value, "memory_usage"):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """Thread-safe TTL cache around a single function
+
+    :param func: the function to cache
+    :param ttl: seconds an entry stays fresh, or a function called with the
+        same arguments as `func` that returns the seconds for that entry
+    :param maxsize: maximum number of entries
+    :param max_bytes: optional bound on the total size of cached values
+    :param stale_while_revalidate: seconds after expiry during which the old
+        value is still returned while a background thread refreshes it
+    :param sizeof: function that measures a value for `max_bytes`
+    """
+
+    def __init__(self,
+                 func: Callable,
+                 ttl: Union[float, Callable[..., float]],
+                 maxsize: int = 128,
+                 max_bytes: Optional[int] = None,
+                 stale_while_revalidate: float = 0,
+                 sizeof: Callable[[Any], int] = _sizeof,
+                 clock: Callable[[], float] = time.monotonic):
+        self.func = func
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self.sizeof = sizeof
+        self.clock = clock
+
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._inflight: Dict[Any, Future] = {}
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self.hits = self.misses = self.stale_hits = self.evictions = 0
+
+    @staticmethod
+    def make_key(args, kwargs):
+        return functools._make_key(args, kwargs, typed=False)
+
+    def __call__(self, *args, **kwargs):
+        key = self.make_key(args, kwargs)
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires, _ = entry
+                if now < expires:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                if now < expires + self.stale_while_revalidate:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._inflight:
+                        self._inflight[key] = Future()
+                        threading.Thread(target=self._load, args=(key, args, kwargs),
+                                         daemon=True).start()
+                    return value
+
+            # Miss: share one computation between concurrent callers
+            self.misses += 1
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+
+        if owner:
+            self._load(key, args, kwargs)
+        return future.result()
+
+    def _load(self, key, args, kwargs):
+        future = self._inflight[key]
+        try:
+            value = self.func(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            return
+        ttl = self.ttl(*args, **kwargs) if callable(self.ttl) else self.ttl
+        self._store(key, value, ttl)
+        with self._lock:
+            del self._inflight[key]
+        future.set_result(value)
+
+    def _store(self, key, value, ttl):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._nbytes -= old[2]
+            self._data[key] = (value, self.clock() + ttl, size)
+            self._nbytes += size
+            while self._data and (
+                    len(self._data) > self.maxsize
+                    or (self.max_bytes is not None and self._nbytes > self.max_bytes
+                        and len(self._data) > 1)):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._nbytes -= evicted_size
+                self.evictions += 1
+
+    def contains(self, *args, **kwargs) -> bool:
+        """Whether there is a fresh entry for these arguments"""
+        key = self.make_key(args, kwargs)
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and self.clock() < entry[1]
+
+    def invalidate(self, *args, **kwargs) -> bool:
+        """Drop the entry for these arguments; return whether there was one"""
+        key = self.make_key(args, kwargs)
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._nbytes -= entry[2]
+        return entry is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._nbytes = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.stale_hits, self.evictions,
+                             len(self._data), self.maxsize, self._nbytes)
+
+
+_registry: Dict[str, TTLCache] = {}
+
+
+def ttl_cache(ttl: Union[float, Callable[..., float]],
+              maxsize: int = 128,
+              max_bytes: Optional[int] = None,
+              stale_while_revalidate: float = 0) -> Callable:
+    """Decorator that caches a function's results for `ttl` seconds
+
+    The wrapped function gains `cache_info()`, `cache_clear()` and
+    `cache_invalidate(*args, **kwargs)`. Arguments must be hashable.
+
+    :param ttl: seconds an entry stays fresh, or a function of the same
+        arguments returning the seconds for each entry
+    :param maxsize: maximum number of entries, least recently used go first
+    :param max_bytes: optional bound on the memory used by cached values
+    :param stale_while_revalidate: seconds after expiry during which the old
+        value is served while it is refreshed in the background
+    """
+    def decorator(func):
+        cache = TTLCache(func, ttl=ttl, maxsize=maxsize, max_bytes=max_bytes,
+                         stale_while_revalidate=stale_while_revalidate)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return cache(*args, **kwargs)
+
+        wrapper.cache = cache
+        wrapper.cache_info = cache.info
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_invalidate = cache.invalidate
+        _registry[f"{func.__module__}.{func.__qualname__}"] = cache
+        return wrapper
+
+    return decorator
+
+
+def cache_stats() -> Dict[str, CacheInfo]:
+    """Return the counters of every `ttl_cache` in hcc, keyed by function name"""
+    return {name: cache.info() for name, cache in _registry.items()}
+
+
+def clear_all() -> None:
+    """Empty every `ttl_cache`"""
+    for cache in _registry.values():
+        cache.clear()
+
+
+def cache_dir() -> str:
+    """Return the hcc cache directory, creating it if needed
+
+    Uses `HCC_CACHE_DIR` if set, otherwise `$XDG_CACHE_HOME/hcc` or
+    `~/.cache/hcc`.
+    """
+    path = os.environ.get("HCC_CACHE_DIR")
+    if path is None:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        path = os.path.join(base, "hcc")
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -1,31 +1,38 @@
 
-from time import strftime
-
 import hcc.ea_rivers as ea_rivers
-import plotly.express as px
-from functools import lru_cache
-import time
-from datetime import datetime, timedelta
-
+from hcc import instrument, snapshot
+from hcc.align import align
+from hcc.cache import ttl_cache
+from hcc.downsample import downsample
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+import difflib
+import warnings
+
+import numpy as np
 import pandas as pd
 import re
 
-from typing import Any, Tuple
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
 import hcc.ea_rivers as ea_rivers
 
 
 
-# cache some functions
+# cache some functions, each with a lifetime suited to how often it changes
+
+STATIONS_TTL = 6 * 3600
+MEASURES_TTL = 6 * 3600
+READINGS_TTL = 5 * 60
 
-@lru_cache()
+
+@ttl_cache(ttl = STATIONS_TTL, maxsize = 32, stale_while_revalidate = 24 * 3600)
 def get_ea_rivers(
     river_name: str, 
     parameter: str,
-    status:str = "Active", 
-    time_hash: Any = None):
+    status:str = "Active"):
     """
-    Get the stations for a river from the EA API
+    Get the stations for a river from the EA API, cached for `STATIONS_TTL`
 
     Parameters
     ----------
@@ -35,106 +42,488 @@ def get_ea_rivers(
         The parameter to search for, either "level" or "flow"
     status : str, optional
         The status of the station, by default "Active"
-    time_hash : Any, optional
-        Used internally to cache the result, by default None
     """
-    del time_hash  # to emphasize we don't use it and to shut pylint up
     return ea_rivers.get_stations(river_name = river_name, 
         parameter=parameter, status=status)
 
-@lru_cache()
-def get_ea_measures(station, parameter = "level", time_hash=None):
-    del time_hash  # to emphasize we don't use it and to shut pylint up
+@ttl_cache(ttl = MEASURES_TTL, maxsize = 256, stale_while_revalidate = 24 * 3600)
+def get_ea_measures(station, parameter = "level"):
     return ea_rivers.get_measures(station = station, parameter = parameter)
 
 
-def time_hash(seconds=3600):
-    """Return the same value within `seconds` time period"""
-    return round(time.time() / seconds)
+@ttl_cache(ttl = READINGS_TTL, maxsize = 256, max_bytes = 256 * 2**20)
+def get_ea_readings(measure_id, limit = None, since = None):
+    """Readings for a measure, cached for `READINGS_TTL`
+
+    The returned data frame is shared between callers; copy it before changing it.
+    """
+    return ea_rivers.get_readings_for_measure(measure_id, limit = limit, since = since)
 
 
 # wrapper around the EA get_stations function
 def get_thames_levels(river_name = "River Thames"):
-    return get_ea_rivers(river_name, "level", time_hash=time_hash())
+    return get_ea_rivers(river_name, "level")
 
 
 # wrapper around the EA get_stations function
 def get_thames_flow():
-    return get_ea_rivers("River Thames", "flow", time_hash=time_hash())
+    return get_ea_rivers("River Thames", "flow")
 
 
-# Lookup a station name from a search string
+class StationRecord(NamedTuple):
+    """A resolved EA monitoring station"""
+    label: str
+    id: str
+    notation: str
+    lat: float
+    long: float
+    measures: Tuple[str, ...]
+
+
+def _normalise(text):
+    """Lower case, with runs of punctuation and whitespace turned into one space"""
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", str(text).lower()).split())
+
 
+def _first(value):
+    # A few EA stations have a list of labels rather than a single one
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
 
 
+def _measure_ids(measures):
+    if isinstance(measures, dict):
+        measures = [measures]
+    if not isinstance(measures, list):
+        return ()
+    return tuple(m["@id"] for m in measures if isinstance(m, dict) and "@id" in m)
+
+
+class StationIndex:
+    """Prebuilt lookup over a station table
+
+    Exact labels resolve with one dict lookup. Partial searches match every
+    search word against the prefixes of the label words, and misspelt searches
+    fall back to the closest label. Ties go to the station that comes first in
+    the table, as the old `str.contains` lookup did.
+
+    Parameters
+    ----------
+    stations : pd.DataFrame
+        Station table as returned by `ea_rivers.get_stations`
+    """
+
+    def __init__(self, stations: pd.DataFrame):
+        self.records: List[StationRecord] = []
+        self._by_label: Dict[str, int] = {}
+        self._by_prefix: Dict[str, set] = defaultdict(set)
+
+        n = len(stations)
+        columns = {
+            col: (stations[col].tolist() if col in stations else [None] * n)
+            for col in ["label", "@id", "notation", "lat", "long", "measures"]
+        }
+        for i in range(n):
+            label = _first(columns["label"][i])
+            if label is None:
+                continue
+            record = StationRecord(
+                label = str(label),
+                id = columns["@id"][i],
+                notation = columns["notation"][i],
+                lat = _first(columns["lat"][i]),
+                long = _first(columns["long"][i]),
+                measures = _measure_ids(columns["measures"][i]),
+            )
+            pos = len(self.records)
+            self.records.append(record)
+            key = _normalise(label)
+            self._by_label.setdefault(key, pos)
+            for token in key.split():
+                for j in range(1, len(token) + 1):
+                    self._by_prefix[token[:j]].add(pos)
+
+    def __len__(self):
+        return len(self.records)
+
+    def search(self, station_search: str, n: int = 5) -> List[StationRecord]:
+        """Return up to `n` stations matching a search string, best first"""
+        key = _normalise(station_search)
+        if key in self._by_label:
+            return [self.records[self._by_label[key]]]
+
+        tokens = key.split()
+        if tokens:
+            hits = set.intersection(*(self._by_prefix.get(t, set()) for t in tokens))
+            if hits:
+                return [self.records[i] for i in sorted(hits)[:n]]
+
+        # Substring anywhere in the label, e.g. "ingston"
+        hits = [r for r in self.records if key and key in _normalise(r.label)]
+        if hits:
+            return hits[:n]
+
+        close = difflib.get_close_matches(key, self._by_label.keys(), n = n, cutoff = 0.6)
+        return [self.records[self._by_label[c]] for c in close]
+
+    def lookup(self, station_search: str) -> StationRecord:
+        """Return the best matching station, or raise `ValueError`"""
+        hits = self.search(station_search, n = 1)
+        if not hits:
+            raise ValueError(f"No station found matching '{station_search}'")
+        return hits[0]
+
+
+@ttl_cache(ttl = STATIONS_TTL, maxsize = 32, stale_while_revalidate = 24 * 3600)
+def get_station_index(river_name = "River Thames") -> StationIndex:
+    """Return the station index for a river, rebuilt with the station table"""
+    return StationIndex(get_thames_levels(river_name))
+
+
+def lookup_thames_station(station_search, river_name = "River Thames") -> StationRecord:
+    """Resolve a search string to a station record
+
+    The record carries the name, `@id`, notation, location and measure ids, so
+    callers can pass it on instead of searching again. A `StationRecord` is
+    returned unchanged.
+    """
+    if isinstance(station_search, StationRecord):
+        return station_search
+    return get_station_index(river_name).lookup(station_search)
+
+
+# Lookup a station name from a search string
 def lookup_thames_station_name(station_search, river_name = "River Thames"):
     """Look up a station name from a search string
     """
-    stations = get_thames_levels(river_name)
-    idx = stations["label"].str.contains(station_search, na = False)
-    station_name = stations.loc[idx, ["label"]].values[0][0]
-    return station_name
+    return lookup_thames_station(station_search, river_name = river_name).label
 
 # Lookup the measure URL from the station name
 def lookup_thames_station_url(station_name, river_name = "River Thames"):
-    stations = get_thames_levels(river_name)
-    idx = stations["label"].str.contains(station_name, na = False)
-    return stations.loc[idx, "@id"].values[0]
+    return lookup_thames_station(station_name, river_name = river_name).id
 
 
-def get_thames_metric(station_search, position = "upstream", parameter = "level", river_name = "River Thames", since = None, limit = None):
+@instrument.timed("core.get_thames_metric")
+def get_thames_metric(station_search, position = "upstream", parameter = "level", river_name = "River Thames", since = None, limit = None, store = None):
     """ Searches for the station name, then plot the upstream or downstream flow
 
     Parameters
     ----------
 
-        station_search {str} -- Name of the station to search for
+        station_search {str} -- Name of the station to search for, or a
+            `StationRecord` from `lookup_thames_station`
 
         position {str} -- Either "upstream" or "downstream"
 
         parameter {str} -- Either "level" or "flow"
 
+        store -- A `hcc.store.ReadingsStore` or `hcc.ringstore.RingStore` to
+            sync and read from, `True` for the default on-disk store or
+            "memory" for the shared in-memory one. By default readings are
+            fetched directly.
+
     Returns:
-        Pandas dataframe
+        Pandas dataframe, the caller's own copy
     """
 
+    snap = snapshot.active()
+    if snap is not None:
+        name = station_search.label if isinstance(station_search, StationRecord) else station_search
+        found = snap.metric(name, position, parameter, river_name, since = since, limit = limit)
+        if found is not None:
+            return found[1].copy()
+
     if position == "upstream":
         measure = 0
     else:
         measure = 1
     
-    station_name = lookup_thames_station_name(station_search, river_name = river_name)
-    found = lookup_thames_station_url(station_name, river_name = river_name)
-    measures = get_ea_measures(station = found, parameter = parameter).loc[:, ["@id", "label", "notation"]]
+    station = lookup_thames_station(station_search, river_name = river_name)
+    measures = get_ea_measures(station = station.id, parameter = parameter).loc[:, ["@id", "label", "notation"]]
 
     s1 = measures["@id"].values[measure]
-    dat = ea_rivers.get_readings_for_measure(s1, limit = limit, since = since)
-    # print(dat.ndim)
+    if store is None or store is False:
+        dat = get_ea_readings(s1, limit = limit, since = since)
+    else:
+        if store is True:
+            from hcc.store import get_store
+            store = get_store()
+        elif isinstance(store, str) and store == "memory":
+            from hcc.ringstore import get_ring_store
+            store = get_ring_store()
+        dat = store.get_readings(s1, since = since)
+        if limit is not None:
+            dat = dat.head(limit)
     if len(dat) == 0:
-        if since is None:
-            # seven days earlier:
-            since = pd.Timestamp(strftime("%Y-%m-%d %H:%M:%S", gmtime(time() - 7*24*3600)))
+        return _empty_metric(since)
+    # The readings may be shared with the cache, the snapshot or a ring
+    # buffer, so callers get their own copy
+    return dat.copy()
+
+
+def _empty_metric(since = None, freq = "15min"):
+    """Missing values every `freq` from `since` (by default a week ago) to now, newest first
 
-        # Get current time
-        now = datetime.now()
+    Stands in for a station without readings, so plots still get a time axis.
+    """
+    now = pd.Timestamp.now(tz = "UTC").floor(freq)
+    if since is None:
+        start = now - pd.Timedelta(days = 7)
+    else:
+        start = ea_rivers.utc_timestamp(since)
+    times = pd.date_range(start.ceil(freq), now, freq = freq)[::-1]
+    return pd.DataFrame({"dateTime": times, "value": np.full(len(times), np.nan)})
 
-        # Generate time intervals of 15 minutes for the last week
-        time_intervals = [now - timedelta(minutes=15 * i) for i in range(int(7 * 24 * 60 / 15))][::-1]
 
-        # Create DataFrame
-        dat = pd.DataFrame({
-            'dateTime': time_intervals,
-            'value': [None] * len(time_intervals)
-        })
-    return dat
+def _station_readings(notations, parameter, since, max_workers = 8) -> pd.DataFrame:
+    """ Readings since a time for each of several stations, fetched concurrently """
+    def fetch(notation):
+        return ea_rivers.get_readings(parameter = parameter, station_reference = notation,
+                                      since = since, limit = ea_rivers.MAX_LIMIT)
+
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(notations)))) as pool:
+        frames = list(pool.map(fetch, notations))
+    for notation, frame in zip(notations, frames):
+        if len(frame) >= ea_rivers.MAX_LIMIT:
+            warnings.warn(f"{notation} has more than {ea_rivers.MAX_LIMIT} readings since {since}; "
+                          "the latest may be missing")
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return ea_rivers.parse_readings([])
+    return pd.concat(frames, ignore_index = True)
+
+
+def get_river_snapshot(river_name = "River Thames", parameter = "level",
+                       position = "upstream", since = None) -> pd.DataFrame:
+    """ Latest reading at every station on a river
+
+    Uses the EA bulk readings endpoint, so the whole river costs one readings
+    request (plus the cached station table) instead of two per station.
+
+    Parameters
+    ----------
+    river_name : str
+        Name of the river
+    parameter : str
+        Either "level" or "flow"
+    position : str
+        Either "upstream" or "downstream", for stations with two measures
+    since : optional
+        If given, fetch all readings since this time and keep the latest per
+        measure; by default only the latest reading of each measure is fetched.
+        When the nationwide readings since then fill one page, the river's
+        stations are fetched one by one instead.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per station with `label`, `notation`, `lat`, `long`,
+        `measure`, `dateTime` and `value`. Stations without a recent reading
+        have missing `dateTime` and `value`.
+    """
+    measure = 0 if position == "upstream" else 1
+    index = StationIndex(get_ea_rivers(river_name, parameter))
+
+    rows = []
+    for record in index.records:
+        ids = [m for m in record.measures if f"-{parameter}-" in m]
+        if len(ids) > measure:
+            rows.append((record.label, record.notation, record.lat, record.long,
+                         ids[measure], ea_rivers.measure_key(ids[measure])))
+    stations = pd.DataFrame(rows, columns = ["label", "notation", "lat", "long",
+                                             "measure", "key"])
+
+    if since is None:
+        readings = ea_rivers.get_readings(parameter = parameter, latest = True)
+    else:
+        readings = ea_rivers.get_readings(parameter = parameter, since = since,
+                                          limit = ea_rivers.MAX_LIMIT)
+        if len(readings) >= ea_rivers.MAX_LIMIT:
+            # The nationwide page is full, so some stations' latest readings
+            # may be missing: ask each station on the river instead
+            readings = _station_readings(stations["notation"].unique(), parameter, since)
+    if len(readings):
+        readings = (readings
+            .assign(key = readings["measure"].map(ea_rivers.measure_key))
+            .sort_values("dateTime")
+            .drop_duplicates("key", keep = "last")
+            .loc[:, ["key", "dateTime", "value"]])
+    else:
+        readings = pd.DataFrame(columns = ["key", "dateTime", "value"])
+
+    latest = stations.merge(readings, on = "key", how = "left")
+    return latest.drop(columns = "key")
+
+
+def _metric_spec(spec):
+    """Normalise a `get_thames_metrics` spec to a dict of keyword arguments"""
+    if isinstance(spec, str):
+        return {"station_search": spec}
+    if isinstance(spec, dict):
+        return dict(spec)
+    return dict(zip(["station_search", "position", "parameter"], spec))
+
+
+def get_thames_metrics(specs: Iterable[Union[str, tuple, dict]],
+                       since = None,
+                       limit = None,
+                       store = None,
+                       max_workers: int = 8) -> Dict[Tuple[str, str, str, str], Any]:
+    """ Fetch several station metrics concurrently
+
+    Station tables are fetched once per river up front, then the measure and
+    readings requests for every spec run in a bounded thread pool, so the
+    total time is close to the slowest single station rather than the sum.
+
+    Parameters
+    ----------
+    specs : iterable
+        Each spec is either a station search string, a tuple of
+        `(station_search, position, parameter)`, or a dict of keyword
+        arguments for `get_thames_metric`.
+    since : optional
+        Default `since` for specs that don't set their own
+    limit : optional
+        Default `limit` for specs that don't set their own
+    store : optional
+        Default readings `store` for specs that don't set their own
+    max_workers : int, optional
+        Maximum number of concurrent requests, by default 8
+
+    Returns
+    -------
+    dict
+        Keyed by `(station_search, position, parameter, river_name)`. Each
+        value is the data frame returned by `get_thames_metric`, or the
+        exception raised for that spec, so one failing station doesn't fail
+        the whole batch.
+    """
+    kwargs = []
+    for spec in specs:
+        kw = _metric_spec(spec)
+        kw.setdefault("position", "upstream")
+        kw.setdefault("parameter", "level")
+        kw.setdefault("river_name", "River Thames")
+        kw.setdefault("since", since)
+        kw.setdefault("limit", limit)
+        kw.setdefault("store", store)
+        kwargs.append(kw)
+
+    # Warm the station index once per river before fanning out
+    for river_name in {kw["river_name"] for kw in kwargs}:
+        try:
+            get_station_index(river_name)
+        except Exception:
+            pass  # reported per spec below
+
+    def fetch(kw):
+        try:
+            return get_thames_metric(**kw)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(kwargs) or 1))) as pool:
+        results = list(pool.map(fetch, kwargs))
+
+    return {
+        (kw["station_search"], kw["position"], kw["parameter"], kw["river_name"]): result
+        for kw, result in zip(kwargs, results)
+    }
+
+
+def get_thames_panel(stations: Iterable[Union[str, tuple, dict]],
+                     parameter = "level",
+                     since = None,
+                     freq = "15min",
+                     position = "upstream",
+                     river_name = "River Thames",
+                     fill = "interpolate",
+                     fill_limit = "1h",
+                     store = None,
+                     max_workers: int = 8) -> pd.DataFrame:
+    """ Readings of several stations side by side on one time grid
+
+    The stations are fetched concurrently with `get_thames_metrics`, then
+    every reading is snapped to the nearest time of one `date_range` grid in
+    a single vectorized pass (see `hcc.align.align`).
+
+    Parameters
+    ----------
+    stations : iterable
+        Station search strings, or specs as for `get_thames_metrics`
+    parameter : str
+        Either "level" or "flow", for stations given as strings
+    since : optional
+        Start of the grid and of the readings fetched; by default the grid
+        starts at the earliest reading
+    freq : str
+        Grid spacing
+    position : str
+        Either "upstream" or "downstream", for stations given as strings
+    river_name : str
+        River to search for stations given as strings
+    fill : str, optional
+        How to fill gaps: "interpolate", "ffill" or None
+    fill_limit : optional
+        Longest gap to fill, as a duration such as "1h" or a number of grid
+        steps; None fills gaps of any length
+    store : optional
+        Readings `store` passed on to `get_thames_metric`
+    max_workers : int, optional
+        Maximum number of concurrent requests
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by UTC `dateTime`, one float column per station, named by
+        its search string (with position and parameter added if a station
+        appears twice, and the river too if that isn't enough). Stations that
+        fail are all missing values, with a warning.
+    """
+    specs = []
+    for spec in stations:
+        kw = _metric_spec(spec)
+        kw.setdefault("position", position)
+        kw.setdefault("parameter", parameter)
+        kw.setdefault("river_name", river_name)
+        specs.append(kw)
+
+    # Ask for a full page, since the API's default limit is a few days
+    results = get_thames_metrics(specs, since = since, store = store, max_workers = max_workers,
+                                 limit = None if since is None else ea_rivers.MAX_LIMIT)
+
+    searches = [str(kw["station_search"]) for kw in specs]
+    series = [(search, kw["position"], kw["parameter"]) for kw, search in zip(specs, searches)]
+    frames = {}
+    for kw, search, s in zip(specs, searches, series):
+        key = (kw["station_search"], kw["position"], kw["parameter"], kw["river_name"])
+        if searches.count(search) == 1:
+            name = search
+        elif series.count(s) == 1:
+            name = f"{search} {kw['position']} {kw['parameter']}"
+        else:
+            name = f"{search} ({kw['river_name']}) {kw['position']} {kw['parameter']}"
+        result = results[key]
+        if isinstance(result, Exception):
+            warnings.warn(f"No readings for {name}: {result!r}")
+            result = None
+        frames[name] = result
+
+    with instrument.stage("core.align"):
+        return align(frames, freq = freq, start = since, fill = fill, limit = fill_limit)
 
 
 # Create a plotly plot of either levels or flow
+@instrument.timed("core.plot_thames_level")
 def plot_thames_level(station_search, position = "upstream", parameter = "level", 
     river_name = "River Thames",
     since = None,
     limit = None,
-    plot_type = "plotly"):
+    plot_type = "plotly",
+    store = None,
+    max_points = None,
+    downsample_method = "lttb"):
     """ Searches for the station name, then plot the upstream or downstream flow
 
     Arguments:
@@ -145,13 +534,27 @@ def plot_thames_level(station_search, position = "upstream", parameter = "level"
 
         paramater {str} -- Either "level" or "flow"
 
+        store -- Readings store passed on to `get_thames_metric`
+
+        max_points {int} -- If set, downsample the series to at most this
+            many points with `hcc.downsample.downsample`, keeping peaks
+
+        downsample_method {str} -- Either "lttb" or "minmax"
+
     Returns:
         Plotly figure object
     """
 
-    station_name = lookup_thames_station_name(station_search, river_name = river_name)
-    s1msr = get_thames_metric(station_name, position = position, 
-        parameter = parameter, river_name = river_name, since = since, limit = limit)
+    snap = snapshot.active()
+    found = None if snap is None else snap.metric(station_search, position, parameter, river_name,
+                                                  since = since, limit = limit)
+    if found is not None:
+        station_name, s1msr = found
+    else:
+        station = lookup_thames_station(station_search, river_name = river_name)
+        station_name = station.label
+        s1msr = get_thames_metric(station, position = position, 
+            parameter = parameter, river_name = river_name, since = since, limit = limit, store = store)
 
     if parameter == "level":
         title = f"{station_name} {position} river level"
@@ -160,34 +563,37 @@ def plot_thames_level(station_search, position = "upstream", parameter = "level"
         title = f"{station_name} {position} river flow"
         value_label = "River flow (m3/s)"
 
-    # Plot the river level
-    if plot_type == "plotly":
-        fig = px.line(
-            s1msr, x="dateTime", y="value", 
-            title = title,
-            labels = {"dateTime": "Date", "value": f"{value_label}"}
-        )
-        fig.update_layout(
-            autosize=True,
-            # width=500,
-            # height=500,
-        )
+    if max_points is not None:
+        s1msr = downsample(s1msr, n_out = max_points, method = downsample_method)
 
-        return fig
-    else:
-        # create plot using matplotlib
-        # convert the dateTime column to a datetime object
-        s1msr["dateTime"] = pd.to_datetime(s1msr["dateTime"])
-        import matplotlib.pyplot as plt
-        # create plot using matplotlib
-        fig, ax = plt.subplots()
-        ax.plot(s1msr["dateTime"], s1msr["value"])
-        ax.set_title(title)
-        ax.set_xlabel("Date")
-        ax.set_ylabel(value_label)
-        # ax.locator_params(axis='x', nbins=6)
-        ax.xaxis.set_major_locator(plt.MaxNLocator(3))
-        return ax
+    # Plot the river level
+    with instrument.stage("core.plot"):
+        if plot_type == "plotly":
+            import plotly.express as px
+            fig = px.line(
+                s1msr, x="dateTime", y="value", 
+                title = title,
+                labels = {"dateTime": "Date", "value": f"{value_label}"}
+            )
+            fig.update_layout(
+                autosize=True,
+                # width=500,
+                # height=500,
+            )
+
+            return fig
+        else:
+            # create plot using matplotlib
+            import matplotlib.pyplot as plt
+            # create plot using matplotlib
+            fig, ax = plt.subplots()
+            ax.plot(s1msr["dateTime"], s1msr["value"])
+            ax.set_title(title)
+            ax.set_xlabel("Date")
+            ax.set_ylabel(value_label)
+            # ax.locator_params(axis='x', nbins=6)
+            ax.xaxis.set_major_locator(plt.MaxNLocator(3))
+            return ax
 
         
 
@@ -206,13 +612,21 @@ def plot_thames_level(station_search, position = "upstream", parameter = "level"
         # fig.xaxis.set_major_locator(plt.MaxNLocator(3))
 
 
-def find_local(x):
-    local = []
-    for r in x:
-        # print(r)
-        if re.search("Walton|Shepperton|Molesey|Teddington|Kingston|Sunbury", r):
-            local.append('Local')
-        else:
-            local.append('No')
-    return local
+def find_local(x, lat = None, lon = None):
+    """
+    Label places as 'Local' or 'No'
+
+    Uses the locality from `hcc.locality.get_locality()`, by default the
+    Hampton Court reach from Shepperton to Teddington. Rows with coordinates
+    are classified by position; the rest by the place names in their text.
+
+    Parameters
+    ----------
+    x : array-like of str
+        Place descriptions, such as the "Where" column of the closures page
+    lat, lon : array-like of float, optional
+        Coordinates for each row, NaN where unknown
+    """
+    from hcc.locality import get_locality
+    return get_locality().classify(x, lat, lon)
 
@@ -0,0 +1,126 @@
+"""
+Shape-preserving downsampling of time series for plotting.
+
+A 28 day window of 15 minute readings is about 2700 points per trace. These
+functions pick a subset of the original points that keeps the visual shape,
+including peaks such as flood crests, within a fixed point budget.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _as_float(x) -> np.ndarray:
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb(x, y, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling
+
+    :param x: sorted x values (numbers or datetimes)
+    :param y: y values, without missing values
+    :param n_out: number of points to keep
+    :return: sorted indices of the points to keep
+    """
+    x = _as_float(x)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+
+    # Buckets over the interior points; the first and last points are kept
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0] = 0
+    keep[-1] = n - 1
+
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third vertex
+        nxt_start, nxt_stop = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        cx = x[nxt_start:nxt_stop].mean()
+        cy = y[nxt_start:nxt_stop].mean()
+
+        bx = x[start:stop]
+        by = y[start:stop]
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def minmax(x, y, n_out: int) -> np.ndarray:
+    """Min/max bucket downsampling
+
+    Splits the series into `n_out // 2` equal buckets and keeps the lowest and
+    highest point of each, so every extreme survives. An odd budget also
+    keeps the last point, so the trace reaches the latest reading.
+
+    :param x: sorted x values (unused apart from its length)
+    :param y: y values, without missing values
+    :param n_out: number of points to keep
+    :return: sorted indices of the points to keep
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 2:
+        return np.array([0, n - 1])[:max(n_out, 0)]
+    n_buckets = n_out // 2
+
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, size)
+    valid = ~np.isnan(padded).all(axis=1)
+    offsets = np.arange(n_buckets)[valid] * size
+    lo = np.nanargmin(padded[valid], axis=1) + offsets
+    hi = np.nanargmax(padded[valid], axis=1) + offsets
+    last = [n - 1] if n_out % 2 else []
+    return np.unique(np.concatenate([lo, hi, last]).astype(np.int64))
+
+
+METHODS = {"lttb": lttb, "minmax": minmax}
+
+
+def downsample(df: pd.DataFrame,
+               n_out: int = 1000,
+               x: str = "dateTime",
+               y: str = "value",
+               method: str = "lttb") -> pd.DataFrame:
+    """Reduce a data frame to at most `n_out` points for plotting
+
+    A frame with at most `n_out` rows, or with no values at all (such as the
+    empty placeholder `get_thames_metric` returns, whose grid gives a chart
+    its time axis), is returned unchanged. Otherwise the points are chosen
+    from the rows with a `y` value and the result is sorted by `x`.
+
+    :param df: data frame with the series to plot
+    :param n_out: maximum number of points to keep
+    :param x: name of the x column, by default "dateTime"
+    :param y: name of the y column, by default "value"
+    :param method: "lttb" (Largest-Triangle-Three-Buckets) or "minmax"
+    :return: a subset of the rows of `df`
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+    if len(df) <= n_out:
+        return df
+    valid = df.dropna(subset=[y])
+    if not len(valid):
+        return df
+    df = valid.sort_values(x)
+    if len(df) <= n_out:
+        return df
+    xs = df[x]
+    if isinstance(xs.dtype, pd.DatetimeTZDtype):
+        xs = xs.dt.tz_convert(None)
+    idx = METHODS[method](xs.to_numpy(), df[y].to_numpy(), n_out)
+    return df.iloc[idx]
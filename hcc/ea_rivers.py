@@ -3,9 +3,118 @@ Created on Fri May  8 11:25:31 2020
 @author: User
 """
 
+import json
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
 import pandas as pd
-import requests
 
+try:
+    # orjson decodes large readings responses several times faster
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+from hcc import instrument
+from hcc.transport import get_transport
+
+API_ROOT = "https://environment.data.gov.uk/flood-monitoring"
+
+# The API never returns more than this many rows in one response
+MAX_LIMIT = 10000
+
+
+def measure_key(measure_id) -> str:
+    """ The part of a measure URI after `/measures/`, ignoring http vs https """
+    return str(measure_id).rsplit("/measures/", 1)[-1]
+
+
+def utc_timestamp(value) -> pd.Timestamp:
+    """ A time as a UTC `Timestamp`, reading naive times as UTC """
+    t = pd.Timestamp(value)
+    return t.tz_localize("UTC") if t.tzinfo is None else t.tz_convert("UTC")
+
+
+def utc_ns(value) -> int:
+    """ Nanoseconds since the epoch, reading naive times as UTC """
+    return utc_timestamp(value).value
+
+
+def _api_url(path):
+    """ Build an EA API URL from a path or a full measure/station URI
+
+    The API returns `@id` URIs over plain http, which the server redirects to
+    https. Rewrite them to `API_ROOT` up front to save the redirect.
+    """
+    for prefix in ("http://environment.data.gov.uk/flood-monitoring",
+                   "https://environment.data.gov.uk/flood-monitoring"):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+            break
+    return API_ROOT + path
+
+
+def _get_items(path, params, timeout = None):
+    """ GET an EA API endpoint through the shared transport and return its items
+
+    Queries with `since` are not cached: callers that poll move `since` on
+    every call, so the response would never be asked for again.
+    """
+    response = get_transport().get(_api_url(path), params = params,
+                                   timeout = timeout, cache = params.get("since") is None)
+    return _loads(response.content)["items"]
+
+
+READINGS_COLUMNS = ["dateTime", "value", "measure"]
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def parse_readings(items, dtype = np.float64):
+    """ Build a compact readings data frame from EA readings items
+
+    Only `dateTime`, `value` and `measure` are kept: `dateTime` is parsed to
+    `datetime64[ns, UTC]`, `value` is a float array and the repeated
+    `measure` URIs are stored once as a categorical. The per-reading `@id`
+    URIs are dropped.
+
+      :param items: the `items` list of an EA readings response, or the raw
+            response body as bytes or str
+      :param dtype: dtype of the `value` column, for example `np.float32`
+      :return: a pandas data frame with columns `dateTime`, `value`, `measure`
+    """
+    if isinstance(items, (bytes, bytearray, str)):
+        items = _loads(items)["items"]
+
+    times = [item["dateTime"] for item in items]
+    try:
+        # EA timestamps are always UTC "YYYY-MM-DDTHH:MM:SSZ", which numpy
+        # parses far faster than pandas once the "Z" is dropped
+        times = np.array([t.rstrip("Z") for t in times], dtype = "datetime64[ns]")
+        times = pd.DatetimeIndex(times).tz_localize("UTC")
+    except ValueError:
+        times = pd.to_datetime(times, utc = True, format = "ISO8601")
+    values = [item.get("value") for item in items]
+    try:
+        values = np.array(values, dtype = dtype)
+    except (TypeError, ValueError):
+        # A few readings carry a null or a list instead of a number
+        values = np.array([_as_float(v) for v in values], dtype = dtype)
+    measures = pd.Categorical([item.get("measure") for item in items])
+
+    readings = pd.DataFrame({"dateTime": pd.DatetimeIndex(times).as_unit("ns"), "value": values,
+                             "measure": measures})
+    return readings
+
+@instrument.timed("ea_rivers.get_stations")
 def get_stations(
         parameter_name = None,
         parameter = None,
@@ -21,7 +130,8 @@ def get_stations(
         long = None,
         d = None,
         type = None,
-        status = None
+        status = None,
+        timeout = None
     ):
     """ Get details of river monitoring stations from EA API
 
@@ -80,14 +190,13 @@ def get_stations(
             :status: 
                 Return only those stations with the given status. Can be one of
                 "Active", "Closed" or "Suspended".
+            :timeout:
+                Override the transport timeout (seconds) for this call.
 
       :return: a pandas data frame of river monitoring stations
       >>> get_stations()
   """
 
-  
-    api_url = "https://environment.data.gov.uk/flood-monitoring/id/stations"
- 
     # Build dictionary of query params from arguments
     params = {'parameterName': parameter_name,
     'parameter': parameter,
@@ -107,25 +216,23 @@ def get_stations(
     }
     
     # Get data about stations from the EA API
-    response = requests.get(api_url, 
-                            params = params)
-
-    # Extract JSON data from the response
-    data = response.json()
+    items = _get_items("/id/stations", params, timeout = timeout)
 
     # Load data to a data frame
-    stations = pd.DataFrame(data["items"])
+    stations = pd.DataFrame(items)
 
     return(stations)
 
 
 
+@instrument.timed("ea_rivers.get_measures")
 def get_measures(parameter_name = None,
                  parameter = None,
                  qualifier = None,
                  station_reference = None,
                  station = None,
-                 search = None):
+                 search = None,
+                 timeout = None):
     """Get details of measures available from river monitoring stations on the EA API
 
         :param parameter_name: 
@@ -147,14 +254,14 @@ def get_measures(parameter_name = None,
             the given URI.
        :param search: 
             Return only those measures whose label contains the given value.
+       :param timeout:
+            Override the transport timeout (seconds) for this call.
 
        :return: a pandas data frame of river monitoring measures
 
        >>> get_measures()
     """
-    api_url = "http://environment.data.gov.uk/flood-monitoring/id/measures"
-    
-     # Build dictionary of query params from arguments
+    # Build dictionary of query params from arguments
     params = {'parameterName': parameter_name,
     'parameter': parameter,
     'qualifier': qualifier,
@@ -164,18 +271,15 @@ def get_measures(parameter_name = None,
     }
     
     # Get data about measures from the EA API
-    response = requests.get(api_url, 
-                            params)
-
-    # Extract JSON data from the response
-    data = response.json()
+    items = _get_items("/id/measures", params, timeout = timeout)
 
     # Load data to a data frame
-    measures = pd.DataFrame(data["items"])
+    measures = pd.DataFrame(items)
 
     return(measures)
     
 
+@instrument.timed("ea_rivers.get_readings_for_measure")
 def get_readings_for_measure(measure_id, 
                              limit = None,
                              date = None, 
@@ -184,7 +288,9 @@ def get_readings_for_measure(measure_id,
                              since = None, 
                              latest = False,
                              today = False, 
-                             sorted = True):
+                             sorted = True,
+                             timeout = None,
+                             raw = False):
     """ Gets readings for a given measure from the EA river monitoring API
       :param measure_id:
             EA API measure id
@@ -214,6 +320,12 @@ def get_readings_for_measure(measure_id,
             Order the array of returned readings into descending order by date,
             this done before the limits is applied thus enabling you to fetch
             the most recent n readings.
+      :param timeout:
+            Override the transport timeout (seconds) for this call.
+      :param raw:
+            Return the columns exactly as the API sends them (`@id`,
+            `dateTime` and `measure` as strings) instead of the compact
+            frame from `parse_readings`.
       
       :return: a pandas data frame of readings for the measure
       >>> get_readings_for_measure('http://environment.data.gov.uk/flood-monitoring/id/measures/L0215-level-stage-i-15_min-m')
@@ -245,16 +357,178 @@ def get_readings_for_measure(measure_id,
     '_sorted': sorted
     }
   
-    api_url = measure_id + "/readings"
-    
     # Get data about readings from the EA API
-    response = requests.get(api_url, 
-                            params)
-
-    # Extract JSON data from the response
-    data = response.json()
+    items = _get_items(measure_id + "/readings", params, timeout = timeout)
 
     # Load data to a data frame
-    readings = pd.DataFrame(data["items"])
+    if raw:
+        return pd.DataFrame(items)
+    with instrument.stage("ea_rivers.parse_readings") as s:
+        readings = parse_readings(items)
+        s["rows"] = len(readings)
 
     return(readings)
+
+
+@instrument.timed("ea_rivers.get_readings")
+def get_readings(parameter_name = None,
+                 parameter = None,
+                 qualifier = None,
+                 station_reference = None,
+                 limit = None,
+                 date = None,
+                 startdate = None,
+                 enddate = None,
+                 since = None,
+                 latest = False,
+                 today = False,
+                 timeout = None,
+                 raw = False):
+    """ Gets readings for all measures from the EA bulk readings endpoint
+
+    One request returns readings for every matching measure, which is far
+    cheaper than one `get_readings_for_measure` call per station.
+
+      :param parameter_name:
+            Return only readings for parameters with the given name, for
+            example Water Level or Flow.
+      :param parameter:
+            Return only readings for parameters with the given short form
+            name, for example level or flow.
+      :param qualifier:
+            Return only readings for measures with the given qualifier.
+      :param station_reference:
+            Return only readings from the station with this reference.
+      :param limit:
+            Maximum number of records to return. Max 10000.
+      :param date:
+            Return all the readings taken on the specified day.
+      :param startdate:
+            Return the readings taken on the specified range of days.
+      :param enddate:
+            Return the readings taken on the specified range of days.
+      :param since:
+            Return the readings taken since the given date time (not inclusive).
+      :param latest:
+            Return only the latest reading of each measure.
+      :param today:
+            Return all readings from today.
+      :param timeout:
+            Override the transport timeout (seconds) for this call.
+      :param raw:
+            Return the columns exactly as the API sends them.
+
+      :return: a pandas data frame of readings, with a `measure` column
+      >>> get_readings(parameter = "level", latest = True)
+    """
+    params = {'parameterName': parameter_name,
+    'parameter': parameter,
+    'qualifier': qualifier,
+    'stationReference': station_reference,
+    '_limit': limit,
+    'date': date,
+    'startdate': startdate,
+    'enddate': enddate,
+    'since': since,
+    'latest': '' if latest else None,
+    'today': '' if today else None
+    }
+
+    items = _get_items("/data/readings", params, timeout = timeout)
+    if raw:
+        return pd.DataFrame(items)
+    with instrument.stage("ea_rivers.parse_readings") as s:
+        readings = parse_readings(items)
+        s["rows"] = len(readings)
+    return readings
+
+
+def _as_date(value):
+    if value is None:
+        return date.today()
+    return pd.Timestamp(value).date()
+
+
+def _fetch_window(measure_id, start, end):
+    """ Fetch readings for a range of days, splitting it if a page is full """
+    readings = get_readings_for_measure(measure_id,
+                                        startdate = start.isoformat(),
+                                        enddate = end.isoformat(),
+                                        limit = MAX_LIMIT,
+                                        sorted = False)
+    if len(readings) >= MAX_LIMIT:
+        if start < end:
+            mid = start + (end - start) // 2
+            return pd.concat([_fetch_window(measure_id, start, mid),
+                              _fetch_window(measure_id, mid + timedelta(days = 1), end)],
+                             ignore_index = True)
+        warnings.warn(f"{measure_id} has more than {MAX_LIMIT} readings on {start}; "
+                      "some readings are missing")
+    if len(readings):
+        readings = readings.sort_values("dateTime", ignore_index = True)
+    return readings
+
+
+def iter_readings(measure_id,
+                  startdate,
+                  enddate = None,
+                  chunk = 30,
+                  max_workers = 4):
+    """ Stream readings for a measure over a long date range
+
+    The range is split into windows of `chunk` days, each small enough to stay
+    under the API row limit (windows that still fill a page are split again).
+    Windows are fetched with bounded concurrency and yielded in date order.
+
+      :param measure_id:
+            EA API measure id
+      :param startdate:
+            First day of the range, for example 2020-02-17
+      :param enddate:
+            Last day of the range (inclusive). Defaults to today.
+      :param chunk:
+            Window size in days, or a `timedelta`. Defaults to 30 days.
+      :param max_workers:
+            Maximum number of windows fetched at the same time.
+
+      :return: a generator of pandas data frames, oldest readings first
+    """
+    start = _as_date(startdate)
+    end = _as_date(enddate)
+    if isinstance(chunk, timedelta):
+        chunk = chunk.days
+    chunk = max(1, int(chunk))
+
+    windows = []
+    while start <= end:
+        stop = min(start + timedelta(days = chunk - 1), end)
+        windows.append((start, stop))
+        start = stop + timedelta(days = 1)
+
+    with ThreadPoolExecutor(max_workers = max(1, max_workers)) as pool:
+        pending = deque()
+        for window in windows:
+            pending.append(pool.submit(_fetch_window, measure_id, *window))
+            if len(pending) > max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def get_readings_range(measure_id,
+                       startdate,
+                       enddate = None,
+                       chunk = 30,
+                       max_workers = 4):
+    """ Get all readings for a measure over a date range as one data frame
+
+    Convenience wrapper that concatenates the chunks from `iter_readings`.
+
+      :return: a pandas data frame of readings, oldest first
+    """
+    chunks = [c for c in iter_readings(measure_id, startdate, enddate,
+                                       chunk = chunk, max_workers = max_workers)
+              if len(c)]
+    if not chunks:
+        return parse_readings([])
+    return pd.concat(chunks, ignore_index = True)
@@ -0,0 +1,287 @@
+"""
+On-disk HTTP response cache used by `hcc.transport`.
+
+Responses are stored on disk with their `ETag` and `Last-Modified` validators.
+While an entry is within its `Cache-Control: max-age` it is served without
+touching the network; after that the transport sends a conditional request
+(`If-None-Match` / `If-Modified-Since`) and a `304 Not Modified` is answered
+from disk. The cache directory is capped in size, evicting the least recently
+used entries first.
+
+Set `HCC_HTTP_CACHE=0` to turn the cache off for the default transport.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+# Headers kept with a cached body. Content-Encoding and Content-Length are
+# dropped since the body is stored decoded.
+_KEEP_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Date", "Expires")
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-)?max-age\s*=\s*\"?(\d+)", re.IGNORECASE)
+
+
+def _cache_control(headers) -> Dict[str, Any]:
+    """Parse the `Cache-Control` directives that matter to a private cache"""
+    value = headers.get("Cache-Control", "") or ""
+    directives = {d.strip().split("=", 1)[0].lower() for d in value.split(",") if d.strip()}
+    match = _MAX_AGE.search(value)
+    return {
+        "no_store": "no-store" in directives,
+        "no_cache": "no-cache" in directives,
+        "max_age": int(match.group(1)) if match else None,
+    }
+
+
+class CachedEntry:
+    """A response read back from the cache
+
+    :param meta: stored metadata (url, status, headers, stored time, max-age)
+    :param path: path of the body file
+    """
+
+    __slots__ = ("meta", "path")
+
+    def __init__(self, meta: Dict[str, Any], path: str):
+        self.meta = meta
+        self.path = path
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        """True while the entry is within its max-age"""
+        max_age = self.meta.get("max_age")
+        if not max_age:
+            return False
+        if now is None:
+            now = time.time()
+        return now - self.meta["stored"] < max_age
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating this entry"""
+        headers = {}
+        h = self.meta["headers"]
+        if h.get("ETag"):
+            headers["If-None-Match"] = h["ETag"]
+        if h.get("Last-Modified"):
+            headers["If-Modified-Since"] = h["Last-Modified"]
+        return headers
+
+    def response(self) -> requests.Response:
+        """Rebuild a `requests.Response` from the stored body and headers"""
+        with open(self.path, "rb") as f:
+            body = f.read()
+        response = requests.Response()
+        response.status_code = self.meta["status"]
+        response.url = self.meta["url"]
+        response.headers = CaseInsensitiveDict(self.meta["headers"])
+        response.headers["Content-Length"] = str(len(body))
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.reason = "OK"
+        response._content = body
+        response.from_cache = True
+        return response
+
+
+class HttpCache:
+    """Size-capped on-disk store of HTTP responses
+
+    :param directory: where to keep the cache files
+    :param max_bytes: cap on the total size of the stored bodies; the least
+        recently used entries are evicted above it
+    :param default_max_age: seconds to treat responses without a max-age as
+        fresh. By default they are always revalidated.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = DEFAULT_MAX_BYTES,
+                 default_max_age: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.default_max_age = default_max_age
+        self._lock = threading.Lock()
+        self._nbytes = None
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(url: str, vary: Optional[Dict[str, str]] = None) -> str:
+        """Cache key for a fully resolved URL, including its query string
+
+        :param vary: request headers that select a different response, such
+            as credentials; only their hash is stored
+        """
+        text = url
+        if vary:
+            text += "\n" + json.dumps(sorted(vary.items()))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def get(self, url: str, vary: Optional[Dict[str, str]] = None) -> Optional[CachedEntry]:
+        """Return the stored entry for `url` and the `vary` headers, or None"""
+        key = self.key(url, vary)
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            # The body's access time drives LRU eviction
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or meta.get("key", key) != key:
+            return None
+        return CachedEntry(meta, body_path)
+
+    def put(self, url: str, response: requests.Response, vary: Optional[Dict[str, str]] = None) -> bool:
+        """Store a 200 response if its headers allow it
+
+        :param vary: request headers the response depends on; see `key`
+
+        :return: True if the response was stored
+        """
+        if response.status_code != 200:
+            return False
+        cc = _cache_control(response.headers)
+        if cc["no_store"]:
+            return False
+        max_age = 0 if cc["no_cache"] else cc["max_age"]
+        if max_age is None:
+            max_age = self.default_max_age
+        headers = {k: response.headers[k] for k in _KEEP_HEADERS if k in response.headers}
+        if not max_age and "ETag" not in headers and "Last-Modified" not in headers:
+            # Nothing to revalidate against, so it could never be reused
+            return False
+
+        body = response.content
+        if len(body) > self.max_bytes:
+            return False
+        key = self.key(url, vary)
+        meta = {"url": url, "key": key, "status": 200, "headers": headers,
+                "stored": time.time(), "max_age": max_age, "size": len(body)}
+        meta_path, body_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        with self._lock:
+            previous = self._size(body_path)
+            self._write(body_path, body)
+            self._write(meta_path, json.dumps(meta).encode("utf-8"))
+            if self._nbytes is not None:
+                self._nbytes += len(body) - previous
+        self._evict()
+        return True
+
+    def refresh(self, entry: CachedEntry, response: requests.Response) -> None:
+        """Update a stored entry after a `304 Not Modified`"""
+        meta = dict(entry.meta)
+        headers = dict(meta["headers"])
+        for k in _KEEP_HEADERS:
+            if k in response.headers:
+                headers[k] = response.headers[k]
+        cc = _cache_control(headers)
+        max_age = 0 if cc["no_cache"] else cc["max_age"]
+        meta.update(headers=headers, stored=time.time(),
+                    max_age=self.default_max_age if max_age is None else max_age)
+        meta_path, _ = self._paths(meta.get("key") or self.key(meta["url"]))
+        with self._lock:
+            self._write(meta_path, json.dumps(meta).encode("utf-8"))
+        entry.meta = meta
+
+    def clear(self) -> None:
+        """Remove every stored response"""
+        with self._lock:
+            for path in self._files():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._nbytes = 0
+
+    def nbytes(self) -> int:
+        """Total size of the stored bodies"""
+        with self._lock:
+            return self._total()
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        # Write to a temporary file and rename, so readers in other processes
+        # never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _files(self):
+        for sub in os.scandir(self.directory):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    yield entry.path
+
+    def _total(self) -> int:
+        if self._nbytes is None:
+            self._nbytes = sum(self._size(p) for p in self._files() if p.endswith(".body"))
+        return self._nbytes
+
+    def _evict(self) -> None:
+        with self._lock:
+            if self._total() <= self.max_bytes:
+                return
+            bodies = []
+            for path in self._files():
+                if path.endswith(".body"):
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    bodies.append((st.st_mtime, st.st_size, path))
+            bodies.sort()
+            total = sum(size for _, size, _ in bodies)
+            # Evict down to 90% of the cap so a full cache doesn't scan on every put
+            target = int(self.max_bytes * 0.9)
+            for _, size, path in bodies:
+                if total <= target:
+                    break
+                for p in (path, path[:-len(".body")] + ".json"):
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        pass
+                total -= size
+            self._nbytes = total
+
+
+def default_http_cache() -> Optional[HttpCache]:
+    """The cache used by the default transport
+
+    Lives in `http/` under the hcc cache directory; returns None when
+    `HCC_HTTP_CACHE` is set to 0.
+    """
+    from hcc.cache import cache_dir
+
+    if os.environ.get("HCC_HTTP_CACHE", "").lower() in ("0", "false", "no"):
+        return None
+    return HttpCache(os.path.join(cache_dir(), "http"))
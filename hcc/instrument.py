@@ -0,0 +1,202 @@
+"""
+Opt-in instrumentation for hcc.
+
+When enabled, every outbound HTTP call records its wall time, bytes
+transferred and status, and the main hcc functions record their own wall time,
+row counts and the separate parse and plot stages. Cache hits and misses come
+from the `hcc.cache` counters.
+
+    import hcc
+    with hcc.instrument.recording():
+        hcc.plot_thames_level("Walton", parameter = "flow")
+    print(hcc.instrument.report())
+
+Setting the environment variable `HCC_INSTRUMENT=1` enables it at import.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+_enabled = False
+_lock = threading.Lock()
+_events: List[Dict[str, Any]] = []
+_cache_baseline: Dict[str, tuple] = {}
+_started: Optional[float] = None
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Forget recorded events and restart the cache counters"""
+    global _cache_baseline, _started
+    from hcc.cache import cache_stats
+    with _lock:
+        _events.clear()
+        _cache_baseline = {name: info for name, info in cache_stats().items()}
+        _started = time.perf_counter()
+
+
+def enable() -> None:
+    """Start recording"""
+    global _enabled
+    if not _enabled:
+        reset()
+    _enabled = True
+
+
+def disable() -> None:
+    """Stop recording; recorded events are kept until `reset`"""
+    global _enabled
+    _enabled = False
+
+
+@contextmanager
+def recording():
+    """Record events inside a `with` block, starting from a clean slate"""
+    global _enabled
+    was_enabled = _enabled
+    reset()
+    _enabled = True
+    try:
+        yield
+    finally:
+        _enabled = was_enabled
+
+
+def _add(event: Dict[str, Any]) -> None:
+    with _lock:
+        _events.append(event)
+
+
+def record_http(url: str, status: int, nbytes: int, seconds: float, error: str = None) -> None:
+    """Record one outbound HTTP call (called by `hcc.transport`)"""
+    if _enabled:
+        host = urlparse(url).netloc
+        _add({"kind": "http", "name": host, "url": url, "status": status,
+              "bytes": nbytes, "seconds": seconds, "error": error})
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block of code as a named stage
+
+    Yields a dict; set `rows` in it to record how many rows the stage produced.
+    """
+    if not _enabled:
+        yield {}
+        return
+    info: Dict[str, Any] = {}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        _add({"kind": "stage", "name": name, "seconds": time.perf_counter() - start,
+              "rows": info.get("rows")})
+
+
+def timed(name: str):
+    """Decorator recording the wall time and result length of a function"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            error = None
+            result = None
+            try:
+                result = func(*args, **kwargs)
+                return result
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                rows = len(result) if hasattr(result, "__len__") and not isinstance(result, (str, bytes)) else None
+                _add({"kind": "call", "name": name, "seconds": time.perf_counter() - start,
+                      "rows": rows, "error": error})
+        return wrapper
+    return decorator
+
+
+def events() -> List[Dict[str, Any]]:
+    """Return a copy of the recorded events"""
+    with _lock:
+        return list(_events)
+
+
+def summary() -> Dict[str, Any]:
+    """Summarise the recorded events by kind and name"""
+    from hcc.cache import cache_stats
+
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for e in events():
+        g = groups.setdefault((e["kind"], e["name"]), {
+            "kind": e["kind"], "name": e["name"], "calls": 0, "seconds": 0.0,
+            "max_seconds": 0.0, "bytes": 0, "rows": 0, "errors": 0, "status": Counter()})
+        g["calls"] += 1
+        g["seconds"] += e["seconds"]
+        g["max_seconds"] = max(g["max_seconds"], e["seconds"])
+        g["bytes"] += e.get("bytes") or 0
+        g["rows"] += e.get("rows") or 0
+        g["errors"] += bool(e.get("error"))
+        if e.get("status") is not None:
+            g["status"][str(e["status"])] += 1
+
+    caches = {}
+    for name, info in cache_stats().items():
+        before = _cache_baseline.get(name)
+        hits = info.hits - (before.hits if before else 0)
+        misses = info.misses - (before.misses if before else 0)
+        stale = info.stale_hits - (before.stale_hits if before else 0)
+        if hits or misses or stale:
+            caches[name] = {"hits": hits, "misses": misses, "stale_hits": stale,
+                            "currsize": info.currsize}
+
+    rows = sorted(groups.values(), key=lambda g: (g["kind"], -g["seconds"]))
+    for g in rows:
+        g["status"] = dict(g["status"])
+    http = [g for g in rows if g["kind"] == "http"]
+    return {
+        "elapsed_seconds": None if _started is None else time.perf_counter() - _started,
+        "http_calls": sum(g["calls"] for g in http),
+        "http_bytes": sum(g["bytes"] for g in http),
+        "http_seconds": sum(g["seconds"] for g in http),
+        "groups": rows,
+        "caches": caches,
+    }
+
+
+def to_json(path: Optional[str] = None) -> str:
+    """Return the summary as JSON, and write it to `path` if given"""
+    text = json.dumps(summary(), indent=2)
+    if path is not None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+    return text
+
+
+def report() -> str:
+    """Format the summary as a plain text table"""
+    s = summary()
+    lines = [f"{'kind':<6} {'name':<36}{'calls':>6}{'total ms':>10}{'max ms':>9}{'kB':>9}{'rows':>8}{'err':>5}"]
+    for g in s["groups"]:
+        lines.append(f"{g['kind']:<6} {g['name'][:36]:<36}{g['calls']:>6}{g['seconds'] * 1000:>10.1f}"
+                     f"{g['max_seconds'] * 1000:>9.1f}{g['bytes'] / 1024:>9.1f}{g['rows']:>8}{g['errors']:>5}")
+    for name, c in s["caches"].items():
+        lines.append(f"cache  {name.rsplit('.', 1)[-1][:36]:<36} hits {c['hits']}, misses {c['misses']}, stale {c['stale_hits']}")
+    lines.append(f"{s['http_calls']} HTTP calls, {s['http_bytes'] / 1024:.1f} kB, "
+                 f"{s['http_seconds'] * 1000:.0f} ms in HTTP")
+    return "\n".join(lines)
+
+
+if os.environ.get("HCC_INSTRUMENT", "").lower() not in ("", "0", "false", "no"):
+    enable()
@@ -0,0 +1,415 @@
+"""
+Classify river places as local to a club.
+
+A `Locality` knows which of a table of Thames place names are local, either
+a named set of places or every place within a radius of a home point. Rows
+with only text (the "Where" and "From" columns of the gov.uk pages) are
+matched against all the place names with one precompiled alternation; rows
+with coordinates are classified by their distance from home, or by the
+nearest known place. Whole columns are classified in one vectorized call.
+
+The default is the Hampton Court reach, from Shepperton to Teddington:
+Walton, Shepperton, Molesey, Teddington, Kingston and Sunbury, and the locks,
+bridges and variants of those names. Other clubs can set their own, by
+places or by radius:
+
+    import hcc.locality
+    hcc.locality.set_locality(hcc.locality.Locality(home = (51.4839, -0.6044), radius_km = 6))
+"""
+
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+HAMPTON_COURT = (51.4034, -0.3379)
+
+# Places local to Hampton Court; any place whose name contains one of these
+# words is local, so "Walton Bridge" and "East Molesey" are too
+LOCAL_PLACES = ("Walton", "Shepperton", "Molesey", "Teddington", "Kingston", "Sunbury")
+
+EARTH_RADIUS_KM = 6371.0
+
+# Approximate coordinates of towns, locks and landmarks along the Thames and
+# the tideway. Several names can share a point so that the short forms used on
+# gov.uk ("Walton", "Molesey") match too.
+PLACES: Dict[str, Tuple[float, float]] = {
+    # Tideway
+    "Westminster": (51.5010, -0.1240),
+    "Battersea": (51.4800, -0.1600),
+    "Putney": (51.4660, -0.2160),
+    "Hammersmith": (51.4900, -0.2230),
+    "Barnes": (51.4720, -0.2440),
+    "Chiswick": (51.4880, -0.2600),
+    "Mortlake": (51.4680, -0.2680),
+    "Kew": (51.4840, -0.2900),
+    "Kew Bridge": (51.4880, -0.2870),
+    "Brentford": (51.4860, -0.3090),
+    "Isleworth": (51.4710, -0.3240),
+    "Richmond": (51.4613, -0.3037),
+    "Richmond Lock": (51.4660, -0.3170),
+    "Twickenham": (51.4470, -0.3290),
+    "Eel Pie Island": (51.4450, -0.3250),
+    "Ham": (51.4390, -0.3100),
+    "Teddington": (51.4270, -0.3320),
+    "Teddington Lock": (51.4306, -0.3227),
+    # Teddington to Shepperton
+    "Hampton Wick": (51.4140, -0.3120),
+    "Kingston": (51.4123, -0.3007),
+    "Kingston upon Thames": (51.4123, -0.3007),
+    "Kingston Bridge": (51.4120, -0.3080),
+    "Raven's Ait": (51.3990, -0.3080),
+    "Surbiton": (51.3930, -0.3030),
+    "Thames Ditton": (51.3890, -0.3310),
+    "Hampton Court": HAMPTON_COURT,
+    "Hampton Court Bridge": (51.4030, -0.3420),
+    "Molesey": (51.4027, -0.3432),
+    "Molesey Lock": (51.4027, -0.3432),
+    "East Molesey": (51.4000, -0.3490),
+    "West Molesey": (51.3990, -0.3740),
+    "Tagg's Island": (51.4080, -0.3550),
+    "Hampton": (51.4150, -0.3680),
+    "Platt's Eyot": (51.4120, -0.3760),
+    "Sunbury": (51.4057, -0.4130),
+    "Sunbury Lock": (51.4050, -0.4037),
+    "Walton": (51.3868, -0.4171),
+    "Walton-on-Thames": (51.3868, -0.4171),
+    "Walton Bridge": (51.3903, -0.4194),
+    "Desborough Cut": (51.3820, -0.4360),
+    "Shepperton": (51.3960, -0.4490),
+    "Shepperton Lock": (51.3963, -0.4533),
+    # Upstream of Shepperton
+    "Weybridge": (51.3715, -0.4575),
+    "Chertsey": (51.3890, -0.5090),
+    "Chertsey Lock": (51.3896, -0.4887),
+    "Laleham": (51.4080, -0.4900),
+    "Penton Hook": (51.4186, -0.4981),
+    "Penton Hook Lock": (51.4186, -0.4981),
+    "Staines": (51.4340, -0.5110),
+    "Staines-upon-Thames": (51.4340, -0.5110),
+    "Egham": (51.4310, -0.5480),
+    "Bell Weir Lock": (51.4320, -0.5450),
+    "Runnymede": (51.4440, -0.5640),
+    "Old Windsor": (51.4610, -0.5830),
+    "Old Windsor Lock": (51.4610, -0.5830),
+    "Datchet": (51.4840, -0.5790),
+    "Romney Lock": (51.4860, -0.6040),
+    "Windsor": (51.4839, -0.6044),
+    "Eton": (51.4920, -0.6080),
+    "Boveney Lock": (51.4940, -0.6440),
+    "Dorney": (51.4960, -0.6620),
+    "Bray": (51.5080, -0.7000),
+    "Bray Lock": (51.5080, -0.6970),
+    "Maidenhead": (51.5220, -0.7190),
+    "Boulter's Lock": (51.5330, -0.7100),
+    "Cookham": (51.5600, -0.7100),
+    "Cookham Lock": (51.5570, -0.7000),
+    "Bourne End": (51.5760, -0.7100),
+    "Marlow": (51.5680, -0.7750),
+    "Marlow Lock": (51.5660, -0.7690),
+    "Temple Lock": (51.5550, -0.8000),
+    "Hurley": (51.5480, -0.8090),
+    "Hurley Lock": (51.5490, -0.8210),
+    "Hambleden Lock": (51.5590, -0.8680),
+    "Henley": (51.5360, -0.9020),
+    "Henley-on-Thames": (51.5360, -0.9020),
+    "Marsh Lock": (51.5300, -0.8980),
+    "Wargrave": (51.5010, -0.8670),
+    "Shiplake": (51.5080, -0.8960),
+    "Shiplake Lock": (51.5080, -0.8960),
+    "Sonning": (51.4730, -0.9140),
+    "Sonning Lock": (51.4730, -0.9140),
+    "Caversham": (51.4670, -0.9730),
+    "Caversham Lock": (51.4610, -0.9600),
+    "Reading": (51.4560, -0.9710),
+    "Mapledurham Lock": (51.4860, -1.0280),
+    "Purley": (51.4830, -1.0480),
+    "Pangbourne": (51.4860, -1.0860),
+    "Whitchurch Lock": (51.4870, -1.0870),
+    "Goring": (51.5220, -1.1380),
+    "Goring Lock": (51.5210, -1.1390),
+    "Streatley": (51.5220, -1.1450),
+    "Cleeve Lock": (51.5350, -1.1400),
+    "Wallingford": (51.5990, -1.1250),
+    "Benson": (51.6200, -1.1110),
+    "Benson Lock": (51.6200, -1.1110),
+    "Shillingford": (51.6270, -1.1390),
+    "Dorchester": (51.6440, -1.1660),
+    "Days Lock": (51.6380, -1.1790),
+    "Clifton Hampden": (51.6550, -1.2100),
+    "Clifton Lock": (51.6530, -1.2320),
+    "Culham": (51.6550, -1.2600),
+    "Culham Lock": (51.6530, -1.2710),
+    "Abingdon": (51.6710, -1.2830),
+    "Abingdon Lock": (51.6720, -1.2740),
+    "Sandford Lock": (51.7110, -1.2290),
+    "Iffley": (51.7290, -1.2380),
+    "Iffley Lock": (51.7300, -1.2370),
+    "Oxford": (51.7520, -1.2577),
+    "Osney Lock": (51.7490, -1.2710),
+    "Godstow Lock": (51.7750, -1.2950),
+    "King's Lock": (51.7920, -1.3090),
+    "Eynsham": (51.7800, -1.3750),
+    "Eynsham Lock": (51.7740, -1.3600),
+    "Pinkhill Lock": (51.7640, -1.3800),
+    "Northmoor Lock": (51.7150, -1.4210),
+    "Newbridge": (51.7070, -1.4180),
+    "Radcot": (51.6930, -1.5870),
+    "Lechlade": (51.6930, -1.6910),
+    "St John's Lock": (51.6920, -1.6790),
+    "Cricklade": (51.6410, -1.8560),
+}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great circle distance in km, broadcasting over numpy arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype = np.float64))
+                              for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _normalise(text: pd.Series) -> pd.Series:
+    """Lower case with typographic apostrophes replaced, as place names are keyed"""
+    return text.str.replace("’", "'", regex = False).str.lower()
+
+
+def _alternation(keys: Iterable[str]) -> str:
+    """Regex alternation over `keys` with shared prefixes factored out
+
+    A flat alternation of a hundred-odd place names retries every name at
+    each position; as a trie the regex engine rejects most positions after
+    one character. Where one key is a prefix of another the longer is tried
+    first.
+    """
+    trie: dict = {}
+    for key in keys:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        end = "" in node
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        if len(alts) == 1 and not end:
+            return alts[0]
+        return "(?:" + "|".join(alts) + ")" + ("?" if end else "")
+
+    return build(trie)
+
+
+class GridIndex:
+    """Uniform lat/long grid over a set of points, for radius queries
+
+    :param lat: latitudes of the points
+    :param lon: longitudes of the points
+    :param cell_km: size of a grid cell
+    """
+
+    def __init__(self, lat: Iterable[float], lon: Iterable[float], cell_km: float = 5.0):
+        self.lat = np.asarray(lat, dtype = np.float64)
+        self.lon = np.asarray(lon, dtype = np.float64)
+        self.cell_lat = cell_km / 111.2
+        # Cells are square at the mean latitude of the points, which is
+        # plenty for a river catchment
+        mean_lat = float(np.nanmean(self.lat)) if len(self.lat) else 0.0
+        self.cell_lon = cell_km / (111.2 * max(math.cos(math.radians(mean_lat)), 0.01))
+        self._cells: Dict[Tuple[int, int], list] = defaultdict(list)
+        rows, cols = self._cell(self.lat, self.lon)
+        for i, (r, c) in enumerate(zip(rows.tolist(), cols.tolist())):
+            self._cells[(r, c)].append(i)
+
+    def _cell(self, lat, lon):
+        return (np.floor(np.asarray(lat) / self.cell_lat).astype(np.int64),
+                np.floor(np.asarray(lon) / self.cell_lon).astype(np.int64))
+
+    def within(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Indices of the points within `radius_km` of `(lat, lon)`"""
+        r, c = (int(v) for v in self._cell(lat, lon))
+        dr = int(math.ceil(radius_km / 111.2 / self.cell_lat))
+        dc = int(math.ceil(radius_km / 111.2 / max(math.cos(math.radians(lat)), 0.01) / self.cell_lon))
+        candidates = [i for rr in range(r - dr, r + dr + 1) for cc in range(c - dc, c + dc + 1)
+                      for i in self._cells.get((rr, cc), ())]
+        if not candidates:
+            return np.empty(0, dtype = np.int64)
+        candidates = np.asarray(candidates, dtype = np.int64)
+        d = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        return np.sort(candidates[d <= radius_km])
+
+    def nearest(self, lat: float, lon: float) -> Tuple[int, float]:
+        """Index of and distance to the point nearest `(lat, lon)`"""
+        if not len(self.lat):
+            raise ValueError("The index is empty")
+        r, c = (int(v) for v in self._cell(lat, lon))
+        candidates = []
+        for ring in range(64):
+            candidates = [i for rr in range(r - ring, r + ring + 1) for cc in range(c - ring, c + ring + 1)
+                          if max(abs(rr - r), abs(cc - c)) == ring
+                          for i in self._cells.get((rr, cc), ())]
+            if candidates:
+                break
+        if candidates:
+            # The nearest point in the first non-empty ring bounds the search
+            d = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+            candidates = self.within(lat, lon, float(d.min()) + 1e-9)
+        else:
+            candidates = np.arange(len(self.lat))
+        d = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        best = int(np.argmin(d))
+        return int(candidates[best]), float(d[best])
+
+
+class Locality:
+    """Decide which places count as local to a home point
+
+    Without `radius_km` or `local_places`, the places named in `LOCAL_PLACES`
+    are local.
+
+    :param home: `(lat, long)` of the club
+    :param radius_km: places within this distance of home are local
+    :param local_places: words naming the local places, instead of a radius;
+        a place is local if its name contains one of them
+    :param places: mapping of place names to `(lat, long)`, by default `PLACES`
+    :param stations: extra named points, for example EA station labels and
+        coordinates; see `Locality.from_catalog`
+    """
+
+    LOCAL = 'Local'
+    NOT_LOCAL = 'No'
+
+    def __init__(self,
+                 home: Tuple[float, float] = HAMPTON_COURT,
+                 radius_km: Optional[float] = None,
+                 local_places: Optional[Iterable[str]] = None,
+                 places: Optional[Dict[str, Tuple[float, float]]] = None,
+                 stations: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.home = (float(home[0]), float(home[1]))
+        if radius_km is None and local_places is None:
+            local_places = LOCAL_PLACES
+        if radius_km is not None and local_places is not None:
+            raise ValueError("Give radius_km or local_places, not both")
+        self.radius_km = None if radius_km is None else float(radius_km)
+
+        table = dict(PLACES if places is None else places)
+        for name, point in (stations or {}).items():
+            if pd.notna(point[0]) and pd.notna(point[1]):
+                table.setdefault(name, point)
+        self.names = list(table)
+        lat = [table[n][0] for n in self.names]
+        lon = [table[n][1] for n in self.names]
+        self.index = GridIndex(lat, lon, cell_km = max((self.radius_km or 5.0) / 2, 1.0))
+
+        if self.radius_km is not None:
+            local = self.index.within(self.home[0], self.home[1], self.radius_km)
+        else:
+            words = re.compile(r"\b(?:" + "|".join(re.escape(w.replace("’", "'").lower())
+                                                   for w in local_places) + r")\b")
+            local = [i for i, n in enumerate(self.names) if words.search(n.replace("’", "'").lower())]
+        self.local_names = frozenset(self.names[i].replace("’", "'").lower() for i in local)
+        self._local = np.zeros(len(self.names), dtype = bool)
+        self._local[list(local)] = True
+
+        # The longest name wins, so "Walton Bridge" is found rather than "Walton"
+        keys = {n.replace("’", "'").lower() for n in self.names}
+        self.pattern = re.compile(r"\b(" + _alternation(keys) + r")\b")
+
+    @classmethod
+    def from_catalog(cls, river_name: str = "River Thames", **kwargs) -> "Locality":
+        """A locality that also knows the EA station labels on a river
+
+        The station table comes from the (cached) EA catalog, so this makes
+        a request the first time it's called.
+        """
+        from hcc.core import get_station_index
+
+        stations = {r.label: (r.lat, r.long) for r in get_station_index(river_name).records}
+        return cls(stations = stations, **kwargs)
+
+    def distance_km(self, lat, lon) -> np.ndarray:
+        """Distance from home for arrays of coordinates"""
+        return haversine_km(self.home[0], self.home[1], lat, lon)
+
+    def is_local(self, text = None, lat = None, lon = None) -> np.ndarray:
+        """Boolean array marking the local rows
+
+        Rows with coordinates are classified by distance from home, or with
+        `local_places` by whether the nearest known place is local. The other
+        rows are classified by the place names in `text`: a row is local if
+        any place it mentions is local.
+
+        :param text: place descriptions, one per row
+        :param lat: latitudes, one per row, NaN where unknown
+        :param lon: longitudes, one per row, NaN where unknown
+        """
+        if text is None and lat is None:
+            raise ValueError("Give text, coordinates or both")
+        n = len(text) if text is not None else len(lat)
+        result = np.zeros(n, dtype = bool)
+
+        todo = np.ones(n, dtype = bool)
+        if lat is not None:
+            lat = np.asarray(lat, dtype = np.float64)
+            lon = np.asarray(lon, dtype = np.float64)
+            known = ~(np.isnan(lat) | np.isnan(lon))
+            if self.radius_km is not None:
+                result[known] = self.distance_km(lat[known], lon[known]) <= self.radius_km
+            elif known.any():
+                # Distances from every row to every known place, a few hundred columns
+                d = haversine_km(lat[known, None], lon[known, None], self.index.lat, self.index.lon)
+                result[known] = self._local[np.argmin(d, axis = 1)]
+            todo = ~known
+
+        if text is not None and todo.any():
+            s = pd.Series(np.asarray(text, dtype = object)[todo]).fillna("").astype(str)
+            # Columns repeat the same few places, so match each distinct text
+            # once, and run the regex over all of them joined in a single pass
+            codes, uniques = pd.factorize(_normalise(s))
+            lengths = np.fromiter(map(len, uniques), dtype = np.int64, count = len(uniques))
+            starts = np.cumsum(lengths + 1) - (lengths + 1)
+            local = self.local_names
+            found = [m.start() for m in self.pattern.finditer("\n".join(uniques))
+                     if m.group(1) in local]
+            hits = np.zeros(len(uniques), dtype = bool)
+            hits[np.searchsorted(starts, found, side = 'right') - 1] = True
+            result[todo] = hits[codes]
+        return result
+
+    def classify(self, text = None, lat = None, lon = None) -> np.ndarray:
+        """Label rows 'Local' or 'No'; see `is_local` for the arguments"""
+        return np.where(self.is_local(text, lat, lon), self.LOCAL, self.NOT_LOCAL).astype(object)
+
+    def nearest_place(self, lat: float, lon: float) -> Tuple[str, float]:
+        """Name of and distance to the known place nearest a point"""
+        i, d = self.index.nearest(lat, lon)
+        return self.names[i], d
+
+
+_locality: Optional[Locality] = None
+
+
+def get_locality() -> Locality:
+    """Return the module-level locality, creating the Hampton Court default on first use"""
+    global _locality
+    if _locality is None:
+        _locality = Locality()
+    return _locality
+
+
+def set_locality(locality: Optional[Locality]) -> Optional[Locality]:
+    """Replace the module-level locality used by `find_local` and the scrapers
+
+    Passing `None` resets to the Hampton Court default on next use.
+
+    :return: the previous locality
+    """
+    global _locality
+    previous = _locality
+    _locality = locality
+    return previous
@@ -1,31 +1,146 @@
 
-import requests
 import json
+import math
+import threading
+import time
+import warnings
 import dotenv
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Mapping, Optional, Tuple, Union
+import numpy as np
 import pandas as pd
 import os
 
+try:
+    # orjson decodes the forecast JSON several times faster
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+from hcc import instrument
+from hcc.cache import ttl_cache
+from hcc.transport import get_transport
+
+API_ROOT = 'https://data.hub.api.metoffice.gov.uk/sitespecific/v0/point'
+
+# Site-specific forecasts are refreshed hourly
+FORECAST_TTL = 3600
+
+# How often each forecast type is republished, and roughly how long after the
+# hour a new run appears. Cached forecasts expire when the next run is due.
+MODEL_UPDATE_INTERVAL = {
+    "hourly": 3600,
+    "three-hourly": 3600,
+    "daily": 3 * 3600,
+}
+MODEL_PUBLISH_DELAY = 15 * 60
+
+# Spacing of the forecast grid; points closer than this share a forecast
+GRID_KM = 2.0
+
+# Requests per second sent by `get_weather_many`
+RATE_LIMIT = 5.0
+
 # call Met Office weatherhub API to retrieve site specific weather data
 # https://data.hub.api.metoffice.gov.uk/sitespecific/v0/point
 
-def _decode_response(response: any) -> pd.DataFrame:
-    resp = json.loads(response)
+# Weather codes in lookup order: the code plus one indexes the table, with
+# anything unknown or missing ("NA") mapped to the last slot
+_CODE_KEYS = [str(code) for code in range(-1, 31)] + ['NA']
+_NA_SLOT = len(_CODE_KEYS) - 1
+
+
+def _code_lookup(table: Dict[str, str]):
+    """Precompute the categorical codes and categories for a code table"""
+    categories = list(dict.fromkeys(table[k] for k in _CODE_KEYS))
+    position = {c: i for i, c in enumerate(categories)}
+    return (np.array([position[table[k]] for k in _CODE_KEYS], dtype = np.int8),
+            pd.CategoricalDtype(categories))
+
+
+def _code_slots(codes) -> np.ndarray:
+    """Positions of weather codes in `_CODE_KEYS`"""
+    values = pd.to_numeric(pd.Series(codes), errors = 'coerce').to_numpy(dtype = np.float64, na_value = np.nan)
+    slots = np.full(len(values), _NA_SLOT, dtype = np.int64)
+    valid = ~np.isnan(values) & (values >= -1) & (values <= 30)
+    slots[valid] = values[valid].astype(np.int64) + 1
+    return slots
+
+
+def _describe(codes):
+    """Description and icon categoricals for a column of weather codes"""
+    slots = _code_slots(codes)
+    return (pd.Categorical.from_codes(_DESCRIPTION_LOOKUP[0][slots], dtype = _DESCRIPTION_LOOKUP[1]),
+            pd.Categorical.from_codes(_ICON_LOOKUP[0][slots], dtype = _ICON_LOOKUP[1]))
+
+
+_INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def _column(values: list):
+    """Build a compact array from one JSON field
+
+    Whole numbers become the smallest signed int that holds them, other
+    numbers float32 (missing values as NaN), and anything else is left as is.
+    """
+    if all(type(v) is int for v in values):
+        lo, hi = (min(values), max(values)) if values else (0, 0)
+        for t in _INT_TYPES:
+            info = np.iinfo(t)
+            if info.min <= lo and hi <= info.max:
+                return np.array(values, dtype = t)
+    if all(v is None or type(v) in (int, float) for v in values):
+        return np.array([np.nan if v is None else v for v in values], dtype = np.float32)
+    return values
+
+
+def _parse_times(times) -> pd.DatetimeIndex:
+    """Parse Met Office "YYYY-MM-DDTHH:MMZ" times into a UTC index"""
+    try:
+        # numpy parses the ISO form directly once the "Z" is dropped
+        parsed = np.array([t[:-1] if t.endswith('Z') else t for t in times], dtype = 'datetime64[ns]')
+        index = pd.DatetimeIndex(parsed).tz_localize('UTC')
+    except (TypeError, ValueError, AttributeError):
+        index = pd.DatetimeIndex(pd.to_datetime(list(times), utc = True, format = 'ISO8601'))
+    return index.rename('time')
+
+
+@instrument.timed("metoffice._decode_response")
+def _decode_response(response: Union[bytes, str, Dict[str, Any]]) -> pd.DataFrame:
+    """Decode a site-specific forecast into a data frame indexed by time
+
+    Weather codes are mapped to `description` and `icon` categoricals. The
+    daily forecast has separate day and night codes, which become
+    `dayDescription`, `dayIcon`, `nightDescription` and `nightIcon`;
+    `description` and `icon` then describe the day.
+
+    :param response: the response body as bytes or str, or already decoded
+    :return: a data frame with a tz-aware (UTC) `time` index, float32 and
+        small integer measurements and categorical descriptions
+    """
+    resp = response if isinstance(response, dict) else _loads(response)
     fcst = resp['features'][0]['properties']['timeSeries']
 
-    import pandas as pd
-    df = pd.DataFrame(fcst)
-    
-    wc = df['significantWeatherCode'].map(str)
-    df['description'] = [weather_codes[w] for w in wc]
-    df['icon'] = [weather_code_icons[w] for w in wc]
-    # df.head()
-    return(df)
+    # Build each column once, with its final dtype, rather than letting
+    # pandas infer object columns and converting them afterwards
+    keys = dict.fromkeys(k for row in fcst for k in row)
+    columns = {k: [row.get(k) for row in fcst] for k in keys}
+    index = _parse_times(columns.pop('time')) if 'time' in columns else None
+    data = {k: _column(v) for k, v in columns.items()}
+
+    for prefix in ['', 'day', 'night']:
+        code = prefix + ('S' if prefix else 's') + 'ignificantWeatherCode'
+        if code in data:
+            description, icon = _describe(data[code])
+            data[prefix + ('Description' if prefix else 'description')] = description
+            data[prefix + ('Icon' if prefix else 'icon')] = icon
+    if 'description' not in data and 'dayDescription' in data:
+        data['description'] = data['dayDescription']
+        data['icon'] = data['dayIcon']
 
-    # from datetime import datetime
-    # datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    df = pd.DataFrame(data, index = index)
+    return(df)
 
-    # return(df)
 
 def get_api_key() -> str:
     """Get the Met Office API key from the environment variable or .env file"""
@@ -50,6 +165,15 @@ def get_api_key() -> str:
 
     return(api_key)
 
+def _forecast_ttl(lat = None, lon = None, type = None, api_key = None, now = None) -> float:
+    """Seconds until the next model run of `type` should be available"""
+    interval = MODEL_UPDATE_INTERVAL.get(type or "three-hourly", FORECAST_TTL)
+    if now is None:
+        now = time.time()
+    return interval - (now - MODEL_PUBLISH_DELAY) % interval
+
+
+@ttl_cache(ttl = _forecast_ttl, maxsize = 64)
 def get_weather(lat:float, lon:float, type:Optional[str] = None, api_key:Optional[str] = None) -> pd.DataFrame:
     """Get weather forecast data from the Met Office API
 
@@ -60,6 +184,9 @@ def get_weather(lat:float, lon:float, type:Optional[str] = None, api_key:Optiona
     :param: type: type of forecast, can be one of "hourly", "three-hourly" or "daily". Default is "hourly".
 
     :param: api_key: Met Office API key. If not provided, it will be read from the environment variable or .env file
+
+    Forecasts are cached until the next model run is due, see
+    `MODEL_UPDATE_INTERVAL`.
     """
     if type is None:
         type = "three-hourly"
@@ -74,10 +201,11 @@ def get_weather(lat:float, lon:float, type:Optional[str] = None, api_key:Optiona
     df = _decode_response(resp)
     return(df)
 
+@instrument.timed("metoffice._call_weather_api")
 def _call_weather_api(lat:float, lon:float, type:Optional[str] = None, api_key:Optional[str] = None) -> Dict[str, Any]:
     """Get weather forecast data from the Met Office API
 
-    :return: a json object with the weather forecast data
+    :return: the JSON response body as bytes
 
     >>> call_weather_api()
     """
@@ -100,24 +228,131 @@ def _call_weather_api(lat:float, lon:float, type:Optional[str] = None, api_key:O
         'apikey': api_key
         }
 
-    api_url = 'https://data.hub.api.metoffice.gov.uk/sitespecific/v0/point'
-    api_url = api_url + '/' + type
+    api_url = API_ROOT + '/' + type
 
     try:
-        response = requests.get(api_url, headers = headers, params = params)
-        success = True
+        response = get_transport().get(api_url, headers = headers, params = params)
     except Exception as e:
         print('Failed to retrieve data:', e)
-        print('status code:', response.status_code)
-        
-        # stop the program
-        success = False
+        # HTTP errors carry the response; connection errors don't
+        failed = getattr(e, 'response', None)
+        if failed is not None:
+            print('status code:', failed.status_code)
+        raise
 
-    
-    resp = response.text
+    resp = response.content
     return(resp)
 
 
+def snap_to_grid(lat: float, lon: float, grid_km: float = GRID_KM) -> Tuple[float, float]:
+    """Snap a point to the centre of its forecast grid cell
+
+    Cells are `grid_km` across, so nearby points (for example a lock and
+    the weir next to it) share one forecast request.
+    """
+    step_lat = grid_km / 111.2
+    cell_lat = (math.floor(lat / step_lat) + 0.5) * step_lat
+    # The longitude step depends on the cell's latitude, not the point's, so
+    # that every point in a row of cells uses the same step
+    step_lon = grid_km / (111.2 * max(math.cos(math.radians(cell_lat)), 0.01))
+    cell_lon = (math.floor(lon / step_lon) + 0.5) * step_lon
+    return round(cell_lat, 5), round(cell_lon, 5)
+
+
+class _RateLimiter:
+    """Space out calls from several threads to at most `rate` per second"""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+@ttl_cache(ttl = _forecast_ttl, maxsize = 512)
+def _get_cell_weather(lat: float, lon: float, type: str, api_key: str) -> pd.DataFrame:
+    """Decoded forecast for one grid cell, cached until the next model run"""
+    return _decode_response(_call_weather_api(lat, lon, type, api_key = api_key))
+
+
+@instrument.timed("metoffice.get_weather_many")
+def get_weather_many(points: Union[Mapping[Any, Tuple[float, float]], Iterable[Tuple[float, float]]],
+                     type: Optional[str] = None,
+                     api_key: Optional[str] = None,
+                     grid_km: float = GRID_KM,
+                     max_workers: int = 4,
+                     rate_limit: Optional[float] = RATE_LIMIT) -> pd.DataFrame:
+    """Get forecasts for many points, one request per forecast grid cell
+
+    Points are snapped to a grid (`snap_to_grid`) so that nearby points share
+    a request, the distinct cells are fetched concurrently, and each cell's
+    forecast is cached until the next model run. Cells that fail are left
+    out with a warning.
+
+    :param points: a mapping of names to `(lat, lon)`, or a sequence of
+        `(lat, lon)` pairs, which are then keyed by position
+
+    :param type: type of forecast, one of "hourly", "three-hourly" or "daily". Default is "three-hourly".
+
+    :param api_key: Met Office API key. If not provided, it will be read from the environment variable or .env file
+
+    :param grid_km: grid spacing used to merge nearby points
+
+    :param max_workers: number of requests in flight at once
+
+    :param rate_limit: maximum requests started per second, or None for no limit
+
+    :return: a long data frame with one row per point and forecast time, with
+        columns `point`, `lat`, `lon`, `cell_lat`, `cell_lon`, `time` followed
+        by the forecast columns
+    """
+    if type is None:
+        type = "three-hourly"
+    if type not in ["hourly", "three-hourly", "daily"]:
+        raise ValueError("type must be one of 'hourly', 'three-hourly' or 'daily'")
+    if api_key is None:
+        api_key = get_api_key()
+
+    items = points.items() if isinstance(points, Mapping) else enumerate(points)
+    table = pd.DataFrame([(key, float(lat), float(lon)) + snap_to_grid(lat, lon, grid_km)
+                          for key, (lat, lon) in items],
+                         columns = ['point', 'lat', 'lon', 'cell_lat', 'cell_lon'])
+    cells = list(dict.fromkeys(zip(table['cell_lat'], table['cell_lon'])))
+
+    limiter = _RateLimiter(rate_limit)
+
+    def fetch(cell):
+        # Cached cells don't count against the rate limit
+        if not _get_cell_weather.cache.contains(*cell, type, api_key):
+            limiter.wait()
+        return _get_cell_weather(*cell, type, api_key)
+
+    frames, failed = {}, []
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(cells) or 1))) as pool:
+        for cell, future in [(cell, pool.submit(fetch, cell)) for cell in cells]:
+            try:
+                frames[cell] = future.result()
+            except Exception as e:
+                failed.append((cell, e))
+    if failed:
+        warnings.warn(f"No forecast for {len(failed)} of {len(cells)} grid cells: "
+                      + "; ".join(f"{cell}: {e!r}" for cell, e in failed[:3]))
+
+    if not frames:
+        return table.iloc[0:0]
+    forecasts = pd.concat(frames, names = ['cell_lat', 'cell_lon']).reset_index()
+    return table.merge(forecasts, on = ['cell_lat', 'cell_lon'], how = 'inner').reset_index(drop = True)
+
+
 weather_codes = {
 'NA':	'Not available',
 '-1':	'Trace rain',
@@ -188,4 +423,7 @@ weather_code_icons = {
 '28':	'wi-night-thunderstorm',       # Thunder shower (night)
 '29':	'wi-day-thunderstorm',         # Thunder shower (day)
 '30':	'wi-thunderstorm'          # Thunder
-}
\ No newline at end of file
+}
+
+_DESCRIPTION_LOOKUP = _code_lookup(weather_codes)
+_ICON_LOOKUP = _code_lookup(weather_code_icons)
@@ -0,0 +1,344 @@
+"""
+Long-running poller for new EA readings.
+
+The EA publishes a reading for each measure about every 15 minutes, but
+each station reports on its own schedule and with its own delay. A `Poller`
+tracks a set of measures and polls each one with `since` set to its last
+reading. It learns each measure's interval between readings and the delay
+before they appear, and schedules the next poll just after the next reading
+is expected. Polls are spread with random jitter, retried with growing
+delays when a reading is late or a request fails, and run on a fixed number
+of worker threads. New readings are passed to the registered callbacks.
+
+    poller = hcc.poller.Poller()
+    poller.track_station("Walton", parameter = "flow")
+    poller.subscribe(lambda measure, df: print(measure, len(df)))
+    poller.start()
+
+The poller takes its time from a clock, so it can be driven step by step
+with a `SimulatedClock` (see `bench/poll.py`).
+"""
+
+import random
+import statistics
+import threading
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+import hcc.ea_rivers as ea_rivers
+
+# Interval between readings assumed until a measure's own is learnt
+DEFAULT_INTERVAL = 900.0
+
+# Seconds to wait past the expected publication time before polling
+DEFAULT_MARGIN = 20.0
+
+# Upper bound of the random delay added to every poll
+DEFAULT_JITTER = 15.0
+
+# First retry delay after a poll fails; doubles each time
+RETRY_DELAY = 60.0
+
+# Longest delay between polls of a failing measure
+MAX_BACKOFF = 1800.0
+
+# Readings fetched on the first poll of a measure, to learn its interval
+DEFAULT_HISTORY = 6 * 3600.0
+
+# Intervals between readings remembered per measure
+_SAMPLES = 16
+
+# Each poll that finds its reading already there tries this much earlier next
+# time, so a delay that shrinks is noticed
+_PROBE = 2.5
+
+Callback = Callable[[str, pd.DataFrame], None]
+
+
+class SystemClock:
+    """Wall clock time"""
+
+    def time(self) -> float:
+        return time.time()
+
+    def wait(self, stop: threading.Event, seconds: float) -> bool:
+        """Sleep for `seconds` or until `stop` is set; return True if it was set"""
+        return stop.wait(max(seconds, 0))
+
+
+class SimulatedClock:
+    """A clock that only moves when waited on or advanced
+
+    :param start: starting time in seconds since the epoch, by default now
+    """
+
+    def __init__(self, start: Optional[float] = None):
+        self.now = time.time() if start is None else float(start)
+
+    def time(self) -> float:
+        return self.now
+
+    def wait(self, stop: threading.Event, seconds: float) -> bool:
+        self.now += max(seconds, 0)
+        return stop.is_set()
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class Tracked:
+    """Polling state of one measure"""
+
+    __slots__ = ("measure", "last", "intervals", "lag", "due", "polled", "misses", "errors",
+                 "polls", "readings")
+
+    def __init__(self, measure: str, due: float):
+        self.measure = measure
+        self.last: Optional[float] = None
+        self.intervals: deque = deque(maxlen = _SAMPLES)
+        # Estimated delay between a reading's time and it being available
+        self.lag = 0.0
+        self.due = due
+        self.polled: Optional[float] = None
+        self.misses = 0
+        self.errors = 0
+        self.polls = 0
+        self.readings = 0
+
+    @property
+    def interval(self) -> float:
+        """Typical time between readings"""
+        return statistics.median(self.intervals) if self.intervals else DEFAULT_INTERVAL
+
+
+class Poller:
+    """Polls a set of measures for new readings
+
+    :param measures: measure ids to track from the start
+    :param max_workers: requests in flight at once
+    :param clock: source of time, by default the wall clock
+    :param margin: seconds to wait past a reading's expected publication
+    :param jitter: upper bound in seconds of the random delay added to each poll
+    :param history: seconds of readings fetched on a measure's first poll
+    :param seed: seed for the jitter, for repeatable runs
+    """
+
+    def __init__(self,
+                 measures: Iterable[str] = (),
+                 max_workers: int = 4,
+                 clock = None,
+                 margin: float = DEFAULT_MARGIN,
+                 jitter: float = DEFAULT_JITTER,
+                 history: float = DEFAULT_HISTORY,
+                 seed: Optional[int] = None):
+        self.clock = clock or SystemClock()
+        self.max_workers = max_workers
+        self.margin = margin
+        self.jitter = jitter
+        self.history = history
+        self._random = random.Random(seed)
+        self._tracked: Dict[str, Tracked] = {}
+        self._callbacks: List[Callback] = []
+        self._error_callbacks: List[Callable[[str, Exception], None]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        for measure in measures:
+            self.track(measure)
+
+    def track(self, measure_id: str) -> None:
+        """Start polling a measure; its first poll is due now"""
+        with self._lock:
+            if measure_id not in self._tracked:
+                self._tracked[measure_id] = Tracked(measure_id, self.clock.time())
+
+    def track_station(self, station_search, position = "upstream", parameter = "level",
+                      river_name = "River Thames") -> str:
+        """Track the measure `get_thames_metric` reads for a station; return its id"""
+        import hcc.core as core
+
+        station = core.lookup_thames_station(station_search, river_name = river_name)
+        ids = [m for m in station.measures if f"-{parameter}-" in m]
+        index = 0 if position == "upstream" else 1
+        if len(ids) <= index:
+            raise ValueError(f"{station.label} has no {position} {parameter} measure")
+        self.track(ids[index])
+        return ids[index]
+
+    def untrack(self, measure_id: str) -> None:
+        with self._lock:
+            self._tracked.pop(measure_id, None)
+
+    def subscribe(self, callback: Callback) -> Callback:
+        """Call `callback(measure_id, readings)` with each batch of new readings
+
+        Readings are a data frame like `get_readings_for_measure` returns,
+        newest first. Callbacks run one at a time on the polling thread.
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def on_error(self, callback: Callable[[str, Exception], None]) -> Callable[[str, Exception], None]:
+        """Call `callback(measure_id, exception)` when a poll or a subscriber fails
+
+        Without an error callback, failures are reported with `warnings.warn`.
+        """
+        self._error_callbacks.append(callback)
+        return callback
+
+    def _fetch(self, tracked: Tracked, now: float) -> pd.DataFrame:
+        since = now - self.history if tracked.last is None else tracked.last
+        return ea_rivers.get_readings_for_measure(
+            tracked.measure, since = pd.Timestamp(since, unit = "s", tz = "UTC").strftime("%Y-%m-%dT%H:%M:%SZ"),
+            limit = ea_rivers.MAX_LIMIT)
+
+    def _schedule(self, tracked: Tracked, now: float, df: Optional[pd.DataFrame],
+                  error: Optional[Exception]) -> Optional[pd.DataFrame]:
+        """Update a measure's state after a poll and set its next poll; return the new readings"""
+        tracked.polls += 1
+        previous, tracked.polled = tracked.polled, now
+        jitter = self._random.uniform(0, self.jitter)
+        if error is not None:
+            tracked.errors += 1
+            backoff = min(RETRY_DELAY * 2 ** (tracked.errors - 1), MAX_BACKOFF)
+            # Spread the retries of measures that failed together
+            tracked.due = now + self._random.uniform(backoff / 2, backoff)
+            return None
+        tracked.errors = 0
+
+        new = None
+        if df is not None and len(df):
+            stamps = pd.to_datetime(df["dateTime"], utc = True)
+            seconds = stamps.to_numpy(dtype = "datetime64[ns]").astype("int64") / 1e9
+            if tracked.last is not None:
+                keep = seconds > tracked.last
+                df, seconds = df[keep], seconds[keep]
+            if len(df):
+                new = df
+        if new is None:
+            # Too early: retry soon, then less often if the reading is late
+            tracked.misses += 1
+            retry = min(self.margin * 2 ** (tracked.misses - 1), tracked.interval / 2)
+            tracked.due = now + retry
+            return None
+
+        ordered = sorted(seconds)
+        if tracked.last is not None:
+            ordered.insert(0, tracked.last)
+            if tracked.misses:
+                # The reading appeared between the previous, early poll and
+                # this one; take the middle
+                tracked.lag = max((previous + now) / 2 - ordered[-1], 0.0)
+            else:
+                tracked.lag = max(min(tracked.lag, now - ordered[-1]) - _PROBE, 0.0)
+        tracked.intervals.extend(b - a for a, b in zip(ordered, ordered[1:]) if b > a)
+        tracked.last = ordered[-1]
+        tracked.misses = 0
+        tracked.readings += len(new)
+
+        expected = tracked.last + tracked.interval + tracked.lag + self.margin
+        tracked.due = max(expected, now) + jitter
+        return new
+
+    def poll_due(self) -> int:
+        """Poll every measure that is due now; return how many were polled"""
+        now = self.clock.time()
+        with self._lock:
+            due = [t for t in self._tracked.values() if t.due <= now]
+        if not due:
+            return 0
+
+        def poll(tracked):
+            try:
+                return self._fetch(tracked, now), None
+            except Exception as e:
+                return None, e
+
+        with ThreadPoolExecutor(max_workers = self.max_workers) as pool:
+            results = list(pool.map(poll, due))
+
+        for tracked, (df, error) in zip(due, results):
+            with self._lock:
+                new = self._schedule(tracked, now, df, error)
+            if error is not None:
+                self._report(tracked.measure, error)
+            elif new is not None:
+                for callback in self._callbacks:
+                    # A failing subscriber must not stop the polling thread
+                    try:
+                        callback(tracked.measure, new)
+                    except Exception as e:
+                        self._report(tracked.measure, e)
+        return len(due)
+
+    def _report(self, measure: str, error: Exception) -> None:
+        """Pass a failure to the error callbacks, or warn if there are none"""
+        for callback in self._error_callbacks:
+            try:
+                callback(measure, error)
+            except Exception as e:
+                warnings.warn(f"Error callback for {measure} failed: {e!r}")
+        if not self._error_callbacks:
+            warnings.warn(f"Polling {measure} failed: {error!r}")
+
+    def next_due(self) -> Optional[float]:
+        """Time of the next poll, or None if nothing is tracked"""
+        with self._lock:
+            return min((t.due for t in self._tracked.values()), default = None)
+
+    def run(self, until: Optional[float] = None, idle: float = 60.0) -> None:
+        """Poll until `stop` is called, or the clock passes `until`
+
+        :param until: time in seconds since the epoch to stop at
+        :param idle: seconds to wait when nothing is tracked
+        """
+        while not self._stop.is_set():
+            self.poll_due()
+            now = self.clock.time()
+            if until is not None and now >= until:
+                break
+            due = self.next_due()
+            wait = idle if due is None else due - now
+            if until is not None:
+                wait = min(wait, until - now)
+            if self.clock.wait(self._stop, wait):
+                break
+
+    def start(self) -> "Poller":
+        """Run the poller on a background thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target = self.run, name = "hcc-poller", daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the poller after the polls in flight finish"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self) -> pd.DataFrame:
+        """One row per tracked measure with its learnt cadence and counters"""
+        def ts(seconds):
+            return pd.NaT if seconds is None else pd.Timestamp(seconds, unit = "s", tz = "UTC")
+
+        with self._lock:
+            rows = [{
+                "measure": t.measure,
+                "last": ts(t.last),
+                "interval": pd.Timedelta(seconds = t.interval),
+                "lag": pd.Timedelta(seconds = t.lag),
+                "next_poll": ts(t.due),
+                "polls": t.polls,
+                "readings": t.readings,
+                "misses": t.misses,
+                "errors": t.errors,
+            } for t in self._tracked.values()]
+        return pd.DataFrame(rows, columns = ["measure", "last", "interval", "lag", "next_poll",
+                                             "polls", "readings", "misses", "errors"])
@@ -0,0 +1,314 @@
+"""
+In-memory store of recent readings in fixed-size ring buffers.
+
+A long-running process that refreshes readings keeps a data frame of
+timestamps and values per measure per refresh, and memory grows and
+fragments over days. `RingStore` instead keeps a fixed window per measure in
+two preallocated arrays, nanosecond `int64` times and `float32` values, so
+its memory use is fixed once a measure is added.
+
+Each buffer is written twice over, at `i` and `i + capacity`, so the
+readings in any window are one contiguous slice. `RingStore.view` and
+`RingStore.arrow` return them without copying; `RingStore.frame` shares the
+values and builds only the UTC `dateTime` column. Views see later writes,
+so copy them to keep them past the next update.
+
+A `RingStore` can be passed as `store` to `get_thames_metric` and
+`plot_thames_level`, and its `add` method works as a poller callback:
+
+    store = hcc.ringstore.RingStore(window = "7D")
+    poller.subscribe(store.add)
+    hcc.plot_thames_level("Walton", parameter = "flow", store = store)
+"""
+
+import math
+import threading
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+import hcc.ea_rivers as ea_rivers
+
+DEFAULT_WINDOW = "28D"
+
+# Expected time between readings, which sets the buffer size for a window
+DEFAULT_RESOLUTION = "15min"
+
+# Spare room for measures that report more often than `resolution`
+HEADROOM = 1.25
+
+
+def _iso(ns: int) -> str:
+    return pd.Timestamp(ns, tz = "UTC").strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _same(a, b):
+    """Equal values, counting two missing values as equal"""
+    return (a == b) | (np.isnan(a) & np.isnan(b))
+
+
+class Window(NamedTuple):
+    """Readings of one measure, oldest first, as views of the ring buffer"""
+    times: np.ndarray
+    values: np.ndarray
+
+
+class RingSeries:
+    """Ring buffer and metadata of one measure
+
+    :param measure: measure id
+    :param capacity: readings kept
+    """
+
+    __slots__ = ("measure", "capacity", "times", "values", "head", "size", "last", "covered")
+
+    def __init__(self, measure: str, capacity: int):
+        self.measure = measure
+        self.capacity = capacity
+        self.times = np.zeros(2 * capacity, dtype = np.int64)
+        self.values = np.full(2 * capacity, np.nan, dtype = np.float32)
+        # Index the next reading goes to, and the number of readings held
+        self.head = 0
+        self.size = 0
+        # Time of the newest reading
+        self.last: Optional[int] = None
+        # Earliest time the buffer holds every reading since, if synced
+        self.covered: Optional[int] = None
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"RingSeries({self.measure!r}, {self.size}/{self.capacity})"
+
+    @property
+    def nbytes(self) -> int:
+        return self.times.nbytes + self.values.nbytes
+
+    def window(self) -> Window:
+        """Every reading held, oldest first, without copying"""
+        start = (self.head - self.size) % self.capacity
+        return Window(self.times[start:start + self.size], self.values[start:start + self.size])
+
+    def append(self, t: int, value: float) -> bool:
+        """Add one reading in O(1); return False if it changed nothing
+
+        A reading at the time of the newest one replaces its value. Older
+        readings go through `extend`.
+        """
+        last = self.last
+        if last is not None and t <= last:
+            if t == last:
+                i = (self.head - 1) % self.capacity
+                if _same(self.values[i], value):
+                    return False
+                self.values[i] = self.values[i + self.capacity] = value
+                return True
+            return self.extend(np.array([t], dtype = np.int64), np.array([value], dtype = np.float32)) > 0
+        i = self.head
+        self.times[i] = self.times[i + self.capacity] = t
+        self.values[i] = self.values[i + self.capacity] = value
+        self.head = (i + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        self.last = t
+        return True
+
+    def extend(self, times: np.ndarray, values: np.ndarray) -> int:
+        """Add readings in any order; return how many were added or changed
+
+        Readings newer than the newest held are written in one vectorized
+        step. Readings among the held ones are merged, which rewrites the
+        buffer; a reading at a time already held replaces its value. Readings
+        that fall out of a full buffer, and those that repeat a held value,
+        don't count.
+        """
+        times = np.asarray(times, dtype = np.int64)
+        values = np.asarray(values, dtype = np.float32)
+        if not len(times):
+            return 0
+        order = np.argsort(times, kind = "stable")
+        times, values = times[order], values[order]
+        # Keep the last of readings with the same time
+        keep = np.append(times[1:] != times[:-1], True)
+        times, values = times[keep], values[keep]
+
+        last = self.last
+        if last is None or times[0] > last:
+            self._write(times[-self.capacity:], values[-self.capacity:])
+            return min(len(times), self.capacity)
+
+        held = self.window()
+        # Readings that would change the buffer: new times, or new values at held times
+        i = np.minimum(np.searchsorted(held.times, times), max(len(held.times) - 1, 0))
+        known = held.times[i] == times if len(held.times) else np.zeros(len(times), dtype = bool)
+        changed = ~known | ~_same(held.values[i], values)
+        if len(held.times) >= self.capacity:
+            # A full buffer keeps only what is newer than its oldest reading
+            changed &= times > held.times[0]
+        if not changed.any():
+            return 0
+        merged_times = np.concatenate([held.times, times])
+        merged_values = np.concatenate([held.values, values])
+        order = np.argsort(merged_times, kind = "stable")
+        merged_times, merged_values = merged_times[order], merged_values[order]
+        # The stable sort puts new readings after held ones at the same time
+        keep = np.append(merged_times[1:] != merged_times[:-1], True)
+        merged_times, merged_values = merged_times[keep], merged_values[keep]
+        self.head = self.size = 0
+        self.last = None
+        self._write(merged_times[-self.capacity:], merged_values[-self.capacity:])
+        # Of those, the ones still in the window after the merge
+        return int(np.count_nonzero(changed & (times >= merged_times[-self.capacity:][0])))
+
+    def _write(self, times: np.ndarray, values: np.ndarray) -> None:
+        n = len(times)
+        positions = (self.head + np.arange(n)) % self.capacity
+        self.times[positions] = self.times[positions + self.capacity] = times
+        self.values[positions] = self.values[positions + self.capacity] = values
+        self.head = (self.head + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        if n:
+            self.last = int(times[-1])
+
+
+class RingStore:
+    """Fixed-size in-memory store of recent readings for many measures
+
+    :param window: length of history kept per measure
+    :param resolution: expected time between readings; with `headroom` this
+        sets the number of readings each buffer holds
+    :param headroom: buffer size as a multiple of `window / resolution`
+    """
+
+    def __init__(self, window = DEFAULT_WINDOW, resolution = DEFAULT_RESOLUTION, headroom: float = HEADROOM):
+        self.window = pd.Timedelta(window)
+        self.capacity = math.ceil(self.window / pd.Timedelta(resolution) * headroom)
+        self._series: Dict[str, RingSeries] = {}
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return f"RingStore(window={self.window}, {len(self._series)} measures)"
+
+    def __contains__(self, measure_id: str) -> bool:
+        return measure_id in self._series
+
+    def __len__(self):
+        return len(self._series)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in the buffers"""
+        return sum(s.nbytes for s in self._series.values())
+
+    def series(self, measure_id: str) -> RingSeries:
+        """The buffer of a measure, created empty if needed"""
+        with self._lock:
+            s = self._series.get(measure_id)
+            if s is None:
+                s = self._series[measure_id] = RingSeries(measure_id, self.capacity)
+            return s
+
+    def add(self, measure_id: str, readings: pd.DataFrame) -> int:
+        """Add readings with `dateTime` and `value`, such as `get_readings_for_measure` returns
+
+        :return: number of readings added or changed
+        """
+        if not len(readings):
+            return 0
+        times = pd.to_datetime(readings["dateTime"], utc = True).to_numpy(dtype = "datetime64[ns]")
+        values = pd.to_numeric(readings["value"], errors = "coerce").to_numpy(dtype = np.float32)
+        with self._lock:
+            return self.series(measure_id).extend(times.view(np.int64), values)
+
+    def append(self, measure_id: str, time, value) -> bool:
+        """Add one reading"""
+        with self._lock:
+            return self.series(measure_id).append(ea_rivers.utc_ns(time), np.float32(value))
+
+    def sync(self, measure_id: str, since = None) -> int:
+        """Fetch the readings newer than those held for a measure
+
+        :param since: earliest reading needed, by default the start of the
+            window; readings from before the window are not kept
+        :return: number of readings added
+        """
+        now = pd.Timestamp.now(tz = "UTC").value
+        start = now - self.window.value
+        since = start if since is None else max(ea_rivers.utc_ns(since), start)
+        s = self.series(measure_id)
+        with self._lock:
+            fetch_since = since if s.covered is None or since < s.covered else max(s.last or since, since)
+        new = ea_rivers.get_readings_for_measure(measure_id, since = _iso(fetch_since),
+                                                 limit = ea_rivers.MAX_LIMIT)
+        with self._lock:
+            added = self.add(measure_id, new)
+            if s.covered is None or since < s.covered:
+                s.covered = since
+            return added
+
+    def view(self, measure_id: str, since = None, until = None) -> Window:
+        """Readings of a measure, oldest first, as views of its buffer
+
+        :param since: only readings after this time
+        :param until: only readings up to this time
+        """
+        with self._lock:
+            s = self._series.get(measure_id)
+            if s is None:
+                return Window(np.empty(0, dtype = np.int64), np.empty(0, dtype = np.float32))
+            w = s.window()
+        lo = 0 if since is None else np.searchsorted(w.times, ea_rivers.utc_ns(since), side = "right")
+        hi = len(w.times) if until is None else np.searchsorted(w.times, ea_rivers.utc_ns(until), side = "right")
+        return Window(w.times[lo:hi], w.values[lo:hi])
+
+    def frame(self, measure_id: str, since = None, until = None, newest_first: bool = True) -> pd.DataFrame:
+        """Readings of a measure as a data frame like `get_readings_for_measure` returns
+
+        The `value` column shares the buffer's memory.
+        """
+        w = self.view(measure_id, since, until)
+        if newest_first:
+            w = Window(w.times[::-1], w.values[::-1])
+        return pd.DataFrame({
+            "dateTime": pd.DatetimeIndex(w.times.view("datetime64[ns]"), copy = False).tz_localize("UTC"),
+            "value": w.values,
+            "measure": pd.Categorical.from_codes(np.zeros(len(w.times), dtype = np.int8), [measure_id]),
+        }, copy = False)
+
+    def arrow(self, measure_id: str, since = None, until = None):
+        """Readings of a measure, oldest first, as a pyarrow table sharing the buffer"""
+        import pyarrow as pa
+
+        w = self.view(measure_id, since, until)
+        n = len(w.times)
+        times = pa.Array.from_buffers(pa.timestamp("ns", tz = "UTC"), n, [None, pa.py_buffer(w.times)])
+        values = pa.Array.from_buffers(pa.float32(), n, [None, pa.py_buffer(w.values)])
+        return pa.table({"dateTime": times, "value": values})
+
+    def get_readings(self, measure_id: str, since = None) -> pd.DataFrame:
+        """Sync a measure, then answer from the buffer; the `store` interface of `get_thames_metric`"""
+        self.sync(measure_id, since = since)
+        return self.frame(measure_id, since = since)
+
+    def drop(self, measure_id: Optional[str] = None) -> None:
+        """Forget one measure, or all of them"""
+        with self._lock:
+            if measure_id is None:
+                self._series.clear()
+            else:
+                self._series.pop(measure_id, None)
+
+
+_default_store: Optional[RingStore] = None
+_default_lock = threading.Lock()
+
+
+def get_ring_store() -> RingStore:
+    """Return the shared in-memory store, with the default 28 day window"""
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = RingStore()
+        return _default_store
@@ -0,0 +1,399 @@
+"""
+Rolling statistics of river readings and the river state they imply.
+
+The reports describe the river with rules of thumb: about 100 cumecs at
+Walton is when the yellow boards appear and 150 cumecs brings the red ones,
+and the Sunbury level says how much of the club car park is under water.
+`RiverState` applies those rules to the latest readings and keeps rolling
+statistics for each measure: rolling max, min, mean and percentiles, the
+rate of change and the time spent above each threshold.
+
+`RollingStats` updates its statistics one reading at a time, for readings
+that arrive as they are polled. `rolling_stats` computes the same
+statistics for a whole history in one vectorized pass.
+
+    hcc.river_state()
+"""
+
+import bisect
+import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import hcc.ea_rivers as ea_rivers
+
+# Statistics cover the readings in the last DEFAULT_WINDOW
+DEFAULT_WINDOW = "24h"
+
+# Rate of change is measured across the readings in the last DEFAULT_RATE_WINDOW
+DEFAULT_RATE_WINDOW = "1h"
+
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+
+# Longer gaps between readings count for this long towards time above a threshold
+MAX_GAP = "1h"
+
+_HOUR_NS = 3600 * 10**9
+
+
+def _quantile_name(q: float) -> str:
+    return f"p{q * 100:g}"
+
+
+def _threshold_name(threshold: float) -> str:
+    return f"above_{threshold:g}"
+
+
+def _quantile(ordered: List[float], q: float) -> float:
+    """Quantile of sorted values with linear interpolation, as numpy and pandas compute it"""
+    if not ordered:
+        return math.nan
+    position = q * (len(ordered) - 1)
+    lo = int(position)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (position - lo)
+
+
+class RollingStats:
+    """Rolling statistics of one measure, updated a reading at a time
+
+    Max and min use monotonic queues and the mean and time above each
+    threshold use running sums, so each reading costs O(1) amortized. The
+    percentiles keep the window's values sorted, which costs a binary search
+    and a short memory move per reading.
+
+    Readings must arrive in time order; a reading that isn't newer than the
+    last one, or has no value, is ignored.
+
+    :param window: length of the rolling window, anything `pd.Timedelta` accepts
+    :param rate_window: window over which the rate of change is measured
+    :param thresholds: values to track the time above
+    :param quantiles: rolling quantiles to keep, between 0 and 1
+    :param max_gap: longest interval between readings counted towards time above
+    """
+
+    def __init__(self,
+                 window = DEFAULT_WINDOW,
+                 rate_window = DEFAULT_RATE_WINDOW,
+                 thresholds: Iterable[float] = (),
+                 quantiles: Iterable[float] = DEFAULT_QUANTILES,
+                 max_gap = MAX_GAP):
+        self.window = pd.Timedelta(window).value
+        self.rate_window = pd.Timedelta(rate_window).value
+        self.max_gap = pd.Timedelta(max_gap).value
+        self.thresholds = tuple(float(t) for t in thresholds)
+        self.quantiles = tuple(float(q) for q in quantiles)
+
+        # (time, value, time above each threshold) of the readings in the window
+        self._readings: deque = deque()
+        self._rate: deque = deque()
+        self._max: deque = deque()
+        self._min: deque = deque()
+        self._sorted: List[float] = []
+        self._sum = 0.0
+        self._above = [0] * len(self.thresholds)
+        self.last_time: Optional[int] = None
+        self.last_value = math.nan
+
+    def __len__(self):
+        return len(self._readings)
+
+    def update(self, time, value) -> bool:
+        """Add one reading; return False if it was ignored"""
+        value = float(value) if value is not None else math.nan
+        t = ea_rivers.utc_ns(time)
+        if math.isnan(value) or (self.last_time is not None and t <= self.last_time):
+            return False
+
+        dt = 0 if self.last_time is None else min(t - self.last_time, self.max_gap)
+        above = tuple(dt if value >= threshold else 0 for threshold in self.thresholds)
+        self._readings.append((t, value, above))
+        self._sum += value
+        for i, a in enumerate(above):
+            self._above[i] += a
+        bisect.insort(self._sorted, value)
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((t, value))
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((t, value))
+        self._rate.append((t, value))
+
+        start = t - self.window
+        while self._readings[0][0] <= start:
+            old_t, old_value, old_above = self._readings.popleft()
+            self._sum -= old_value
+            for i, a in enumerate(old_above):
+                self._above[i] -= a
+            del self._sorted[bisect.bisect_left(self._sorted, old_value)]
+            if self._max[0][0] == old_t:
+                self._max.popleft()
+            if self._min[0][0] == old_t:
+                self._min.popleft()
+        start = t - self.rate_window
+        while self._rate[0][0] <= start:
+            self._rate.popleft()
+
+        self.last_time, self.last_value = t, value
+        return True
+
+    def extend(self, times, values) -> int:
+        """Add readings in time order; return how many were used"""
+        return sum(self.update(t, v) for t, v in zip(times, values))
+
+    def rate(self) -> float:
+        """Change per hour across the readings in the rate window"""
+        if len(self._rate) < 2:
+            return math.nan
+        (t0, v0), (t1, v1) = self._rate[0], self._rate[-1]
+        return (v1 - v0) / ((t1 - t0) / _HOUR_NS)
+
+    def current(self) -> Dict[str, Any]:
+        """The statistics as of the latest reading
+
+        The keys match the columns of `rolling_stats`.
+        """
+        n = len(self._readings)
+        result = {
+            "dateTime": pd.Timestamp(self.last_time, tz = "UTC") if self.last_time is not None else pd.NaT,
+            "value": self.last_value,
+            "max": self._max[0][1] if n else math.nan,
+            "min": self._min[0][1] if n else math.nan,
+            "mean": self._sum / n if n else math.nan,
+            "rate": self.rate(),
+        }
+        for q in self.quantiles:
+            result[_quantile_name(q)] = _quantile(self._sorted, q)
+        for threshold, above in zip(self.thresholds, self._above):
+            result[_threshold_name(threshold)] = pd.Timedelta(above)
+        return result
+
+
+def _readings(df: pd.DataFrame) -> pd.DataFrame:
+    """Readings oldest first, without missing values or repeated times"""
+    out = pd.DataFrame({
+        "dateTime": pd.to_datetime(df["dateTime"], utc = True).to_numpy(dtype = "datetime64[ns]"),
+        "value": pd.to_numeric(df["value"], errors = "coerce").to_numpy(dtype = np.float64),
+    })
+    out["dateTime"] = out["dateTime"].dt.tz_localize("UTC")
+    out = out.dropna().sort_values("dateTime", kind = "stable")
+    return out.drop_duplicates("dateTime", keep = "first").reset_index(drop = True)
+
+
+def rolling_stats(df: pd.DataFrame,
+                  window = DEFAULT_WINDOW,
+                  rate_window = DEFAULT_RATE_WINDOW,
+                  thresholds: Iterable[float] = (),
+                  quantiles: Iterable[float] = DEFAULT_QUANTILES,
+                  max_gap = MAX_GAP) -> pd.DataFrame:
+    """Rolling statistics at every reading of a history, computed vectorized
+
+    Gives the same results as feeding the readings to `RollingStats` one at
+    a time.
+
+    :param df: readings with `dateTime` and `value`, as returned by
+        `get_thames_metric`, in any order
+    :param window: length of the rolling window
+    :param rate_window: window over which the rate of change is measured
+    :param thresholds: values to track the time above
+    :param quantiles: rolling quantiles, between 0 and 1
+    :param max_gap: longest interval between readings counted towards time above
+    :return: one row per reading, oldest first, with `dateTime`, `value`,
+        `max`, `min`, `mean`, `rate` (change per hour), a `p<q>` column per
+        quantile and an `above_<threshold>` column per threshold holding the
+        time above it within the window
+    """
+    readings = _readings(df)
+    times = readings["dateTime"]
+    values = readings["value"].to_numpy()
+    t = times.to_numpy(dtype = "datetime64[ns]").astype(np.int64)
+    series = pd.Series(values, index = pd.DatetimeIndex(times))
+    rolling = series.rolling(pd.Timedelta(window))
+
+    out = {
+        "dateTime": times,
+        "value": values,
+        "max": rolling.max().to_numpy(),
+        "min": rolling.min().to_numpy(),
+        "mean": rolling.mean().to_numpy(),
+    }
+
+    # Oldest reading inside the rate window of each reading
+    first = np.searchsorted(t, t - pd.Timedelta(rate_window).value, side = "right")
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        rate = (values - values[first]) / ((t - t[first]) / _HOUR_NS)
+    out["rate"] = np.where(first < np.arange(len(t)), rate, np.nan)
+
+    for q in quantiles:
+        out[_quantile_name(float(q))] = rolling.quantile(float(q)).to_numpy()
+
+    dt = np.minimum(np.diff(t, prepend = t[:1]), pd.Timedelta(max_gap).value)
+    for threshold in thresholds:
+        above = pd.Series(np.where(values >= threshold, dt, 0), index = series.index)
+        # A day in nanoseconds is well inside float64's exact integers
+        total = above.rolling(pd.Timedelta(window)).sum()
+        out[_threshold_name(float(threshold))] = pd.to_timedelta(np.round(total.to_numpy()), unit = "ns")
+    return pd.DataFrame(out)
+
+
+class Rule(NamedTuple):
+    """Thresholds that map a station's readings to a named state
+
+    `bands` are `(lower bound, state)` pairs in increasing order; readings
+    below the first bound are in state `base`.
+    """
+    station: str
+    position: str
+    parameter: str
+    bands: Tuple[Tuple[float, str], ...]
+    river_name: str = "River Thames"
+    base: str = "normal"
+
+    @property
+    def thresholds(self) -> Tuple[float, ...]:
+        return tuple(b[0] for b in self.bands)
+
+    def classify(self, values) -> np.ndarray:
+        """The state of each value; missing values have no state"""
+        values = np.asarray(values, dtype = np.float64)
+        names = np.array([self.base] + [b[1] for b in self.bands], dtype = object)
+        states = names[np.searchsorted(self.thresholds, values, side = "right")]
+        states[np.isnan(values)] = None
+        return states
+
+
+# The rules of thumb from the reports
+DEFAULT_RULES = [
+    Rule("Walton", "upstream", "flow", ((100, "yellow"), (150, "red"))),
+    Rule("Sunbury", "downstream", "level", (
+        (2.8, "strong stream"),
+        (3.19, "flooding possible"),
+        (4.0, "in flood"),
+        (4.5, "car park half under water"),
+        (4.95, "car park under water"),
+        (5.05, "club house step under water"),
+    ), base = "low"),
+]
+
+
+class RiverState:
+    """Current state and rolling statistics for a set of rules
+
+    Each `refresh` fetches only the readings newer than the last one seen
+    for each rule and feeds them to that rule's `RollingStats`.
+
+    :param rules: the rules to track, by default `DEFAULT_RULES`
+    :param window: length of the rolling window
+    :param rate_window: window over which the rate of change is measured
+    :param quantiles: rolling quantiles to keep
+    """
+
+    def __init__(self,
+                 rules: Iterable[Rule] = DEFAULT_RULES,
+                 window = DEFAULT_WINDOW,
+                 rate_window = DEFAULT_RATE_WINDOW,
+                 quantiles: Iterable[float] = DEFAULT_QUANTILES):
+        # Bands given as lists are made tuples, so rules can key dicts
+        self.rules = [Rule(*r)._replace(bands = tuple(tuple(b) for b in r[3])) for r in rules]
+        self.window = pd.Timedelta(window)
+        self.stats = {rule: RollingStats(window, rate_window, rule.thresholds, quantiles)
+                      for rule in self.rules}
+        # Current state of each rule and the time it started
+        self._state: Dict[Rule, Tuple[Optional[str], Any]] = {rule: (None, pd.NaT) for rule in self.rules}
+        self._lock = threading.Lock()
+
+    def feed(self, rule: Rule, df: pd.DataFrame) -> int:
+        """Add readings for one rule, in any order; return how many were new"""
+        readings = _readings(df)
+        with self._lock:
+            stats = self.stats[rule]
+            if stats.last_time is not None:
+                readings = readings[readings["dateTime"] > pd.Timestamp(stats.last_time, tz = "UTC")]
+            if not len(readings):
+                return 0
+            states = rule.classify(readings["value"].to_numpy())
+            state, since = self._state[rule]
+            # The last change of state among the new readings, if any
+            previous = np.empty_like(states)
+            previous[0] = state
+            previous[1:] = states[:-1]
+            changed = np.flatnonzero(states != previous)
+            if len(changed):
+                state, since = states[-1], readings["dateTime"].iloc[changed[-1]]
+            self._state[rule] = (state, since)
+            return stats.extend(readings["dateTime"], readings["value"].to_numpy())
+
+    def refresh(self, max_workers: int = 4) -> pd.DataFrame:
+        """Fetch new readings for every rule and return `current()`"""
+        import hcc.core as core
+
+        def fetch(rule):
+            last = self.stats[rule].last_time
+            if last is None:
+                since = pd.Timestamp.now(tz = "UTC") - self.window
+            else:
+                since = pd.Timestamp(last, tz = "UTC")
+            return core.get_thames_metric(rule.station, position = rule.position, parameter = rule.parameter,
+                                          river_name = rule.river_name,
+                                          since = since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                                          limit = ea_rivers.MAX_LIMIT)
+
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            for rule, df in zip(self.rules, pool.map(fetch, self.rules)):
+                self.feed(rule, df)
+        return self.current()
+
+    def current(self) -> pd.DataFrame:
+        """One row per rule with its state and the statistics of its latest reading
+
+        `since` is when the current state started, as far back as the
+        readings seen go. `above` is the time within the window spent at or
+        above the lower bound of the current state.
+        """
+        rows = []
+        with self._lock:
+            for rule in self.rules:
+                stats = self.stats[rule].current()
+                state, since = self._state[rule]
+                bounds = dict((name, lower) for lower, name in rule.bands)
+                above = stats.get(_threshold_name(bounds[state])) if state in bounds else pd.NaT
+                row = {"station": rule.station, "position": rule.position, "parameter": rule.parameter,
+                       "state": state, "since": since, "above": above}
+                row.update((k, v) for k, v in stats.items() if not k.startswith("above_"))
+                rows.append(row)
+        return pd.DataFrame(rows)
+
+
+_river_state: Optional[RiverState] = None
+_river_state_lock = threading.Lock()
+
+
+def get_river_state() -> RiverState:
+    """Return the shared `RiverState`, creating it with the default rules"""
+    global _river_state
+    with _river_state_lock:
+        if _river_state is None:
+            _river_state = RiverState()
+        return _river_state
+
+
+def set_river_state(state: Optional[RiverState]) -> None:
+    """Replace the shared `RiverState`, for example with different rules"""
+    global _river_state
+    with _river_state_lock:
+        _river_state = state
+
+
+def river_state() -> pd.DataFrame:
+    """Current state of the river at each station with a rule
+
+    Fetches the readings since the last call and updates the shared
+    `RiverState`.
+    """
+    return get_river_state().refresh()
@@ -1,96 +1,109 @@
 
-import requests
-from bs4 import BeautifulSoup
+from io import StringIO
+
 import pandas as pd
 import hcc
+from hcc import instrument, snapshot
 from hcc.core import find_local
+from hcc.transport import get_transport
+
+CLOSURES_URL = 'https://www.gov.uk/guidance/river-thames-restrictions-and-closures'
+CONDITIONS_URL = 'https://www.gov.uk/guidance/river-thames-current-river-conditions'
+
+
+def _fetch_html(url):
+    """Download a page through the shared transport"""
+    return get_transport().get(url).text
+
+
+CLOSURE_COLUMNS = ['When', 'Where', 'What’s happening']
+
+
+def _cell_text(el):
+    """Cell text with runs of whitespace collapsed, as `pd.read_html` does"""
+    return " ".join(el.text_content().split())
+
+
+def _closure_rows(html):
+    """Extract the rows and links of the closure tables in one lxml pass
+
+    :return: a list of `[when, where, what, link]` rows, where `link` is the
+        first link in the row or ''
+    """
+    from lxml import html as lxml_html
+
+    if isinstance(html, str):
+        html = html.encode('utf-8')
+    doc = lxml_html.fromstring(html, parser = lxml_html.HTMLParser(encoding = 'utf-8'))
+
+    rows = []
+    for table in doc.iter('table'):
+        header = [_cell_text(th) for th in table.xpath('.//tr[th][1]/th')]
+        if header != CLOSURE_COLUMNS:
+            continue
+        for tr in table.xpath('.//tr[td]'):
+            cells = [_cell_text(td) for td in tr.xpath('./td')]
+            if len(cells) != len(CLOSURE_COLUMNS):
+                continue
+            href = tr.xpath('./td//a/@href')
+            rows.append(cells + [str(href[0]) if href else ''])
+    return rows
+
 
 # Scrap the gov.uk for river thames restrictions and closures
-def scrape_river_closures():
-    url = 'https://www.gov.uk/guidance/river-thames-restrictions-and-closures'
-
-    # import into pandas
-    pd_dfs = pd.read_html(url)
-
-    # read with beautiful soup
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-
-    # find all tables
-    tbls = soup.find_all('table')
-    len(tbls)
-
-    # function to find all links in a table
-    def extract_links(table):
-        links = []
-        for tr in table.findAll("tr"):
-            tds = tr.findAll("td")
-            for td in tds:
-                try:
-                    link = td.find('a')['href']
-                    links.append(link)
-                except:
-                    # links.append('')
-                    pass
-        return links
-
-    def identify_river_closure_tables(x):
-        correct = []
-        for i in range(len(x)):
-            nms = x[i].columns.values.tolist()
-            if  nms == ['When', 'Where', 'What’s happening']:
-                correct.append(i)
-        return correct
-
-    correct = identify_river_closure_tables(pd_dfs)
-    pd_dfs = [pd_dfs[i] for i in correct]
-    tbls = [tbls[i] for i in correct]
-
-    # insert column of links into pandas dataframe
-    for i in range(len(tbls)):
-        new_link = extract_links(tbls[i])
-        # print(f"Table {i} has {len(new_link)} links")
-        # print(f"Table {i} has {len(pd_dfs[i])} rows")
-        if len(new_link) != len(pd_dfs[i]):
-            pd_dfs[i]['link'] = [''] * len(pd_dfs[i])
-        else:
-            pd_dfs[i]['link'] = new_link
-
-    # concatenate all dataframes into one
-    df = pd.concat(pd_dfs)
-
-    # insert hyperlink
-
-    links = []
-    for i, el in enumerate(df['link']):
-        event = df['What’s happening'].values[i]
-        colon = str.find(event, ':')
-        beg = event[:colon]
-        end = event[colon:]
-        # link = df['link'].values[i]
-        link = el
-        if link != '':
-            links.append(f"<a href='{link}' target='_blank'>{beg}</a>{end}")
-        else:
-            links.append(f"{beg} {end}")
-    
-    df['Event'] = links
+@instrument.timed("scrape.scrape_river_closures")
+def scrape_river_closures(html = None):
+    """
+    Scrape river Thames restrictions and closures from gov.uk
+
+    :param html: page content as bytes or str. By default the page is
+        downloaded, or read from the active `hcc.snapshot`; pass it in to
+        parse a saved copy.
+    """
+    if html is None:
+        snap = snapshot.active()
+        if snap is not None and snap.has('closures'):
+            return snap.table('closures').copy()
+        html = get_transport().get(CLOSURES_URL).content
+
+    with instrument.stage("scrape.parse_closures") as s:
+        rows = _closure_rows(html)
+        s["rows"] = len(rows)
+
+    df = pd.DataFrame(rows, columns = CLOSURE_COLUMNS + ['link'])
+
+    # Link the text before the first colon of each event
+    what = df['What’s happening'].str.extract(r'^(?P<beg>[^:]*)(?P<end>.*)$', expand = True)
+    linked = "<a href='" + df['link'] + "' target='_blank'>" + what['beg'] + "</a>" + what['end']
+    df['Event'] = linked.where(df['link'] != '', what['beg'] + ' ' + what['end'])
     df['Local'] = hcc.core.find_local(df['Where'].values)
-    
+
     return df[['When', 'Where', 'Local', 'Event']]
 
 
 
-def scrape_conditions():
+@instrument.timed("scrape.scrape_conditions")
+def scrape_conditions(html = None):
     """
     Scrape conditions from environment agency and gov.uk websites
+
+    :param html: page content as bytes or str. By default the page is
+        downloaded, or read from the active `hcc.snapshot`; pass it in to
+        parse a saved copy.
     """
     import re
+    if html is None:
+        snap = snapshot.active()
+        if snap is not None and snap.has('conditions'):
+            return snap.table('conditions').copy()
     # url = 'http://riverconditions.environment-agency.gov.uk/'
-    url = 'https://www.gov.uk/guidance/river-thames-current-river-conditions'
-
     try:
-        dfs = pd.read_html(url)
+        if html is None:
+            html = _fetch_html(CONDITIONS_URL)
+        elif isinstance(html, bytes):
+            html = html.decode('utf-8')
+        with instrument.stage("scrape.parse_conditions"):
+            dfs = pd.read_html(StringIO(html))
         success = True
     except Exception as e:
         print(f"Error: {e}")
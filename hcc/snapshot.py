@@ -0,0 +1,277 @@
+"""
+Shared data snapshot for the Quarto reports.
+
+The reports all need the same river conditions, closures and station
+readings. `build` fetches everything once, in parallel, and writes it to a
+single zip bundle holding a `manifest.json` and one Parquet file per table.
+While a snapshot is active, `scrape_conditions`, `scrape_river_closures`,
+`get_thames_metric` and `plot_thames_level` read from it instead of going
+to the network.
+
+    python -m hcc.snapshot snapshot.zip
+    HCC_SNAPSHOT=snapshot.zip quarto render thames-river-levels.qmd
+
+or from Python:
+
+    hcc.snapshot.build("snapshot.zip")
+    hcc.snapshot.activate("snapshot.zip")
+
+Requires pyarrow.
+"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import pandas as pd
+
+import hcc.ea_rivers as ea_rivers
+
+FORMAT_VERSION = 1
+
+# Days of readings kept for each metric
+DEFAULT_DAYS = 28
+
+# (station_search, position, parameter, river_name) for every chart in the reports
+DEFAULT_METRICS = [
+    ("Walton", "upstream", "flow", "River Thames"),
+    ("Kingston", "upstream", "flow", "River Thames"),
+    ("Sunbury", "downstream", "level", "River Thames"),
+    ("Molesey Lock", "downstream", "level", "River Thames"),
+    ("Richmond", "upstream", "level", "Thames Tideway"),
+]
+
+
+def _metric_key(station, position, parameter, river_name) -> Tuple[str, str, str, str]:
+    return (str(station).strip().lower(), position, parameter, river_name)
+
+
+class Snapshot:
+    """A snapshot bundle opened for reading
+
+    Tables are read from the bundle the first time they're asked for.
+
+    :param path: path of the bundle written by `build`
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with zipfile.ZipFile(path) as z:
+            self.manifest = json.loads(z.read("manifest.json"))
+        if self.manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version in {path}")
+        self.created = pd.Timestamp(self.manifest["created"])
+        self.since = pd.Timestamp(self.manifest["since"])
+        self._tables: Dict[str, pd.DataFrame] = {}
+        self._lock = threading.Lock()
+        self._metrics = {}
+        for m in self.manifest["metrics"]:
+            for name in (m["station_search"], m["label"]):
+                self._metrics[_metric_key(name, m["position"], m["parameter"], m["river_name"])] = m
+
+    def __repr__(self):
+        return f"Snapshot({self.path!r}, created={self.created.isoformat()})"
+
+    def has(self, name: str) -> bool:
+        return name in self.manifest["tables"]
+
+    def table(self, name: str) -> pd.DataFrame:
+        """Read a table from the bundle; the frame is shared, so copy it before changing it"""
+        import pyarrow.parquet as pq
+
+        with self._lock:
+            df = self._tables.get(name)
+            if df is None:
+                with zipfile.ZipFile(self.path) as z:
+                    data = z.read(self.manifest["tables"][name]["file"])
+                df = self._tables[name] = pq.read_table(io.BytesIO(data)).to_pandas()
+            return df
+
+    def metric(self, station, position = "upstream", parameter = "level",
+               river_name = "River Thames", since = None, limit = None) -> Optional[Tuple[str, pd.DataFrame]]:
+        """The station label and readings for a metric, if the snapshot can answer it
+
+        Returns None when the metric isn't in the snapshot, or when `since`
+        asks for readings from before the snapshot's window.
+        """
+        m = self._metrics.get(_metric_key(station, position, parameter, river_name))
+        if m is None:
+            return None
+        df = self.table(m["table"])
+        if since is not None:
+            since = ea_rivers.utc_timestamp(since)
+            if since < self.since:
+                return None
+            df = df[df["dateTime"] > since]
+        if limit is not None:
+            df = df.head(limit)
+        return m["label"], df
+
+
+_active: Optional[Snapshot] = None
+_from_env = False
+
+
+def active() -> Optional[Snapshot]:
+    """The active snapshot, if any
+
+    On first use this activates the bundle named by `HCC_SNAPSHOT`, if set and
+    the file exists.
+    """
+    global _active, _from_env
+    if _active is None and not _from_env:
+        _from_env = True
+        path = os.environ.get("HCC_SNAPSHOT")
+        if path and os.path.isfile(path):
+            _active = Snapshot(path)
+    return _active
+
+
+def activate(snapshot: Union[str, Snapshot]) -> Snapshot:
+    """Make hcc read from a snapshot bundle (a path or a `Snapshot`)"""
+    global _active, _from_env
+    _from_env = True
+    _active = snapshot if isinstance(snapshot, Snapshot) else Snapshot(snapshot)
+    return _active
+
+
+def deactivate() -> Optional[Snapshot]:
+    """Stop reading from the snapshot; return the one that was active"""
+    global _active, _from_env
+    previous = _active
+    _active = None
+    _from_env = True
+    return previous
+
+
+@contextmanager
+def using(snapshot: Optional[Union[str, Snapshot]]):
+    """Activate a snapshot inside a `with` block; `None` suspends any active one"""
+    global _active, _from_env
+    previous, previous_env = active(), _from_env
+    _active = None if snapshot is None else (snapshot if isinstance(snapshot, Snapshot) else Snapshot(snapshot))
+    _from_env = True
+    try:
+        yield _active
+    finally:
+        _active, _from_env = previous, previous_env
+
+
+def _write_parquet(df: pd.DataFrame) -> bytes:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index = False), buffer, compression = "zstd")
+    return buffer.getvalue()
+
+
+def build(path: str,
+          metrics: Iterable[Tuple[str, str, str, str]] = DEFAULT_METRICS,
+          days: int = DEFAULT_DAYS,
+          max_workers: int = 8) -> Snapshot:
+    """Fetch everything the reports need and write it to a bundle at `path`
+
+    The two gov.uk pages and every metric are fetched concurrently. A metric
+    that fails is left out of the snapshot (the reports then fetch it
+    themselves); a failing page is left out likewise.
+
+    :param path: where to write the bundle; it is replaced atomically
+    :param metrics: `(station_search, position, parameter, river_name)` tuples
+    :param days: days of readings to keep for each metric
+    :param max_workers: maximum number of concurrent requests
+    :return: the new snapshot, not yet active
+    """
+    import hcc.core as core
+    import hcc.scrape as scrape
+
+    since = (datetime.now(timezone.utc) - timedelta(days = days)).replace(microsecond = 0)
+    metrics = [tuple(m) for m in metrics]
+
+    def metric(spec):
+        station_search, position, parameter, river_name = spec
+        label = core.lookup_thames_station(station_search, river_name = river_name).label
+        # Ask for a full page so the whole window fits, not the API's default limit
+        df = core.get_thames_metric(station_search, position = position, parameter = parameter,
+                                    river_name = river_name, since = since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                                    limit = ea_rivers.MAX_LIMIT)
+        return label, df
+
+    # Build from the network even if an older snapshot is active
+    with using(None), ThreadPoolExecutor(max_workers = max_workers) as pool:
+        pages = {name: pool.submit(func) for name, func in
+                 [("conditions", scrape.scrape_conditions), ("closures", scrape.scrape_river_closures)]}
+        readings = {spec: pool.submit(metric, spec) for spec in metrics}
+
+        files: Dict[str, bytes] = {}
+        manifest: Dict[str, Any] = {
+            "version": FORMAT_VERSION,
+            "created": datetime.now(timezone.utc).isoformat(timespec = "seconds"),
+            "since": since.isoformat(),
+            "tables": {},
+            "metrics": [],
+            "errors": [],
+        }
+        for name, future in pages.items():
+            try:
+                df = future.result()
+            except Exception as e:
+                manifest["errors"].append({"table": name, "error": repr(e)})
+                continue
+            files[name] = _write_parquet(df)
+            manifest["tables"][name] = {"file": name + ".parquet", "rows": len(df)}
+        for i, (spec, future) in enumerate(readings.items()):
+            try:
+                label, df = future.result()
+            except Exception as e:
+                manifest["errors"].append({"metric": list(spec), "error": repr(e)})
+                continue
+            name = f"metric-{i:03d}"
+            files[name] = _write_parquet(df)
+            manifest["tables"][name] = {"file": name + ".parquet", "rows": len(df)}
+            manifest["metrics"].append(dict(zip(["station_search", "position", "parameter", "river_name"], spec),
+                                            label = label, table = name))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok = True)
+    fd, tmp = tempfile.mkstemp(dir = directory, suffix = ".tmp")
+    try:
+        # Parquet is already compressed, so the zip only stores the files
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_STORED) as z:
+            z.writestr("manifest.json", json.dumps(manifest, indent = 2))
+            for name, data in files.items():
+                z.writestr(manifest["tables"][name]["file"], data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return Snapshot(path)
+
+
+def main(argv = None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description = "Build the shared data snapshot for the reports")
+    parser.add_argument("path", nargs = "?", default = "snapshot.zip")
+    parser.add_argument("--days", type = int, default = DEFAULT_DAYS, help = "days of readings per metric")
+    args = parser.parse_args(argv)
+
+    snapshot = build(args.path, days = args.days)
+    for error in snapshot.manifest["errors"]:
+        print("Not in snapshot:", error)
+    print(f"Wrote {args.path}: {len(snapshot.manifest['tables'])} tables, "
+          f"{os.path.getsize(args.path) / 1024:.0f} kB")
+
+
+if __name__ == "__main__":
+    # Run the imported module, so the active snapshot is the one hcc reads
+    import hcc.snapshot
+    hcc.snapshot.main()
@@ -0,0 +1,158 @@
+"""
+Persistent local store of EA readings.
+
+Readings are kept in a SQLite database under the hcc cache directory, keyed by
+measure `@id`. Each sync only asks the API for readings `since` the last
+`dateTime` already stored, so repeated renders cost one small delta request
+per measure.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import timedelta
+from typing import Optional
+
+import pandas as pd
+
+import hcc.ea_rivers as ea_rivers
+from hcc.cache import cache_dir
+
+DEFAULT_WINDOW = timedelta(days=28)
+
+
+def _iso(when) -> str:
+    """Format a date, datetime or string as an EA style UTC timestamp"""
+    return ea_rivers.utc_timestamp(when).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class ReadingsStore:
+    """On-disk readings store with incremental `since` sync
+
+    :param path: path to the SQLite database, by default `readings.sqlite` in
+        the hcc cache directory
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = os.path.join(cache_dir(), "readings.sqlite")
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._con:
+            self._con.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS readings (
+                    measure TEXT NOT NULL,
+                    dateTime TEXT NOT NULL,
+                    value REAL,
+                    PRIMARY KEY (measure, dateTime)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS coverage (
+                    measure TEXT PRIMARY KEY,
+                    start TEXT NOT NULL,
+                    last TEXT
+                );
+            """)
+
+    def coverage(self, measure_id: str):
+        """Return `(start, last)` stored for a measure, or `None`"""
+        with self._lock:
+            return self._con.execute(
+                "SELECT start, last FROM coverage WHERE measure = ?",
+                (measure_id,)).fetchone()
+
+    def sync(self, measure_id: str, since=None) -> int:
+        """Fetch readings newer than the stored ones and append them
+
+        :param measure_id: EA API measure id
+        :param since: earliest reading the caller needs. If this is before the
+            stored coverage the missing history is fetched too. Defaults to
+            28 days ago.
+        :return: number of readings added
+        """
+        if since is None:
+            since = pd.Timestamp.now(tz="UTC") - DEFAULT_WINDOW
+        since = _iso(since)
+
+        covered = self.coverage(measure_id)
+        if covered is None or since < covered[0]:
+            start, fetch_since = since, since
+        else:
+            start, fetch_since = covered[0], covered[1] or since
+
+        new = ea_rivers.get_readings_for_measure(measure_id, since = fetch_since,
+                                                 limit = ea_rivers.MAX_LIMIT)
+        if len(new) >= ea_rivers.MAX_LIMIT:
+            # More than one page behind: page through the gap by date
+            new = ea_rivers.get_readings_range(measure_id, startdate = fetch_since)
+            new = new[new["dateTime"] > pd.Timestamp(fetch_since)]
+        rows = []
+        if len(new):
+            rows = list(zip(new["dateTime"].dt.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                            new["value"].to_numpy()))
+
+        with self._lock, self._con:
+            self._con.executemany(
+                "INSERT OR REPLACE INTO readings VALUES (?, ?, ?)",
+                [(measure_id, t, None if pd.isna(v) else float(v)) for t, v in rows])
+            last = self._con.execute(
+                "SELECT max(dateTime) FROM readings WHERE measure = ?",
+                (measure_id,)).fetchone()[0]
+            self._con.execute(
+                "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)",
+                (measure_id, start, last))
+        return len(rows)
+
+    def window(self, measure_id: str, since=None, until=None) -> pd.DataFrame:
+        """Return stored readings for a measure, newest first
+
+        :param measure_id: EA API measure id
+        :param since: only return readings after this time
+        :param until: only return readings up to this time
+        """
+        query = "SELECT dateTime, value FROM readings WHERE measure = ?"
+        args = [measure_id]
+        if since is not None:
+            query += " AND dateTime > ?"
+            args.append(_iso(since))
+        if until is not None:
+            query += " AND dateTime <= ?"
+            args.append(_iso(until))
+        query += " ORDER BY dateTime DESC"
+        with self._lock:
+            readings = pd.read_sql_query(query, self._con, params=args)
+        readings["dateTime"] = pd.to_datetime(readings["dateTime"], utc=True,
+                                              format="%Y-%m-%dT%H:%M:%SZ").dt.as_unit("ns")
+        readings["value"] = readings["value"].astype("float64")
+        readings["measure"] = pd.Categorical([measure_id] * len(readings))
+        return readings
+
+    def get_readings(self, measure_id: str, since=None) -> pd.DataFrame:
+        """Sync a measure, then answer the window query locally"""
+        self.sync(measure_id, since = since)
+        return self.window(measure_id, since = since)
+
+    def clear(self, measure_id: Optional[str] = None) -> None:
+        """Delete stored readings for one measure, or for all measures"""
+        with self._lock, self._con:
+            if measure_id is None:
+                self._con.execute("DELETE FROM readings")
+                self._con.execute("DELETE FROM coverage")
+            else:
+                self._con.execute("DELETE FROM readings WHERE measure = ?", (measure_id,))
+                self._con.execute("DELETE FROM coverage WHERE measure = ?", (measure_id,))
+
+    def close(self) -> None:
+        self._con.close()
+
+
+_default_store: Optional[ReadingsStore] = None
+
+
+def get_store() -> ReadingsStore:
+    """Return the default readings store in the hcc cache directory"""
+    global _default_store
+    if _default_store is None:
+        _default_store = ReadingsStore()
+    return _default_store
@@ -1,20 +1,206 @@
+"""
+Times of dawn, sunrise, sunset and dusk.
 
-import pytz
-import astral
-from astral.sun import sun
-from time import strftime
+Uses the NOAA solar position equations evaluated with numpy over arrays of
+dates and locations, so a season of dates for several club sites is one
+vectorized call. Each event time is refined once at the estimated time of
+the event, which keeps results within a second of `astral` away from the
+polar circles (see `bench/sun.py`).
+"""
+
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, Mapping, Optional, Tuple, Union
+
+import numpy as np
 import pandas as pd
 
+from hcc.locality import HAMPTON_COURT
 
-def sunrise_times():
-    here = astral.Observer()
+TIMEZONE = "Europe/London"
+
+# Solar zenith angle of each event in degrees, and whether the sun is rising.
+# Sunrise and sunset are when the top of the sun's disc (16' above its centre)
+# meets the horizon, and dawn and dusk are civil twilight (6 degrees below),
+# each plus atmospheric refraction as astral computes it, so the times agree
+# with astral's.
+EVENTS = {
+    "dawn": (96.05490, True),
+    "sunrise": (90.78911, True),
+    "sunset": (90.78911, False),
+    "dusk": (96.05490, False),
+}
+
+SITES: Dict[str, Tuple[float, float]] = {"Hampton Court": HAMPTON_COURT}
+
+# Julian day number of the unix epoch
+_UNIX_EPOCH_JD = 2440587.5
+
+
+def _sun_position(jd: np.ndarray):
+    """Solar declination (radians) and equation of time (minutes) at Julian day `jd`"""
+    t = (jd - 2451545.0) / 36525.0
+    l0 = np.radians((280.46646 + t * (36000.76983 + t * 0.0003032)) % 360)
+    m = np.radians(357.52911 + t * (35999.05029 - 0.0001537 * t))
+    e = 0.016708634 - t * (0.000042037 + 0.0000001267 * t)
+    c = np.radians(np.sin(m) * (1.914602 - t * (0.004817 + 0.000014 * t))
+                   + np.sin(2 * m) * (0.019993 - 0.000101 * t)
+                   + np.sin(3 * m) * 0.000289)
+    omega = np.radians(125.04 - 1934.136 * t)
+    apparent_long = l0 + c - np.radians(0.00569 + 0.00478 * np.sin(omega))
+    obliquity = np.radians(23 + (26 + (21.448 - t * (46.815 + t * (0.00059 - t * 0.001813))) / 60) / 60
+                           + 0.00256 * np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_long))
+
+    y = np.tan(obliquity / 2) ** 2
+    eot = 4 * np.degrees(y * np.sin(2 * l0) - 2 * e * np.sin(m)
+                         + 4 * e * y * np.sin(m) * np.cos(2 * l0)
+                         - 0.5 * y * y * np.sin(4 * l0) - 1.25 * e * e * np.sin(2 * m))
+    return declination, eot
+
+
+def _event_minutes(jd0: np.ndarray, lat: np.ndarray, lon: np.ndarray,
+                   zenith: float, rising: bool, iterations: int = 2) -> np.ndarray:
+    """Minutes after 00:00 UTC of an event, broadcasting over dates and locations
+
+    NaN where the sun doesn't reach `zenith` that day.
+    """
+    lat = np.radians(lat)
+    cos_zenith = np.cos(np.radians(zenith))
+    # Start from local solar noon, then re-evaluate the sun's position at the
+    # estimated time of the event
+    minutes = 720 - 4 * lon + 0 * jd0
+    for _ in range(iterations):
+        declination, eot = _sun_position(jd0 + minutes / 1440)
+        noon = 720 - 4 * lon - eot
+        with np.errstate(invalid = 'ignore'):
+            hour_angle = np.degrees(np.arccos(
+                (cos_zenith - np.sin(lat) * np.sin(declination)) / (np.cos(lat) * np.cos(declination))))
+        minutes = noon - 4 * hour_angle if rising else noon + 4 * hour_angle
+    return minutes
+
+
+def solar_events(dates, lat, lon) -> Dict[str, np.ndarray]:
+    """Event times in UTC for every combination of dates and locations
+
+    :param dates: array-like of dates
+    :param lat: array of latitudes in degrees
+    :param lon: array of longitudes in degrees (east positive)
+    :return: a dict of event name to a `datetime64[ns]` UTC array of shape
+        `(len(lat), len(dates))`, NaT where the event doesn't happen
+    """
+    days = pd.DatetimeIndex(pd.to_datetime(dates)).normalize()
+    if days.tz is not None:
+        days = days.tz_localize(None)
+    midnight = days.to_numpy(dtype = 'datetime64[ns]')
+    jd0 = midnight.astype(np.int64) / 86400e9 + _UNIX_EPOCH_JD
+
+    lat = np.asarray(lat, dtype = np.float64)[:, None]
+    lon = np.asarray(lon, dtype = np.float64)[:, None]
+    result = {}
+    for event, (zenith, rising) in EVENTS.items():
+        minutes = _event_minutes(jd0[None, :], lat, lon, zenith, rising)
+        offset = np.round(minutes * 60e9)
+        times = np.where(np.isnan(offset), np.datetime64('NaT'),
+                         midnight[None, :] + np.nan_to_num(offset).astype('timedelta64[ns]'))
+        result[event] = times
+    return result
 
-    s = sun(here, tzinfo = pytz.timezone("Europe/London"))
 
-    events = pd.DataFrame({
-        'event' : ['dawn', 'sunrise', 'sunset', 'dusk'],
-        'time': [s['dawn'], s['sunrise'], s['sunset'], s['dusk']],
+# Tables kept, oldest dropped first; each is four arrays of 365 times
+YEAR_CACHE_SIZE = 256
+
+_year_cache: Dict[Tuple[float, float, int], Dict[str, np.ndarray]] = {}
+_year_lock = threading.Lock()
+
+
+def _year_tables(points, year: int):
+    """Event times for every day of `year`, computed once per location
+
+    Missing locations are computed together in one vectorized call.
+    """
+    with _year_lock:
+        missing = list(dict.fromkeys(p for p in points if (p[0], p[1], year) not in _year_cache))
+    if missing:
+        days = pd.date_range(f"{year}-01-01", f"{year}-12-31", freq = "D")
+        lat, lon = zip(*missing)
+        events = solar_events(days, lat, lon)
+        with _year_lock:
+            for i, (la, lo) in enumerate(missing):
+                _year_cache[(la, lo, year)] = {event: times[i] for event, times in events.items()}
+            tables = [_year_cache[(p[0], p[1], year)] for p in points]
+            while len(_year_cache) > max(YEAR_CACHE_SIZE, len(points)):
+                del _year_cache[next(iter(_year_cache))]
+        return tables
+    with _year_lock:
+        return [_year_cache[(p[0], p[1], year)] for p in points]
+
+
+def _as_locations(locations) -> Dict[str, Tuple[float, float]]:
+    if locations is None:
+        return dict(SITES)
+    if isinstance(locations, Mapping):
+        return {name: (float(p[0]), float(p[1])) for name, p in locations.items()}
+    if len(locations) == 2 and np.isscalar(locations[0]):
+        return {f"{locations[0]}, {locations[1]}": (float(locations[0]), float(locations[1]))}
+    return {f"{p[0]}, {p[1]}": (float(p[0]), float(p[1])) for p in locations}
+
+
+def sun_times(dates: Union[date, datetime, str, Iterable, None] = None,
+              locations: Union[Mapping[str, Tuple[float, float]], Tuple[float, float], None] = None,
+              tz: Optional[str] = TIMEZONE) -> pd.DataFrame:
+    """Dawn, sunrise, sunset and dusk for many dates and locations
+
+    Results are computed a year at a time per location and cached, so a
+    season of dates costs one vectorized call the first time and lookups
+    after that.
+
+    :param dates: a date or an iterable of dates, by default today. Each is
+        the local date at the location.
+    :param locations: a mapping of names to `(lat, lon)` or a single
+        `(lat, lon)`, by default `SITES` (Hampton Court)
+    :param tz: time zone of the returned times, or None for UTC
+    :return: a tidy data frame with columns `location`, `date`, `event`
+        and `time`, one row per location, date and event
+    """
+    if dates is None:
+        dates = pd.Timestamp.now(tz = tz or "UTC").date()
+    if isinstance(dates, (date, datetime, str, pd.Timestamp)):
+        dates = [dates]
+    days = pd.DatetimeIndex(pd.to_datetime(list(dates))).normalize()
+    if days.tz is not None:
+        days = days.tz_localize(None)
+
+    sites = _as_locations(locations)
+    names = list(sites)
+    points = [sites[n] for n in names]
+    events = list(EVENTS)
+
+    years = days.year.to_numpy()
+    day_of_year = days.dayofyear.to_numpy() - 1
+    # (location, date, event) array of times
+    times = np.empty((len(points), len(days), len(events)), dtype = 'datetime64[ns]')
+    for year in np.unique(years):
+        selected = years == year
+        for i, table in enumerate(_year_tables(points, int(year))):
+            for k, event in enumerate(events):
+                times[i, selected, k] = table[event][day_of_year[selected]]
+
+    n_loc, n_day, n_event = times.shape
+    time_index = pd.DatetimeIndex(times.reshape(-1)).tz_localize("UTC")
+    if tz is not None:
+        time_index = time_index.tz_convert(tz)
+    return pd.DataFrame({
+        'location': pd.Categorical(np.repeat(names, n_day * n_event), categories = names),
+        'date': np.tile(np.repeat(days.date, n_event), n_loc),
+        'event': pd.Categorical(np.tile(events, n_loc * n_day), categories = events, ordered = True),
+        'time': time_index,
     })
 
-    events['time'] = [strftime("%H:%M", t.timetuple()) for t in events['time']]
-    return events
\ No newline at end of file
+
+def sunrise_times():
+    """Today's dawn, sunrise, sunset and dusk at Hampton Court, as "HH:MM" """
+    events = sun_times(locations = SITES)[['event', 'time']]
+    events = events.assign(event = events['event'].astype(str),
+                           time = events['time'].dt.strftime("%H:%M"))
+    return events.reset_index(drop = True)
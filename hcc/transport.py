@@ -0,0 +1,220 @@
+"""
+Shared HTTP transport used by the hcc modules that talk to web APIs.
+
+A single pooled, keep-alive `requests.Session` is reused for every call, so
+repeated requests to the same host skip the TCP and TLS handshakes. The
+default transport also keeps an on-disk response cache (see `hcc.httpcache`),
+so unchanged pages and API responses are revalidated with a conditional
+request instead of downloaded again.
+"""
+
+import time
+from typing import Any, Dict, Iterable, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from hcc import instrument
+from hcc.httpcache import HttpCache, default_http_cache
+
+DEFAULT_TIMEOUT = (3.05, 30)
+
+Timeout = Union[float, tuple, None]
+
+# Request headers that carry credentials. They are part of the cache key, so
+# a response fetched with one key is never served to a caller using another.
+CREDENTIAL_HEADERS = ("authorization", "apikey", "x-api-key")
+
+
+class Transport:
+    """Pooled HTTP transport with timeouts and retries
+
+    :param timeout: default (connect, read) timeout in seconds for each call
+    :param retries: number of times to retry failed requests
+    :param backoff_factor: exponential backoff factor between retries
+    :param status_forcelist: HTTP status codes that trigger a retry
+    :param pool_connections: number of host connection pools to keep
+    :param pool_maxsize: maximum number of connections kept per host
+    :param headers: extra headers sent with every request
+    :param session: an existing `requests.Session` to use instead of a new one
+    :param rewrite: mapping of URL prefixes to replacements, for example
+        `{"https://environment.data.gov.uk": "http://127.0.0.1:8000"}` to send
+        EA calls to a local stand-in server
+    :param cache: an `HttpCache` for responses, or None for no caching
+    """
+
+    def __init__(self,
+                 timeout: Timeout = DEFAULT_TIMEOUT,
+                 retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 status_forcelist: Iterable[int] = (429, 500, 502, 503, 504),
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 16,
+                 headers: Optional[Dict[str, str]] = None,
+                 session: Optional[requests.Session] = None,
+                 rewrite: Optional[Dict[str, str]] = None,
+                 cache: Optional[HttpCache] = None):
+        self.timeout = timeout
+        self.cache = cache
+        self.rewrite = dict(rewrite or {})
+        self.retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=tuple(status_forcelist),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+
+        if session is None:
+            session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=self.retry,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "User-Agent": "hcc (Hampton Court Canoe Club river conditions)",
+        })
+        if headers:
+            session.headers.update(headers)
+        self.session = session
+
+    def get(self,
+            url: str,
+            params: Optional[Dict[str, Any]] = None,
+            headers: Optional[Dict[str, str]] = None,
+            timeout: Timeout = None,
+            cache: bool = True) -> requests.Response:
+        """Send a GET request and raise for HTTP error status codes
+
+        :param url: the URL to request
+        :param params: query parameters; entries that are `None` are dropped
+        :param headers: extra headers for this request only
+        :param timeout: override the default timeout for this request
+        :param cache: use the response cache; pass False for requests that
+            won't be repeated, such as readings `since` a moving time
+        """
+        url = self.resolve(url)
+        if params is not None:
+            params = {k: v for k, v in params.items() if v is not None}
+        if timeout is None:
+            timeout = self.timeout
+
+        store = self.cache if cache else None
+        entry = None
+        if store is not None:
+            cache_url = requests.Request("GET", url, params=params).prepare().url
+            vary = self._credentials(headers)
+            entry = store.get(cache_url, vary)
+            if entry is not None:
+                if entry.fresh():
+                    instrument.record_http(cache_url, "cached", 0, 0.0)
+                    return entry.response()
+                headers = {**entry.validators(), **(headers or {})}
+
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, headers=headers,
+                                        timeout=timeout)
+        except requests.RequestException as e:
+            instrument.record_http(url, None, 0, time.perf_counter() - start, error=repr(e))
+            raise
+        if instrument.is_enabled():
+            # Bytes on the wire: the compressed length when the body was gzipped
+            nbytes = int(response.headers.get("Content-Length") or len(response.content))
+            instrument.record_http(response.url, response.status_code, nbytes,
+                                   time.perf_counter() - start)
+
+        if store is not None:
+            if response.status_code == 304 and entry is not None:
+                store.refresh(entry, response)
+                return entry.response()
+            store.put(cache_url, response, vary)
+        response.raise_for_status()
+        return response
+
+    def stream(self,
+               url: str,
+               params: Optional[Dict[str, Any]] = None,
+               timeout: Timeout = None) -> requests.Response:
+        """Send a GET request for a large body that is read incrementally
+
+        The response cache is bypassed. Read the decoded body from
+        `response.raw` or `iter_content`, and close the response when done.
+        """
+        url = self.resolve(url)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, stream=True,
+                                        timeout=self.timeout if timeout is None else timeout)
+        except requests.RequestException as e:
+            instrument.record_http(url, None, 0, time.perf_counter() - start, error=repr(e))
+            raise
+        instrument.record_http(response.url, response.status_code,
+                               int(response.headers.get("Content-Length") or 0),
+                               time.perf_counter() - start)
+        if not response.ok:
+            response.close()
+        response.raise_for_status()
+        # Let readers of `raw` see the body with any gzip encoding removed
+        response.raw.decode_content = True
+        return response
+
+    def _credentials(self, headers: Optional[Dict[str, str]]) -> Dict[str, str]:
+        """The credential headers a request is sent with, from the session and `headers`"""
+        merged = {**self.session.headers, **(headers or {})}
+        return {k.lower(): v for k, v in merged.items() if k.lower() in CREDENTIAL_HEADERS}
+
+    def resolve(self, url: str) -> str:
+        """Apply the `rewrite` prefixes to a URL"""
+        for prefix, replacement in self.rewrite.items():
+            if url.startswith(prefix):
+                return replacement + url[len(prefix):]
+        return url
+
+    def get_json(self, url: str, **kwargs) -> Any:
+        """Send a GET request and decode the JSON body"""
+        return self.get(url, **kwargs).json()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_transport: Optional[Transport] = None
+
+
+def get_transport() -> Transport:
+    """Return the module-level transport, creating it on first use
+
+    The default transport caches responses on disk unless `HCC_HTTP_CACHE=0`.
+    """
+    global _transport
+    if _transport is None:
+        _transport = Transport(cache=default_http_cache())
+    return _transport
+
+
+def set_transport(transport: Optional[Transport]) -> Optional[Transport]:
+    """Replace the module-level transport
+
+    Use this to inject a transport with different timeouts or retry policy, or
+    one that rewrites URLs to a local stand-in server. Passing `None` resets
+    to a fresh default transport on next use.
+
+    :return: the previous transport
+    """
+    global _transport
+    previous = _transport
+    _transport = transport
+    return previous
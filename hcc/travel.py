@@ -0,0 +1,230 @@
+"""
+Travel times of rises in flow or level between stations on a river.
+
+A rise at Walton reaches the club some hours later. `lag_matrix` estimates
+the lag between every pair of stations in an aligned panel from the peak of
+their cross-correlation, computed with FFTs for all pairs at once, so a
+hundred stations with months of 15 minute readings take seconds.
+`travel_times` builds the panel for every station on a river, ordered from
+upstream to downstream, and caches the result for each time window.
+
+    hcc.travel_times("River Thames", parameter = "flow", days = 28).lag
+"""
+
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+import hcc.ea_rivers as ea_rivers
+from hcc.align import align
+from hcc.cache import ttl_cache
+
+DEFAULT_DAYS = 28
+
+# Longest lag looked for between two stations
+DEFAULT_MAX_LAG = "2D"
+
+# Share of the readings two series must have in common at a lag
+MIN_OVERLAP = 0.5
+
+# Seconds the result for a window is kept
+TRAVEL_TTL = 3600
+
+
+class TravelTimes(NamedTuple):
+    """Pairwise lag and correlation between stations
+
+    `lag.loc[a, b]` is how many hours changes at `a` take to show at `b`,
+    negative when `b` changes first, and `correlation.loc[a, b]` is the
+    correlation of the two series at that lag. Rows and columns are in
+    upstream to downstream order.
+    """
+    lag: pd.DataFrame
+    correlation: pd.DataFrame
+
+
+def _standardise(x: np.ndarray):
+    """Columns scaled to mean 0 and variance 1, with missing values as 0, and the mask of valid values"""
+    valid = ~np.isnan(x)
+    count = np.maximum(valid.sum(axis = 0), 1)
+    mean = np.where(valid, x, 0).sum(axis = 0) / count
+    centred = np.where(valid, x - mean, 0.0)
+    std = np.sqrt((centred ** 2).sum(axis = 0) / count)
+    std[std == 0] = np.nan
+    return centred / std, valid.astype(np.float64)
+
+
+def lag_matrix(panel: pd.DataFrame,
+               max_lag = DEFAULT_MAX_LAG,
+               difference: bool = True,
+               min_overlap: float = MIN_OVERLAP) -> TravelTimes:
+    """Lag and correlation of every pair of columns of an aligned panel
+
+    Each pair's cross-correlation at every lag up to `max_lag` comes from one
+    inverse FFT of the product of their spectra, normalised by the number of
+    readings the two have in common at that lag (also from FFTs), so gaps
+    don't bias the estimate. The peak is refined between grid steps with a
+    parabola through its neighbours. Pairs whose correlation peaks at
+    `max_lag` or beyond, or that overlap too little, get NaN.
+
+    :param panel: a wide frame on a regular time grid, such as
+        `get_thames_panel` returns; columns in upstream to downstream order
+    :param max_lag: longest lag to look for, as a duration
+    :param difference: correlate the changes between readings rather than
+        the readings, so slow trends don't swamp the timing of rises
+    :param min_overlap: share of the series two stations must have in common
+        at a lag for it to count
+    :return: `TravelTimes` with lags in hours
+    """
+    names = list(panel.columns)
+    if len(panel.index) < 2:
+        empty = pd.DataFrame(np.nan, index = names, columns = names)
+        return TravelTimes(empty, empty.copy())
+    step = (panel.index[1] - panel.index[0]) / pd.Timedelta(hours = 1)
+    x = panel.to_numpy(dtype = np.float64)
+    if difference:
+        x = np.diff(x, axis = 0)
+    n, k = x.shape
+    max_steps = int(min(pd.Timedelta(max_lag) / (panel.index[1] - panel.index[0]), n - 1))
+
+    z, valid = _standardise(x)
+    # Padding to at least n + max_steps keeps the lags we read from wrapping round
+    nfft = 1 << int(np.ceil(np.log2(n + max_steps)))
+    fz = np.fft.rfft(z, nfft, axis = 0)
+    fv = np.fft.rfft(valid, nfft, axis = 0)
+    lags = np.arange(-max_steps, max_steps + 1)
+    rows = lags % nfft
+    min_count = max(min_overlap * n, 2)
+
+    lag = np.full((k, k), np.nan)
+    corr = np.full((k, k), np.nan)
+    for i in range(k):
+        # Correlation of column i with every later column j at each lag τ:
+        # sum over t of z_i(t) z_j(t + τ)
+        products = np.fft.irfft(np.conj(fz[:, i:i + 1]) * fz[:, i:], nfft, axis = 0)[rows]
+        counts = np.fft.irfft(np.conj(fv[:, i:i + 1]) * fv[:, i:], nfft, axis = 0)[rows]
+        counts = np.round(counts)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            r = np.where(counts >= min_count, products / counts, np.nan)
+        found = ~np.all(np.isnan(r), axis = 0)
+        if not found.any():
+            continue
+        cols = np.flatnonzero(found)
+        best = np.nanargmax(r[:, cols], axis = 0)
+        peak = r[best, cols]
+
+        # A peak at the end of the range is a lag longer than `max_lag`
+        inner = (best > 0) & (best < len(lags) - 1)
+        cols, best, peak = cols[inner], best[inner], peak[inner]
+
+        # Parabolic interpolation of the peak between its neighbours
+        below = r[best - 1, cols]
+        above = r[best + 1, cols]
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            curve = below - 2 * peak + above
+            shift = np.where(curve < 0, 0.5 * (below - above) / curve, 0.0)
+        shift = np.nan_to_num(np.clip(shift, -0.5, 0.5))
+
+        j = i + cols
+        lag[i, j] = (lags[best] + shift) * step
+        lag[j, i] = -lag[i, j]
+        corr[i, j] = corr[j, i] = np.minimum(peak, 1.0)
+    # Rather than -0 from mirroring
+    lag[np.diag_indices(k)] = np.where(np.isnan(np.diag(lag)), np.nan, 0.0)
+
+    return TravelTimes(pd.DataFrame(lag, index = names, columns = names),
+                       pd.DataFrame(corr, index = names, columns = names))
+
+
+def upstream_order(records: Iterable, downstream: str = "east") -> List:
+    """Station records sorted from upstream to downstream
+
+    The EA catalog doesn't give stations' positions along a river, so they
+    are ordered by the direction the river flows overall. The Thames and
+    its tideway flow east.
+
+    :param records: `StationRecord`s
+    :param downstream: compass direction the river flows: "east", "west",
+        "north" or "south"
+    """
+    key = {"east": lambda r: r.long, "west": lambda r: -r.long,
+           "north": lambda r: r.lat, "south": lambda r: -r.lat}
+    if downstream not in key:
+        raise ValueError("downstream must be one of 'east', 'west', 'north' or 'south'")
+    return sorted((r for r in records if pd.notna(r.lat) and pd.notna(r.long)), key = key[downstream])
+
+
+def _river_series(river_name: str, parameter: str, downstream: str):
+    """(column name, measure id) of each station measuring `parameter`, upstream first"""
+    import hcc.core as core
+
+    records = upstream_order(core.get_station_index(river_name).records, downstream)
+    series = []
+    labels = [r.label for r in records]
+    for record in records:
+        ids = [m for m in record.measures if f"-{parameter}-" in m]
+        if ids:
+            name = record.label if labels.count(record.label) == 1 else f"{record.label} ({record.notation})"
+            series.append((name, ids[0]))
+    return series
+
+
+@ttl_cache(ttl = TRAVEL_TTL, maxsize = 16)
+def _travel_times(river_name, parameter, start, end, freq, max_lag, downstream, archive, max_workers):
+    series = _river_series(river_name, parameter, downstream)
+    if archive is not None:
+        # The archive's end is exclusive
+        readings = archive.read([m for _, m in series], start = start, end = end + pd.Timedelta(freq))
+        keys = readings["measure"].astype(str).map(ea_rivers.measure_key)
+        groups = {key: group for key, group in readings.groupby(keys, sort = False)}
+        frames = {name: groups.get(ea_rivers.measure_key(m)) for name, m in series}
+    else:
+        def fetch(measure):
+            try:
+                return ea_rivers.get_readings_range(measure, startdate = start.date(), enddate = end.date())
+            except Exception as e:
+                warnings.warn(f"Readings for {measure} failed: {e!r}")
+                return None
+
+        with ThreadPoolExecutor(max_workers = max_workers) as pool:
+            frames = dict(zip([name for name, _ in series], pool.map(fetch, [m for _, m in series])))
+
+    panel = align(frames, freq = freq, start = start, end = end, fill = "interpolate", limit = "1h")
+    return lag_matrix(panel, max_lag = max_lag)
+
+
+def travel_times(river_name: str = "River Thames",
+                 parameter: str = "flow",
+                 since = None,
+                 until = None,
+                 days: int = DEFAULT_DAYS,
+                 freq = "15min",
+                 max_lag = DEFAULT_MAX_LAG,
+                 downstream: str = "east",
+                 archive = None,
+                 max_workers: int = 8) -> TravelTimes:
+    """Lag and correlation between every pair of stations on a river
+
+    Results are cached for each window, which is rounded to `freq`, so
+    repeated calls within the same 15 minutes reuse them.
+
+    :param river_name: river whose stations are compared
+    :param parameter: "flow" or "level"
+    :param since: start of the window, by default `days` before `until`
+    :param until: end of the window, by default now
+    :param days: length of the window when `since` isn't given
+    :param freq: grid the readings are aligned to
+    :param max_lag: longest lag to look for
+    :param downstream: compass direction the river flows, for the station order
+    :param archive: an `hcc.archive.Archive` to read the readings from
+        instead of the API, for windows older than the API keeps
+    :param max_workers: concurrent requests when fetching from the API
+    :return: `TravelTimes` with lags in hours, stations upstream first
+    """
+    end = (ea_rivers.utc_timestamp(until) if until is not None else pd.Timestamp.now(tz = "UTC")).floor(freq)
+    start = ea_rivers.utc_timestamp(since).ceil(freq) if since is not None else end - pd.Timedelta(days = days)
+    return _travel_times(river_name, parameter, start, end, freq, str(pd.Timedelta(max_lag)),
+                         downstream, archive, max_workers)